@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the serialization and model hot paths that run on every request.
+
+Covers prepare_for_mongo / parse_from_mongo, Cart(**parsed), cart.dict(),
+calculate_cart_totals and BookingConfirmation(**...) over carts of 1-20
+items, plus the waiver codec over 1-15 guests with signature images.
+Records ops/sec and allocated KiB per op, and compares against a stored
+baseline so codec and model changes are judged on numbers.
+
+    python benchmarks.py                       # run and compare against benchmarks_baseline.json
+    python benchmarks.py --save-baseline       # record a new baseline on this machine
+    python benchmarks.py --filter cart --threshold 0.15
+
+Exits 1 when any benchmark is slower or allocates more than the threshold
+allows. Baselines are machine-specific: record them on the machine (or CI
+runner class) that will run the comparison.
+"""
+
+import argparse
+import base64
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+BACKEND_DIR = Path(__file__).parent
+DEFAULT_BASELINE = BACKEND_DIR / "benchmarks_baseline.json"
+
+CART_SIZES = (1, 5, 10, 20)
+WAIVER_SIZES = (1, 5, 10, 15)
+
+# Importing server.py needs these set; nothing connects during the benchmarks
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "egf_benchmarks")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+
+def make_cart(items: int, rng: random.Random) -> "server.Cart":
+    services = list(server.SERVICES)
+    return server.Cart(
+        items=[
+            server.CartItem(
+                service_id=rng.choice(services),
+                quantity=rng.randint(1, 6),
+                booking_date=date(2025, 6, 1) + timedelta(days=rng.randint(0, 90)),
+                booking_time=dt_time(rng.randint(8, 19), 0),
+                special_requests=rng.choice([None, "Birthday group, please add a cooler"])
+            )
+            for _ in range(items)
+        ],
+        customer_name="Bench Mark",
+        customer_email="bench@example.com",
+        customer_phone="850-555-0100"
+    )
+
+
+def make_signature(rng: random.Random) -> str:
+    # A canvas signature PNG is typically 8-25 KB
+    return "data:image/png;base64," + base64.b64encode(rng.randbytes(rng.randint(8_000, 25_000))).decode()
+
+
+def make_waiver(guests: int, rng: random.Random) -> "server.Waiver":
+    return server.Waiver(
+        cart_id="bench-cart",
+        waiver_data=server.WaiverData(
+            emergency_contact_name="Emergency Contact",
+            emergency_contact_phone="850-555-0199",
+            emergency_contact_relationship="Spouse"
+        ),
+        guests=[
+            server.WaiverGuest(
+                id=index + 1,
+                name=f"Guest {index + 1}",
+                date=date(2025, 6, 1),
+                isMinor=index % 4 == 3,
+                guardianName="Guardian" if index % 4 == 3 else None,
+                guardianSignature=make_signature(rng) if index % 4 == 3 else None,
+                participantSignature=make_signature(rng)
+            )
+            for index in range(guests)
+        ],
+        signed_at=datetime(2025, 6, 1, 10, 0, tzinfo=timezone.utc),
+        total_guests=guests
+    )
+
+
+def make_booking_document(cart: "server.Cart") -> Dict[str, Any]:
+    cart_items, total_amount = server.calculate_cart_totals(cart)
+    for item in cart_items:
+        item["booking_date"] = item["booking_date"].isoformat()
+        item["booking_time"] = item["booking_time"].strftime('%H:%M:%S')
+    booking = server.BookingConfirmation(
+        cart_id=cart.id,
+        customer_name=cart.customer_name,
+        customer_email=cart.customer_email,
+        items=cart_items,
+        total_amount=total_amount,
+        payment_method="stripe",
+        booking_reference="EGF20250601ABCDEF"
+    )
+    return server.prepare_for_mongo(booking.dict())
+
+
+def build_benchmarks() -> Dict[str, Callable[[], Any]]:
+    """Name -> zero-argument callable; inputs are prepared up front so only the hot path is timed"""
+    rng = random.Random(42)
+    benchmarks: Dict[str, Callable[[], Any]] = {}
+
+    for size in CART_SIZES:
+        cart = make_cart(size, rng)
+        cart_dict = cart.dict()
+        stored_cart = server.prepare_for_mongo(copy.deepcopy(cart_dict))
+        parsed_cart = server.parse_from_mongo(copy.deepcopy(stored_cart))
+        booking_document = make_booking_document(cart)
+
+        # The codecs mutate in place, so each op works on a fresh shallow structure
+        benchmarks[f"cart[{size}].prepare_for_mongo"] = (
+            lambda d=cart_dict: server.prepare_for_mongo({**d, "items": [dict(i) for i in d["items"]]})
+        )
+        benchmarks[f"cart[{size}].parse_from_mongo"] = (
+            lambda d=stored_cart: server.parse_from_mongo({**d, "items": [dict(i) for i in d["items"]]})
+        )
+        benchmarks[f"cart[{size}].Cart(**parsed)"] = lambda d=parsed_cart: server.Cart(**d)
+        benchmarks[f"cart[{size}].cart.dict()"] = lambda c=cart: c.dict()
+        benchmarks[f"cart[{size}].calculate_cart_totals"] = lambda c=cart: server.calculate_cart_totals(c)
+        benchmarks[f"cart[{size}].BookingConfirmation(**parsed)"] = (
+            lambda d=booking_document: server.BookingConfirmation(**server.parse_from_mongo({**d, "items": [dict(i) for i in d["items"]]}))
+        )
+
+    for size in WAIVER_SIZES:
+        waiver = make_waiver(size, rng)
+        waiver_dict = waiver.dict()
+        stored_waiver = server.prepare_for_mongo(copy.deepcopy(waiver_dict))
+
+        benchmarks[f"waiver[{size}].prepare_for_mongo"] = (
+            lambda d=waiver_dict: server.prepare_for_mongo({**d, "guests": [dict(g) for g in d["guests"]]})
+        )
+        benchmarks[f"waiver[{size}].parse_from_mongo"] = (
+            lambda d=stored_waiver: server.parse_from_mongo({**d, "guests": [dict(g) for g in d["guests"]]})
+        )
+        benchmarks[f"waiver[{size}].Waiver(**parsed)"] = (
+            lambda d=stored_waiver: server.Waiver(**server.parse_from_mongo({**d, "guests": [dict(g) for g in d["guests"]]}))
+        )
+        benchmarks[f"waiver[{size}].waiver.dict()"] = lambda w=waiver: w.dict()
+
+    return benchmarks
+
+
+def measure_ops_per_sec(func: Callable[[], Any], min_time: float, repeats: int) -> float:
+    """Best-of-N throughput, with the loop count calibrated so each repeat runs at least min_time"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed < min_time / 10 else max(2, int(min_time / max(elapsed, 1e-9)))
+
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return loops / best
+
+
+def measure_allocations(func: Callable[[], Any], samples: int = 20) -> float:
+    """Average KiB allocated per op (tracemalloc peak above the starting point)"""
+    func()  # warm caches so one-time allocations aren't charged to the op
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - current
+    finally:
+        tracemalloc.stop()
+    return total / samples / 1024
+
+
+def machine_info() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "pydantic": getattr(sys.modules.get("pydantic"), "VERSION", "unknown")
+    }
+
+
+def run_benchmarks(name_filter: str, min_time: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, func in build_benchmarks().items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = {
+            "ops_per_sec": round(measure_ops_per_sec(func, min_time, repeats), 1),
+            "alloc_kib_per_op": round(measure_allocations(func), 2)
+        }
+        print(f"{name:<48}{results[name]['ops_per_sec']:>14,.1f} ops/s{results[name]['alloc_kib_per_op']:>12.2f} KiB/op")
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float,
+            alloc_threshold: float) -> List[Tuple[str, str]]:
+    """Return (benchmark, reason) for every regression beyond the thresholds"""
+    regressions = []
+    baseline_results = baseline.get("results", {})
+    print(f"\n{'benchmark':<48}{'ops/s Δ':>10}{'KiB/op Δ':>12}")
+    for name, current in results.items():
+        previous = baseline_results.get(name)
+        if not previous:
+            print(f"{name:<48}{'new':>10}{'new':>12}")
+            continue
+        speed_change = current["ops_per_sec"] / previous["ops_per_sec"] - 1
+        alloc_change = (
+            current["alloc_kib_per_op"] / previous["alloc_kib_per_op"] - 1
+            if previous["alloc_kib_per_op"] else 0.0
+        )
+        flag = ""
+        if speed_change < -threshold:
+            regressions.append((name, f"ops/sec down {-speed_change:.1%}"))
+            flag = "  <-- slower"
+        # Ignore noise on tiny allocations
+        if alloc_change > alloc_threshold and current["alloc_kib_per_op"] - previous["alloc_kib_per_op"] > 0.5:
+            regressions.append((name, f"allocations up {alloc_change:.1%}"))
+            flag += "  <-- allocates more"
+        print(f"{name:<48}{speed_change:>+10.1%}{alloc_change:>+12.1%}{flag}")
+    return regressions
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serialization/model microbenchmarks with regression thresholds")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Allowed ops/sec drop (fraction, default 0.20)")
+    parser.add_argument("--alloc-threshold", type=float, default=0.25, help="Allowed allocation growth (fraction, default 0.25)")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timing repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Also write the results JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    results = run_benchmarks(options.filter, options.min_time, options.repeats)
+    report = {
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "machine": machine_info(),
+        "results": results
+    }
+
+    if options.output:
+        options.output.write_text(json.dumps(report, indent=2))
+
+    if options.save_baseline:
+        if options.filter and options.baseline.exists():
+            # Merge so a filtered run doesn't drop the other baselines
+            existing = json.loads(options.baseline.read_text())
+            existing["results"].update(results)
+            existing.update(recorded_at=report["recorded_at"], machine=report["machine"])
+            report = existing
+        options.baseline.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline written to {options.baseline}")
+        return 0
+
+    if not options.baseline.exists():
+        print(f"\nNo baseline at {options.baseline}; run with --save-baseline first")
+        return 0
+
+    baseline = json.loads(options.baseline.read_text())
+    if baseline.get("machine") != report["machine"]:
+        print(f"\nWarning: baseline was recorded on {baseline.get('machine')}, this is {report['machine']}")
+
+    regressions = compare(results, baseline, options.threshold, options.alloc_threshold)
+    if regressions:
+        print("\nRegressions:")
+        for name, reason in regressions:
+            print(f"  {name}: {reason}")
+        return 1
+    print("\nNo regressions beyond thresholds")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SLOT_LOCKS_COLLECTION = "capacity_slot_locks"
+
+# (service_id, booking date, booking time) - one bookable slot
+Slot = Tuple[str, str, str]
+
+
+def slot_key(service_id: str, booking_date, booking_time) -> Slot:
+    if isinstance(booking_date, date):
+        booking_date = booking_date.isoformat()
+    if isinstance(booking_time, time):
+        booking_time = booking_time.strftime('%H:%M:%S')
+    return (service_id, booking_date, booking_time)
+
+
+class SlotBusy(RuntimeError):
+    """Another checkout held a slot for longer than we were willing to wait"""
+
+
+async def ensure_capacity_indexes(db):
+    # booked_quantities narrows bookings by service and date before unwinding items
+    await db.bookings.create_index([("items.service_id", 1), ("items.booking_date", 1)])
+
+
+def load_capacities(raw: Optional[str]) -> Dict[str, int]:
+    """Parse SERVICE_CAPACITY, a JSON object of units available per slot, e.g. {"crystal_kayak": 4}
+
+    Services without an entry are unlimited.
+    """
+    if not raw:
+        return {}
+    try:
+        capacities = json.loads(raw)
+        return {service_id: int(units) for service_id, units in capacities.items()}
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.error(f"Invalid SERVICE_CAPACITY, capacity checks disabled: {str(e)}")
+        return {}
+
+
+def _held_pending(now: datetime, pending_hold: timedelta, pending_hold_for_method: Dict[str, timedelta]) -> List[dict]:
+    """Match pending bookings still holding their units, each payment method for its own age"""
+    held = [{
+        "status": "pending",
+        "payment_method": {"$nin": list(pending_hold_for_method)},
+        "created_at": {"$gte": (now - pending_hold).isoformat()}
+    }]
+    held += [
+        {"status": "pending", "payment_method": method, "created_at": {"$gte": (now - hold).isoformat()}}
+        for method, hold in pending_hold_for_method.items()
+    ]
+    return held
+
+
+async def booked_quantities(db, slots: Iterable[Slot], pending_hold: timedelta,
+                            pending_hold_for_method: Optional[Dict[str, timedelta]] = None) -> Dict[Slot, int]:
+    """Units already taken per slot by confirmed bookings and pending ones still within their hold
+
+    Payment methods in `pending_hold_for_method` hold for their own age instead of
+    `pending_hold`, e.g. Venmo/Zelle bookings that are paid days after checkout.
+    """
+    slots = set(slots)
+    if not slots:
+        return {}
+    now = datetime.now(timezone.utc)
+    pipeline = [
+        {"$match": {
+            "items.service_id": {"$in": sorted({slot[0] for slot in slots})},
+            "items.booking_date": {"$in": sorted({slot[1] for slot in slots})},
+            "$or": [{"status": "confirmed"}] + _held_pending(now, pending_hold, pending_hold_for_method or {})
+        }},
+        {"$unwind": "$items"},
+        {"$match": {"$or": [
+            {"items.service_id": service_id, "items.booking_date": booking_date, "items.booking_time": booking_time}
+            for service_id, booking_date, booking_time in slots
+        ]}},
+        {"$group": {
+            "_id": {"service_id": "$items.service_id", "date": "$items.booking_date", "time": "$items.booking_time"},
+            "quantity": {"$sum": "$items.quantity"}
+        }}
+    ]
+    booked = {}
+    async for row in db.bookings.aggregate(pipeline):
+        booked[(row["_id"]["service_id"], row["_id"]["date"], row["_id"]["time"])] = row["quantity"]
+    return booked
+
+
+async def check_capacity(db, capacities: Dict[str, int], requested: Dict[Slot, int], pending_hold: timedelta,
+                         pending_hold_for_method: Optional[Dict[str, timedelta]] = None) -> List[dict]:
+    """Slots where the requested units don't fit next to existing bookings; empty if everything fits"""
+    limited = {slot: quantity for slot, quantity in requested.items() if slot[0] in capacities}
+    if not limited:
+        return []
+    booked = await booked_quantities(db, limited, pending_hold, pending_hold_for_method)
+    problems = []
+    for slot, quantity in limited.items():
+        available = capacities[slot[0]] - booked.get(slot, 0)
+        if quantity > available:
+            problems.append({
+                "service_id": slot[0],
+                "booking_date": slot[1],
+                "booking_time": slot[2],
+                "requested": quantity,
+                "available": max(available, 0)
+            })
+    return problems
+
+
+def requested_quantities(items) -> Dict[Slot, int]:
+    """Total units per slot across cart items"""
+    totals: Dict[Slot, int] = defaultdict(int)
+    for item in items:
+        totals[slot_key(item.service_id, item.booking_date, item.booking_time)] += item.quantity
+    return dict(totals)
+
+
+async def _acquire_slot(db, key: str, owner: str, lease: timedelta, deadline: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            # A lock left behind by a crashed worker is taken over once its lease runs out
+            await db[SLOT_LOCKS_COLLECTION].update_one(
+                {"_id": key, "lease_until": {"$lt": now.isoformat()}},
+                {"$set": {"owner": owner, "lease_until": (now + lease).isoformat()}},
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            if loop.time() >= deadline:
+                raise SlotBusy(key)
+            await asyncio.sleep(0.05)
+
+
+@asynccontextmanager
+async def hold_slots(db, slots: Iterable[Slot], lease: timedelta = timedelta(seconds=30), wait: float = 5.0):
+    """Hold slots exclusively across workers while capacity is re-checked and the booking written
+
+    Locks are taken in sorted order so two checkouts sharing slots can't deadlock.
+    Raises SlotBusy if a slot stays held for more than `wait` seconds.
+    """
+    owner = uuid.uuid4().hex
+    deadline = asyncio.get_running_loop().time() + wait
+    acquired: List[str] = []
+    try:
+        for key in sorted({"|".join(slot) for slot in slots}):
+            await _acquire_slot(db, key, owner, lease, deadline)
+            acquired.append(key)
+        yield
+    finally:
+        if acquired:
+            await db[SLOT_LOCKS_COLLECTION].delete_many({"_id": {"$in": acquired}, "owner": owner})
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import CART_STORE_DIRTY, CART_STORE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class MongoCartStore:
+    """Carts read from and written straight to the carts collection"""
+
+    def __init__(self, get_collection: Callable, to_document: Callable, from_document: Callable):
+        self.get_collection = get_collection
+        self.to_document = to_document
+        self.from_document = from_document
+
+    async def get(self, cart_id: str):
+        cart_data = await self.get_collection().find_one({"id": cart_id})
+        CART_STORE_LOOKUPS.labels("mongo", "hit" if cart_data else "miss").inc()
+        return self.from_document(cart_data) if cart_data else None
+
+    async def save(self, cart, expected_version: Optional[int] = None) -> bool:
+        """Write the cart (upserting on first save); False if expected_version no longer matches"""
+        cart_dict = self.to_document(cart)
+        query: Dict[str, Any] = {"id": cart.id}
+        if expected_version is not None:
+            # Carts written before versioning have no version field
+            query["version"] = expected_version if expected_version else {"$in": [0, None]}
+        try:
+            await self.get_collection().replace_one(query, cart_dict, upsert=True)
+        except DuplicateKeyError:
+            if expected_version is not None:
+                return False
+            # Two first-adds raced; the other one created the document
+            await self.get_collection().replace_one({"id": cart.id}, cart_dict)
+        return True
+
+    async def delete(self, cart_id: str):
+        await self.get_collection().delete_one({"id": cart_id})
+
+    @property
+    def pending_writes(self) -> int:
+        return 0
+
+    async def close(self):
+        pass
+
+
+class TieredCartStore:
+    """In-process LRU of carts in front of Mongo, with write-behind
+
+    Reads are served from memory once a cart has been seen; writes land in memory
+    and are flushed to Mongo within max_lag seconds (and on shutdown). Only safe
+    when every request for a cart reaches the same worker: a single worker, or a
+    load balancer with cart affinity.
+    """
+
+    def __init__(self, durable: MongoCartStore, capacity: int = 10000, max_lag: float = 2.0, max_dirty: int = 500):
+        self.durable = durable
+        self.capacity = capacity
+        self.max_lag = max_lag
+        self.max_dirty = max_dirty
+        self._carts: "OrderedDict[str, Any]" = OrderedDict()
+        # Ids known to have no document yet (cart ids are issued before anything is stored)
+        self._absent: "OrderedDict[str, None]" = OrderedDict()
+        self._dirty: Dict[str, float] = {}
+        self._wake = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def get(self, cart_id: str):
+        cart = self._carts.get(cart_id)
+        if cart is not None:
+            self._carts.move_to_end(cart_id)
+            CART_STORE_LOOKUPS.labels("memory", "hit").inc()
+            return cart.copy(deep=True)
+        if cart_id in self._absent:
+            CART_STORE_LOOKUPS.labels("memory", "absent").inc()
+            return None
+        cart = await self.durable.get(cart_id)
+        if cart is not None:
+            await self._remember(cart)
+            return cart.copy(deep=True)
+        self._absent[cart_id] = None
+        if len(self._absent) > self.capacity:
+            self._absent.popitem(last=False)
+        return None
+
+    async def save(self, cart, expected_version: Optional[int] = None) -> bool:
+        cached = self._carts.get(cart.id)
+        if expected_version is not None:
+            if cached is None:
+                # Nothing to compare against in memory; let Mongo decide
+                if not await self.durable.save(cart, expected_version):
+                    return False
+                await self._remember(cart.copy(deep=True))
+                return True
+            if cached.version != expected_version:
+                return False
+
+        await self._remember(cart.copy(deep=True))
+        self._dirty.setdefault(cart.id, time.monotonic())
+        CART_STORE_DIRTY.set(len(self._dirty))
+        if len(self._dirty) >= self.max_dirty:
+            self._wake.set()
+        return True
+
+    async def delete(self, cart_id: str):
+        self._carts.pop(cart_id, None)
+        self._dirty.pop(cart_id, None)
+        self._absent.pop(cart_id, None)
+        await self.durable.delete(cart_id)
+
+    @property
+    def pending_writes(self) -> int:
+        """Carts saved in memory but not yet flushed to Mongo"""
+        return len(self._dirty)
+
+    async def _remember(self, cart):
+        self._absent.pop(cart.id, None)
+        self._carts[cart.id] = cart
+        self._carts.move_to_end(cart.id)
+        while len(self._carts) > self.capacity:
+            evicted_id, evicted = self._carts.popitem(last=False)
+            if self._dirty.pop(evicted_id, None) is not None:
+                # Never drop an unflushed write
+                await self._write(evicted)
+
+    async def _write(self, cart):
+        try:
+            await self.durable.save(cart)
+        except Exception as e:
+            logger.error(f"Failed to flush cart {cart.id}: {str(e)}")
+            self._dirty.setdefault(cart.id, time.monotonic())
+            self._carts.setdefault(cart.id, cart)
+
+    async def flush(self):
+        """Write every dirty cart to Mongo"""
+        dirty_ids = list(self._dirty)
+        self._dirty.clear()
+        for cart_id in dirty_ids:
+            cart = self._carts.get(cart_id)
+            if cart is not None:
+                await self._write(cart.copy(deep=True))
+        CART_STORE_DIRTY.set(len(self._dirty))
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.max_lag)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Cart write-behind flush failed: {str(e)}")
+
+    async def close(self):
+        """Stop the flusher and write out anything still pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCartToken(ValueError):
+    pass
+
+
+class CartTokenSigner:
+    """Issues cart ids of the form <uuid>.<expiry>.<signature>
+
+    The id is handed to the browser at /api/cart/create without writing anything;
+    the cart document is only created on the first add. The signature proves the
+    server issued the id and carries its expiry, so an expired cart is rejected
+    and a new one served without asking Mongo. The secret has to be shared by
+    every worker; an id that fails to verify is only honoured if its cart was saved.
+    """
+
+    def __init__(self, secret: Optional[str]):
+        if not secret:
+            logger.warning("CART_TOKEN_SECRET not set; cart ids issued by this worker won't verify after a restart")
+            secret = secrets.token_hex(32)
+        self._key = secret.encode()
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self._key, payload.encode(), hashlib.sha256).digest()[:18]
+        return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+    def issue(self, ttl: timedelta) -> Tuple[str, datetime]:
+        expires_at = datetime.now(timezone.utc).replace(microsecond=0) + ttl
+        payload = f"{uuid.uuid4().hex}.{int(expires_at.timestamp())}"
+        return f"{payload}.{self._sign(payload)}", expires_at
+
+    def verify(self, cart_id: str) -> Optional[datetime]:
+        """Expiry of a signed cart id; None for legacy (pre-token) UUID ids"""
+        parts = cart_id.split(".")
+        if len(parts) != 3:
+            try:
+                uuid.UUID(cart_id)
+            except ValueError:
+                raise InvalidCartToken(cart_id) from None
+            return None
+        payload = f"{parts[0]}.{parts[1]}"
+        if not hmac.compare_digest(parts[2], self._sign(payload)):
+            raise InvalidCartToken(cart_id)
+        try:
+            return datetime.fromtimestamp(int(parts[1]), timezone.utc)
+        except ValueError:
+            raise InvalidCartToken(cart_id) from None
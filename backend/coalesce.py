@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import inspect
+import time
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Tuple
+
+from metrics import COALESCED_REQUESTS
+
+_KEY_TYPES = (str, int, float, bool, date, datetime, type(None))
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and hands its result to every concurrent caller
+
+    With ttl > 0 the result is also reused for that many seconds after it finishes.
+    Errors are shared with the callers that were waiting but never cached.
+    invalidate() starts a new generation for the key: callers after it get a fresh
+    computation, never one that started (or was cached) before it.
+    """
+
+    def __init__(self, max_cached: int = 10_000):
+        self.max_cached = max_cached
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]], ttl: float = 0, label: str = "") -> Any:
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                COALESCED_REQUESTS.labels(label, "cached").inc()
+                return cached[1]
+            del self._results[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            COALESCED_REQUESTS.labels(label, "follower").inc()
+        else:
+            COALESCED_REQUESTS.labels(label, "leader").inc()
+            # A separate task, so a disconnecting first caller doesn't cancel it for everyone else
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done, ttl))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task, ttl: float):
+        if self._inflight.get(key) is not task:
+            # Invalidated while running; the result may predate the write, so don't cache it
+            return
+        del self._inflight[key]
+        if ttl > 0 and not task.cancelled() and task.exception() is None:
+            if len(self._results) >= self.max_cached:
+                self._evict_expired()
+            self._results[key] = (time.monotonic() + ttl, task.result())
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._results.items() if expires <= now]:
+            del self._results[key]
+        if len(self._results) >= self.max_cached:
+            self._results.clear()
+
+    def invalidate(self, key: Hashable):
+        """Drop the cached result and detach any running computation so the next call recomputes"""
+        self._results.pop(key, None)
+        # Callers already waiting keep their result; later ones no longer join this flight
+        self._inflight.pop(key, None)
+
+
+single_flight = SingleFlight()
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def coalesce(ttl: float = 0, exclude: Iterable[str] = ()):
+    """Collapse identical concurrent calls of a read endpoint into one
+
+    The key is the endpoint plus its plain (str/int/date/...) arguments; dependency
+    arguments such as db or request are left out automatically. Results must be
+    treated as read-only since every caller gets the same object.
+    """
+    excluded = set(exclude)
+
+    def decorator(endpoint: Callable):
+        signature = inspect.signature(endpoint)
+        label = endpoint.__name__
+
+        def make_key(bound: Dict[str, Any]) -> Tuple:
+            return (label,) + tuple(
+                (name, _normalize(value)) for name, value in sorted(bound.items())
+                if name not in excluded and isinstance(value, _KEY_TYPES)
+            )
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return await single_flight.do(make_key(bound.arguments), lambda: endpoint(*args, **kwargs), ttl=ttl, label=label)
+
+        def invalidate(**params):
+            """Forget the cached or in-flight result for these arguments (e.g. after a write)"""
+            single_flight.invalidate(make_key(params))
+
+        wrapper.invalidate = invalidate
+        return wrapper
+
+    return decorator
@@ -0,0 +1,330 @@
+import asyncio
+import copy
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from bson import Binary
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+COLD_MANIFEST_COLLECTION = "cold_archive_manifest"
+COLD_LOCK_ID = "cold_tiering_lock"
+
+# Collections that can be tiered and the date field their months are cut on
+COLD_COLLECTIONS = {
+    "bookings": "created_at",
+    "waivers": "created_at",
+    "payment_transactions": "created_at",
+}
+
+# Documents are read from Mongo and deleted again this many at a time
+COLD_BATCH_SIZE = 1000
+
+
+async def ensure_cold_indexes(db):
+    for collection, field in COLD_COLLECTIONS.items():
+        await db[collection].create_index([(field, ASCENDING)])
+    await db[COLD_MANIFEST_COLLECTION].create_index([("collection", ASCENDING), ("month", ASCENDING)])
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """'2025-06' -> ISO bounds [2025-06-01, 2025-07-01), comparable with the stored ISO date strings"""
+    year, number = (int(part) for part in month.split("-"))
+    start = date(year, number, 1)
+    end = date(year + (number == 12), number % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def months_before(today: date, hot_months: int) -> str:
+    """First month that stays hot: with hot_months=12 in June 2026, everything before 2025-07 is cold"""
+    index = today.year * 12 + today.month - 1 - (hot_months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class _Codec:
+    def __init__(self, name: str, suffix: str, compress: Callable[[bytes], bytes], open_reader: Callable):
+        self.name = name
+        self.suffix = suffix
+        self.compress = compress
+        self.open_reader = open_reader
+
+
+def load_codec(name: str, level: Optional[int] = None) -> _Codec:
+    """gzip is always available; zstd needs the zstandard package"""
+    if name == "gzip":
+        return _Codec(
+            "gzip", ".ndjson.gz",
+            lambda data: gzip.compress(data, compresslevel=level or 6),
+            lambda raw: gzip.GzipFile(fileobj=raw)
+        )
+    if name == "zstd":
+        zstandard = importlib.import_module("zstandard")
+        return _Codec(
+            "zstd", ".ndjson.zst",
+            lambda data: zstandard.ZstdCompressor(level=level or 10).compress(data),
+            lambda raw: zstandard.ZstdDecompressor().stream_reader(raw)
+        )
+    raise ValueError(f"Unknown archive codec {name}")
+
+
+class BloomFilter:
+    """Membership test for the ids in one archive file, stored in its manifest entry
+
+    Sized for ~1% false positives; lets a lookup by id open only the file(s) that
+    can contain it without keeping an id index in Mongo.
+    """
+
+    HASHES = 7
+
+    def __init__(self, bits: bytearray):
+        self.bits = bits
+
+    @classmethod
+    def for_count(cls, count: int) -> "BloomFilter":
+        return cls(bytearray(max(64, (count * 10 + 7) // 8)))
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        size = len(self.bits) * 8
+        return [(first + i * second) % size for i in range(self.HASHES)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+
+class ColdStore:
+    """Past-season documents in compressed monthly NDJSON files, with a manifest in Mongo
+
+    Each tiering run writes the months older than `hot_months` to
+    <root>/<collection>/<YYYY>/<collection>-<YYYY-MM>-<part><suffix>, records the
+    file (count, checksum, id bloom filter) in the manifest, and only then deletes
+    the documents from Mongo. Archived months are read back on demand with a small
+    LRU of decoded months. The directory must be shared by every worker host.
+    """
+
+    def __init__(self, get_db: Callable, root: Path, codec: _Codec, hot_months: int = 12,
+                 cache_months: int = 4, interval: float = 86400):
+        self.get_db = get_db
+        self.root = Path(root)
+        self.codec = codec
+        self.hot_months = hot_months
+        self.cache_months = cache_months
+        self.interval = interval
+        self._decoded: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tier()
+            except Exception as e:
+                logger.error(f"Cold archive tiering failed: {str(e)}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # Writing
+
+    async def _acquire_lease(self, db, now: datetime) -> bool:
+        try:
+            await db[COLD_MANIFEST_COLLECTION].update_one(
+                {"_id": COLD_LOCK_ID, "lease_until": {"$lt": now.isoformat()}},
+                {"$set": {"lease_until": datetime.fromtimestamp(now.timestamp() + 3600, timezone.utc).isoformat()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _release_lease(self, db):
+        await db[COLD_MANIFEST_COLLECTION].update_one(
+            {"_id": COLD_LOCK_ID}, {"$set": {"lease_until": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def _cold_months(self, db, collection: str, before: str) -> List[str]:
+        """Months before `before` that still have documents in the hot collection, oldest first"""
+        field = COLD_COLLECTIONS[collection]
+        months = []
+        lower, upper = "", month_bounds(before)[0]
+        # One indexed find per month rather than a scan of everything cold
+        while True:
+            oldest = await db[collection].find_one(
+                {field: {"$gte": lower, "$lt": upper}}, {"_id": 0, field: 1}, sort=[(field, ASCENDING)]
+            )
+            if not oldest or not isinstance(oldest.get(field), str):
+                return months
+            months.append(oldest[field][:7])
+            lower = month_bounds(months[-1])[1]
+
+    def _write_file(self, path: Path, documents: List[Dict[str, Any]]) -> Tuple[int, str]:
+        payload = "".join(json.dumps(document, default=str, separators=(",", ":")) + "\n" for document in documents).encode()
+        compressed = self.codec.compress(payload)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as handle:
+            handle.write(compressed)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, path)
+        return len(compressed), hashlib.sha256(compressed).hexdigest()
+
+    async def _delete_archived(self, db, entry: Dict[str, Any]):
+        """Remove a written file's documents from Mongo (also finishes a run that stopped after writing)"""
+        documents = await asyncio.to_thread(self._read_file, self.root / entry["path"])
+        ids = [document["id"] for document in documents]
+        for start in range(0, len(ids), COLD_BATCH_SIZE):
+            await db[entry["collection"]].delete_many({"id": {"$in": ids[start:start + COLD_BATCH_SIZE]}})
+        await db[COLD_MANIFEST_COLLECTION].update_one({"_id": entry["_id"]}, {"$set": {"status": "complete"}})
+
+    async def tier_month(self, collection: str, month: str) -> Optional[Dict[str, Any]]:
+        db = self.get_db()
+        field = COLD_COLLECTIONS[collection]
+        start, end = month_bounds(month)
+        documents = await db[collection].find({field: {"$gte": start, "$lt": end}}, {"_id": 0}).sort(field, ASCENDING).to_list(length=None)
+        if not documents:
+            return None
+
+        # Stragglers that reach an already archived month go to a new part file
+        part = await db[COLD_MANIFEST_COLLECTION].count_documents({"collection": collection, "month": month})
+        relative = Path(collection) / month[:4] / f"{collection}-{month}-{part}{self.codec.suffix}"
+        size, checksum = await asyncio.to_thread(self._write_file, self.root / relative, documents)
+
+        bloom = BloomFilter.for_count(len(documents))
+        for document in documents:
+            bloom.add(document["id"])
+        entry = {
+            "_id": f"{collection}:{month}:{part}",
+            "collection": collection,
+            "month": month,
+            "part": part,
+            "path": str(relative),
+            "codec": self.codec.name,
+            "count": len(documents),
+            "bytes": size,
+            "sha256": checksum,
+            "id_bloom": Binary(bytes(bloom.bits)),
+            "status": "written",
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        await db[COLD_MANIFEST_COLLECTION].insert_one(entry)
+        await self._delete_archived(db, entry)
+        entry["status"] = "complete"
+        logger.info(f"Archived {len(documents)} {collection} from {month} to {relative} ({size} bytes)")
+        return {key: value for key, value in entry.items() if key != "id_bloom"}
+
+    async def tier(self, dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """Archive every month older than the hot window; None if another worker is already at it"""
+        db = self.get_db()
+        now = datetime.now(timezone.utc)
+        before = months_before(now.date(), self.hot_months)
+        if dry_run:
+            return {"dry_run": True, "hot_from": before, "months": {
+                collection: await self._cold_months(db, collection, before) for collection in COLD_COLLECTIONS
+            }}
+        if not await self._acquire_lease(db, now):
+            return None
+        written = []
+        try:
+            unfinished = await db[COLD_MANIFEST_COLLECTION].find({"status": "written"}).to_list(length=None)
+            for entry in unfinished:
+                await self._delete_archived(db, entry)
+            for collection in COLD_COLLECTIONS:
+                for month in await self._cold_months(db, collection, before):
+                    entry = await self.tier_month(collection, month)
+                    if entry:
+                        written.append(entry)
+        finally:
+            await self._release_lease(db)
+        self._decoded.clear()
+        return {"dry_run": False, "hot_from": before, "files": written}
+
+    # Reading
+
+    def _read_file(self, path: Path) -> List[Dict[str, Any]]:
+        codec = load_codec("zstd" if path.name.endswith(".zst") else "gzip")
+        with open(path, "rb") as raw, codec.open_reader(raw) as reader:
+            return [json.loads(line) for line in io.TextIOWrapper(reader, encoding="utf-8") if line.strip()]
+
+    async def _load(self, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        documents = self._decoded.get(entry["path"])
+        if documents is not None:
+            self._decoded.move_to_end(entry["path"])
+            return documents
+        documents = await asyncio.to_thread(self._read_file, self.root / entry["path"])
+        self._decoded[entry["path"]] = documents
+        while len(self._decoded) > self.cache_months:
+            self._decoded.popitem(last=False)
+        return documents
+
+    async def manifest(self, collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"collection": {"$exists": True}}
+        if collection:
+            query["collection"] = collection
+        return await self.get_db()[COLD_MANIFEST_COLLECTION].find(
+            query, {"id_bloom": 0}
+        ).sort([("collection", ASCENDING), ("month", ASCENDING), ("part", ASCENDING)]).to_list(length=None)
+
+    async def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """One archived document by id, opening only the files whose bloom filter may hold it"""
+        entries = await self.get_db()[COLD_MANIFEST_COLLECTION].find(
+            {"collection": collection, "status": "complete"}
+        ).sort("month", -1).to_list(length=None)
+        for entry in entries:
+            if document_id not in BloomFilter(bytearray(entry["id_bloom"])):
+                continue
+            for document in await self._load(entry):
+                if document.get("id") == document_id:
+                    # Callers parse dates in place; keep the cached month untouched
+                    return copy.deepcopy(document)
+        return None
+
+    async def find(self, collection: str, start: Optional[str], end: Optional[str],
+                   match: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Archived documents with the date field in [start, end), optionally equal on some top-level fields
+
+        Months are decoded one at a time, oldest first.
+        """
+        query: Dict[str, Any] = {"collection": collection, "status": "complete"}
+        months: Dict[str, Any] = {}
+        if start:
+            months["$gte"] = start[:7]
+        if end:
+            months["$lte"] = end[:7]
+        if months:
+            query["month"] = months
+        field = COLD_COLLECTIONS[collection]
+        entries = await self.get_db()[COLD_MANIFEST_COLLECTION].find(query, {"id_bloom": 0}).sort("month", ASCENDING).to_list(length=None)
+        for entry in entries:
+            for document in await self._load(entry):
+                value = document.get(field) or ""
+                if (start and value < start) or (end and value >= end):
+                    continue
+                if match and any(document.get(key) != expected for key, expected in match.items()):
+                    continue
+                yield copy.deepcopy(document)
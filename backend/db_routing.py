@@ -0,0 +1,99 @@
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from starlette.requests import Request
+
+from metrics import DB_ROUTED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+READ_ROLES = ("primary", "secondary")
+
+# The driver refuses anything lower
+MIN_MAX_STALENESS_SECONDS = 90
+
+# Admin, report and export reads can lag the primary a little; customer paths
+# (cart, checkout, booking success page, waiver download) always read their own writes
+DEFAULT_READ_ROUTES = {
+    "GET /api/admin/*": "secondary",
+    "GET /api/bookings": "secondary",
+    "GET /api/waivers": "secondary",
+}
+
+
+def parse_read_routes(raw: Optional[str]) -> Dict[str, str]:
+    """DB_READ_ROUTES: JSON object of "METHOD /path/template" (or "METHOD /prefix/*") -> primary|secondary
+
+    Entries are merged over DEFAULT_READ_ROUTES, e.g. {"GET /api/admin/webhooks": "primary"}.
+    """
+    routes = dict(DEFAULT_READ_ROUTES)
+    if not raw:
+        return routes
+    try:
+        overrides = json.loads(raw)
+        for key, role in overrides.items():
+            if role not in READ_ROLES:
+                raise ValueError(f"{key}: role must be one of {READ_ROLES}")
+            routes[key] = role
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Invalid DB_READ_ROUTES, using defaults: {str(e)}")
+        return dict(DEFAULT_READ_ROUTES)
+    return routes
+
+
+class ReadRouter:
+    """Database handles per read role and the rule table that picks one for each route
+
+    Writes always go to the primary whatever handle they use; the role only
+    changes where reads are served. Secondary reads use secondaryPreferred with
+    maxStalenessSeconds, so a lagging secondary is skipped and a set without a
+    healthy secondary falls back to the primary.
+    """
+
+    def __init__(self, database, routes: Dict[str, str], max_staleness: int = MIN_MAX_STALENESS_SECONDS):
+        self.max_staleness = max(max_staleness, MIN_MAX_STALENESS_SECONDS)
+        self.handles = {
+            "primary": database,
+            "secondary": database.client.get_database(
+                database.name, read_preference=SecondaryPreferred(max_staleness=self.max_staleness)
+            ),
+        }
+        self.routes = routes
+        # Exact templates first, then prefixes, longest first
+        self._exact = {key: role for key, role in routes.items() if not key.endswith("*")}
+        self._prefixes: List[Tuple[str, str]] = sorted(
+            ((key[:-1], role) for key, role in routes.items() if key.endswith("*")),
+            key=lambda entry: len(entry[0]), reverse=True
+        )
+
+    def role_for(self, method: str, path: str) -> str:
+        key = f"{method} {path}"
+        if key in self._exact:
+            return self._exact[key]
+        for prefix, role in self._prefixes:
+            if key.startswith(prefix):
+                return role
+        return "primary"
+
+    def for_request(self, request: Request):
+        route = request.scope.get("route")
+        role = self.role_for(request.method, getattr(route, "path", None) or request.url.path)
+        DB_ROUTED_REQUESTS.labels(role).inc()
+        return self.handles[role]
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            "max_staleness_seconds": self.max_staleness,
+            "routes": self.routes,
+            "read_preferences": {role: handle.read_preference.name for role, handle in self.handles.items()},
+        }
+
+    async def probe(self) -> Dict[str, object]:
+        """Which member answers for each role; run against a replica set to check the routing"""
+        members = {}
+        for role, handle in self.handles.items():
+            hello = await handle.command("hello", read_preference=handle.read_preference or Primary())
+            members[role] = {"me": hello.get("me"), "is_primary": hello.get("isWritablePrimary"), "set": hello.get("setName")}
+        return members
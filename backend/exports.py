@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+from datetime import date, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import ASCENDING
+
+# Rows are flushed to the client in chunks of this many; the Motor cursor
+# fetches the same number of documents per round trip
+EXPORT_BATCH_SIZE = 500
+
+# Exportable collections, the field used for date-range filtering, the
+# columns returned when the caller doesn't pick any, and the fields holding
+# lists, which can be exported whole but not walked into with a dotted path
+EXPORT_COLLECTIONS = {
+    "bookings": {
+        "date_field": "created_at",
+        "array_fields": ["items", "payment_history"],
+        "default_columns": [
+            "id", "booking_reference", "created_at", "customer_name", "customer_email", "customer_phone",
+            "total_amount", "payment_method", "payment_status", "status", "payment_session_id", "items"
+        ]
+    },
+    "waivers": {
+        "date_field": "created_at",
+        "array_fields": ["guests"],
+        "default_columns": [
+            "id", "cart_id", "signed_at", "created_at", "total_guests",
+            "waiver_data.emergency_contact_name", "waiver_data.emergency_contact_phone",
+            "waiver_data.emergency_contact_relationship", "waiver_data.medical_conditions",
+            "waiver_data.additional_notes"
+        ]
+    },
+    "payment_transactions": {
+        "date_field": "created_at",
+        "default_columns": [
+            "id", "booking_id", "created_at", "payment_method", "payment_provider", "session_id",
+            "amount", "currency", "payment_status", "customer_email"
+        ]
+    },
+    "contacts": {
+        "date_field": "created_at",
+        "default_columns": ["id", "created_at", "name", "email", "phone", "message"]
+    }
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+
+async def ensure_export_indexes(db):
+    """Exports filter and sort on the date field"""
+    for collection, config in EXPORT_COLLECTIONS.items():
+        await db[collection].create_index([(config["date_field"], ASCENDING)])
+
+
+def build_export_query(collection: str, start_date: Optional[date], end_date: Optional[date]) -> Dict[str, Any]:
+    """Build the date-range filter; dates are stored as ISO strings so string bounds sort correctly"""
+    date_field = EXPORT_COLLECTIONS[collection]["date_field"]
+    bounds = {}
+    if start_date:
+        bounds["$gte"] = start_date.isoformat()
+    if end_date:
+        # end_date is inclusive
+        bounds["$lt"] = (end_date + timedelta(days=1)).isoformat()
+    return {date_field: bounds} if bounds else {}
+
+
+def resolve_columns(collection: str, columns: Optional[str]) -> List[str]:
+    """Parse a comma-separated column list, falling back to the collection defaults
+
+    Raises ValueError for columns the export can't produce: a path inside a list
+    field, or two columns where one contains the other (Mongo rejects the
+    projection, and only once the response has started streaming).
+    """
+    if not columns:
+        return list(EXPORT_COLLECTIONS[collection]["default_columns"])
+    selected = [column.strip() for column in columns.split(",") if column.strip()]
+    selected = [column for column in selected if column != "_id" and not column.startswith("_id.")]
+
+    for field in EXPORT_COLLECTIONS[collection].get("array_fields", []):
+        inside = [column for column in selected if column.startswith(f"{field}.")]
+        if inside:
+            raise ValueError(f"Column {inside[0]} is inside the list field {field}; export {field} instead")
+    for index, column in enumerate(selected):
+        for other in selected[index + 1:]:
+            if column == other or other.startswith(f"{column}.") or column.startswith(f"{other}."):
+                raise ValueError(f"Columns {column} and {other} overlap; pick one")
+    return selected
+
+
+def _get_path(document: Dict[str, Any], path: str) -> Any:
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str, separators=(",", ":"))
+    return value
+
+
+async def stream_export(
+    db,
+    collection: str,
+    export_format: str,
+    columns: List[str],
+    query: Dict[str, Any],
+    archived: Optional[AsyncIterator[Dict[str, Any]]] = None
+) -> AsyncIterator[str]:
+    """Yield the export in chunks while iterating the cursor; memory stays bounded by the batch size
+
+    `archived` documents (from the cold archive, so all older than anything in
+    Mongo) are written first.
+    """
+    date_field = EXPORT_COLLECTIONS[collection]["date_field"]
+    projection = {"_id": 0}
+    projection.update({column: 1 for column in columns})
+
+    cursor = db[collection].find(query, projection).sort(date_field, 1).batch_size(EXPORT_BATCH_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer:
+        writer.writerow(columns)
+
+    async def documents():
+        if archived is not None:
+            async for document in archived:
+                yield document
+        async for document in cursor:
+            yield document
+
+    rows_in_buffer = 0
+    async for document in documents():
+        if writer:
+            writer.writerow([_csv_value(_get_path(document, column)) for column in columns])
+        else:
+            row = {column: _get_path(document, column) for column in columns}
+            buffer.write(json.dumps(row, default=str))
+            buffer.write("\n")
+
+        rows_in_buffer += 1
+        if rows_in_buffer >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            rows_in_buffer = 0
+
+    remaining = buffer.getvalue()
+    if remaining:
+        yield remaining
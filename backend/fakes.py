@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for Stripe, PayPal, SendGrid, Telegram and Google Sheets.
+
+Each fake speaks just enough of the provider API for the calls server.py
+makes, and sits behind a fault injector with a configurable latency
+distribution, error rate and request quota. All fakes are served from one
+port under a path prefix (/stripe, /paypal, /sendgrid, /telegram, /sheets).
+
+Run them and point the app at them:
+    python fakes.py --port 9100 --latency stripe=lognormal:250:0.4 --error-rate paypal=0.05 --quota sheets=1
+    STRIPE_API_BASE=http://127.0.0.1:9100/stripe PAYPAL_API_BASE=http://127.0.0.1:9100/paypal \\
+    SENDGRID_API_BASE=http://127.0.0.1:9100/sendgrid TELEGRAM_API_BASE=http://127.0.0.1:9100/telegram \\
+    GOOGLE_SHEETS_API_BASE=http://127.0.0.1:9100/sheets uvicorn server:app --port 8001
+
+Latency specs (milliseconds): fixed:MS, uniform:LOW:HIGH, normal:MEAN:STDDEV,
+lognormal:MEDIAN:SIGMA. Profiles can also be changed at runtime with
+POST /_fake/config {"stripe": {"latency": "fixed:800", "error_rate": 0.1}}.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger("fakes")
+
+SERVICES = ("stripe", "paypal", "sendgrid", "telegram", "sheets")
+
+
+class LatencyDistribution:
+    """Parses a latency spec and samples delays in seconds"""
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(value) for value in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution '{spec}'")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            delay_ms = self.params[0]
+        elif self.kind == "uniform":
+            delay_ms = rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            delay_ms = rng.gauss(self.params[0], self.params[1])
+        else:
+            delay_ms = rng.lognormvariate(math.log(max(self.params[0], 0.001)), self.params[1])
+        return max(delay_ms, 0) / 1000
+
+
+class FaultProfile:
+    """Latency, error rate and quota for one fake provider"""
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, quota_per_second: Optional[float] = None,
+                 burst: Optional[float] = None, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.update(latency=latency, error_rate=error_rate, quota_per_second=quota_per_second, burst=burst)
+        self.requests = 0
+        self.injected_errors = 0
+        self.throttled = 0
+
+    def update(self, latency: Optional[str] = None, error_rate: Optional[float] = None,
+               quota_per_second: Optional[float] = None, burst: Optional[float] = None):
+        if latency is not None:
+            self.latency = LatencyDistribution(latency)
+        if error_rate is not None:
+            self.error_rate = float(error_rate)
+        if quota_per_second is not None:
+            self.quota_per_second = float(quota_per_second) or None
+            self.burst = float(burst or max(self.quota_per_second or 1, 1))
+            self.tokens = self.burst
+            self.last_refill = time.monotonic()
+        elif not hasattr(self, "quota_per_second"):
+            self.quota_per_second = None
+
+    def take_token(self) -> Optional[float]:
+        """Token bucket; returns seconds until the next token when the quota is exhausted"""
+        if not self.quota_per_second:
+            return None
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.quota_per_second)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.quota_per_second
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency.spec,
+            "error_rate": self.error_rate,
+            "quota_per_second": self.quota_per_second,
+            "requests": self.requests,
+            "injected_errors": self.injected_errors,
+            "throttled": self.throttled
+        }
+
+
+class FaultInjectionMiddleware:
+    """ASGI middleware applying a FaultProfile to every request of a fake, except /_fake control routes"""
+
+    def __init__(self, app, profile: FaultProfile, service: str):
+        self.app = app
+        self.profile = profile
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/_fake"):
+            return await self.app(scope, receive, send)
+
+        profile = self.profile
+        profile.requests += 1
+
+        retry_after = profile.take_token()
+        if retry_after is not None:
+            profile.throttled += 1
+            response = JSONResponse(
+                {"error": {"code": 429, "message": f"{self.service} fake: rate limit exceeded", "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+            return await response(scope, receive, send)
+
+        await asyncio.sleep(profile.latency.sample(profile.rng))
+
+        if profile.error_rate and profile.rng.random() < profile.error_rate:
+            profile.injected_errors += 1
+            response = JSONResponse(
+                {"error": {"type": "api_error", "message": f"{self.service} fake: injected failure"}},
+                status_code=503
+            )
+            return await response(scope, receive, send)
+
+        return await self.app(scope, receive, send)
+
+
+class FakeState:
+    """Shared settings for webhook delivery back into the app"""
+
+    def __init__(self, app_url: Optional[str], stripe_webhook_secret: str, auto_complete: Optional[float]):
+        self.app_url = app_url.rstrip("/") if app_url else None
+        self.stripe_webhook_secret = stripe_webhook_secret
+        self.auto_complete = auto_complete
+
+    async def deliver(self, path: str, body: bytes, headers: Dict[str, str]):
+        if not self.app_url:
+            return
+        try:
+            async with httpx.AsyncClient(timeout=30) as client:
+                response = await client.post(f"{self.app_url}{path}", content=body, headers=headers)
+                logger.info(f"Delivered webhook to {path}: {response.status_code}")
+        except Exception as e:
+            logger.error(f"Webhook delivery to {path} failed: {str(e)}")
+
+    def schedule(self, coroutine_factory):
+        if self.auto_complete is not None:
+            async def later():
+                await asyncio.sleep(self.auto_complete)
+                await coroutine_factory()
+            asyncio.get_running_loop().create_task(later())
+
+
+def stripe_signature(secret: str, payload: bytes, timestamp: Optional[int] = None) -> str:
+    """Stripe-Signature header value: t=<ts>,v1=HMAC_SHA256(secret, "<ts>.<payload>")"""
+    timestamp = timestamp or int(time.time())
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+# Webhook id the fake PayPal verifies deliveries against (PAYPAL_WEBHOOK_ID in fake_environment)
+FAKE_PAYPAL_WEBHOOK_ID = "WH-FAKE-00000000000000000"
+
+
+def _paypal_signature(transmission_id: str, transmission_time: str, webhook_id: str, event_id: str) -> str:
+    # Real PayPal signs with a certificate over the body's CRC32; an HMAC is enough for the fake
+    signed = f"{transmission_id}|{transmission_time}|{webhook_id}|{event_id}".encode()
+    return hmac.new(webhook_id.encode(), signed, hashlib.sha256).hexdigest()
+
+
+def paypal_webhook_headers(event: Dict[str, Any], webhook_id: str = FAKE_PAYPAL_WEBHOOK_ID) -> Dict[str, str]:
+    """PAYPAL-* headers for delivering `event` that the fake's verify-webhook-signature accepts"""
+    transmission_id = str(uuid.uuid4())
+    transmission_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return {
+        "PAYPAL-AUTH-ALGO": "SHA256withRSA",
+        "PAYPAL-CERT-URL": "https://api.paypal.test/v1/notifications/certs/CERT-FAKE",
+        "PAYPAL-TRANSMISSION-ID": transmission_id,
+        "PAYPAL-TRANSMISSION-TIME": transmission_time,
+        "PAYPAL-TRANSMISSION-SIG": _paypal_signature(transmission_id, transmission_time, webhook_id, event["id"]),
+    }
+
+
+def create_stripe_app(state: FakeState) -> FastAPI:
+    app = FastAPI(title="Fake Stripe")
+    sessions: Dict[str, Dict[str, Any]] = {}
+
+    def session_view(session: Dict[str, Any]) -> Dict[str, Any]:
+        return {"object": "checkout.session", **session}
+
+    async def complete(session_id: str):
+        session = sessions[session_id]
+        session.update(status="complete", payment_status="paid")
+        event = {
+            "id": f"evt_{uuid.uuid4().hex[:24]}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "created": int(time.time()),
+            "data": {"object": session_view(session)}
+        }
+        body = json.dumps(event).encode()
+        await state.deliver("/api/webhook/stripe", body, {
+            "Content-Type": "application/json",
+            "Stripe-Signature": stripe_signature(state.stripe_webhook_secret, body)
+        })
+
+    @app.post("/v1/checkout/sessions")
+    async def create_session(request: Request):
+        # Stripe form-encodes nested params, e.g. metadata[booking_id]=... and line_items[0][price_data][unit_amount]=...
+        form = await request.form()
+        data = dict(form)
+        metadata = {key[len("metadata["):-1]: value for key, value in form.multi_items() if key.startswith("metadata[")}
+        amount_total = sum(int(value) for key, value in form.multi_items() if key.endswith("[unit_amount]"))
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        session = {
+            "id": session_id,
+            "url": f"https://checkout.stripe.test/pay/{session_id}",
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": amount_total,
+            "currency": data.get("currency", "usd"),
+            "metadata": metadata,
+            "success_url": data.get("success_url"),
+            "cancel_url": data.get("cancel_url"),
+            "created": int(time.time())
+        }
+        sessions[session_id] = session
+        state.schedule(lambda: complete(session_id))
+        return session_view(session)
+
+    @app.get("/v1/checkout/sessions/{session_id}")
+    async def retrieve_session(session_id: str):
+        if session_id not in sessions:
+            return JSONResponse({"error": {"type": "invalid_request_error", "message": "No such checkout.session"}}, status_code=404)
+        return session_view(sessions[session_id])
+
+    @app.post("/_fake/complete/{session_id}")
+    async def fake_complete(session_id: str):
+        if session_id not in sessions:
+            return JSONResponse({"detail": "Unknown session"}, status_code=404)
+        await complete(session_id)
+        return session_view(sessions[session_id])
+
+    return app
+
+
+def create_paypal_app(state: FakeState) -> FastAPI:
+    app = FastAPI(title="Fake PayPal")
+    payments: Dict[str, Dict[str, Any]] = {}
+
+    async def complete(payment_id: str):
+        payment = payments[payment_id]
+        payment["state"] = "approved"
+        event = {
+            "id": f"WH-{uuid.uuid4().hex[:17].upper()}",
+            "event_type": "PAYMENT.SALE.COMPLETED",
+            "resource_type": "sale",
+            "resource": {
+                "id": uuid.uuid4().hex[:17].upper(),
+                "state": "completed",
+                "parent_payment": payment_id,
+                "amount": payment["transactions"][0]["amount"]
+            }
+        }
+        await state.deliver("/api/webhook/paypal", json.dumps(event).encode(), {
+            "Content-Type": "application/json", **paypal_webhook_headers(event)
+        })
+
+    @app.post("/v1/oauth2/token")
+    async def token():
+        return {
+            "scope": "https://uri.paypal.com/services/payments/payment",
+            "access_token": f"A21AA{uuid.uuid4().hex}",
+            "token_type": "Bearer",
+            "app_id": "APP-FAKE",
+            "expires_in": 32400
+        }
+
+    @app.post("/v1/notifications/verify-webhook-signature")
+    async def verify_webhook_signature(request: Request):
+        body = await request.json()
+        expected = _paypal_signature(
+            body.get("transmission_id", ""), body.get("transmission_time", ""),
+            body.get("webhook_id", ""), (body.get("webhook_event") or {}).get("id", "")
+        )
+        verified = body.get("webhook_id") == FAKE_PAYPAL_WEBHOOK_ID and hmac.compare_digest(expected, body.get("transmission_sig", ""))
+        return {"verification_status": "SUCCESS" if verified else "FAILURE"}
+
+    @app.post("/v1/payments/payment")
+    async def create_payment(request: Request):
+        body = await request.json()
+        payment_id = f"PAYID-{uuid.uuid4().hex[:24].upper()}"
+        payment = {
+            "id": payment_id,
+            "intent": body.get("intent", "sale"),
+            "state": "created",
+            "payer": body.get("payer", {}),
+            "transactions": body.get("transactions", []),
+            "create_time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "links": [
+                {"href": f"https://api.paypal.test/v1/payments/payment/{payment_id}", "rel": "self", "method": "GET"},
+                {"href": f"https://www.paypal.test/checkoutnow?token=EC-{payment_id[6:]}", "rel": "approval_url", "method": "REDIRECT"},
+                {"href": f"https://api.paypal.test/v1/payments/payment/{payment_id}/execute", "rel": "execute", "method": "POST"}
+            ]
+        }
+        payments[payment_id] = payment
+        state.schedule(lambda: complete(payment_id))
+        return JSONResponse(payment, status_code=201)
+
+    @app.get("/v1/payments/payment/{payment_id}")
+    async def get_payment(payment_id: str):
+        if payment_id not in payments:
+            return JSONResponse({"name": "INVALID_RESOURCE_ID", "message": "Requested resource ID was not found."}, status_code=404)
+        return payments[payment_id]
+
+    @app.post("/v1/payments/payment/{payment_id}/execute")
+    async def execute_payment(payment_id: str, request: Request):
+        if payment_id not in payments:
+            return JSONResponse({"name": "INVALID_RESOURCE_ID", "message": "Requested resource ID was not found."}, status_code=404)
+        body = await request.json()
+        payment = payments[payment_id]
+        payment.update(state="approved", payer={**payment.get("payer", {}), "payer_info": {"payer_id": body.get("payer_id")}})
+        return payment
+
+    @app.post("/_fake/complete/{payment_id}")
+    async def fake_complete(payment_id: str):
+        if payment_id not in payments:
+            return JSONResponse({"detail": "Unknown payment"}, status_code=404)
+        await complete(payment_id)
+        return payments[payment_id]
+
+    return app
+
+
+def create_sendgrid_app(state: FakeState) -> FastAPI:
+    app = FastAPI(title="Fake SendGrid")
+    sent = {"count": 0}
+
+    @app.post("/v3/mail/send")
+    async def send(request: Request):
+        await request.body()
+        sent["count"] += 1
+        return JSONResponse(None, status_code=202, headers={"X-Message-Id": uuid.uuid4().hex})
+
+    @app.get("/_fake/sent")
+    async def sent_count():
+        return sent
+
+    return app
+
+
+def create_telegram_app(state: FakeState) -> FastAPI:
+    app = FastAPI(title="Fake Telegram")
+    message_ids = {"next": 1}
+
+    @app.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        body = await request.json()
+        message_id = message_ids["next"]
+        message_ids["next"] += 1
+        return {
+            "ok": True,
+            "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": body.get("chat_id"), "type": "group"},
+                "text": body.get("text", "")
+            }
+        }
+
+    return app
+
+
+def create_sheets_app(state: FakeState) -> FastAPI:
+    app = FastAPI(title="Fake Google Sheets")
+    rows: Dict[str, int] = {}
+
+    @app.post("/v4/spreadsheets/{spreadsheet_id}/values/{range_action:path}")
+    async def append(spreadsheet_id: str, range_action: str, request: Request):
+        value_range, _, action = range_action.rpartition(":")
+        if action != "append":
+            return JSONResponse({"error": {"code": 404, "message": "Not found"}}, status_code=404)
+        body = await request.json()
+        sheet = value_range.split("!")[0]
+        appended = len(body.get("values", []))
+        start_row = rows.get(sheet, 1) + 1
+        rows[sheet] = start_row + appended - 1
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "tableRange": value_range,
+            "updates": {
+                "spreadsheetId": spreadsheet_id,
+                "updatedRange": f"{sheet}!A{start_row}:K{rows[sheet]}",
+                "updatedRows": appended,
+                "updatedCells": sum(len(row) for row in body.get("values", []))
+            }
+        }
+
+    return app
+
+
+APP_FACTORIES = {
+    "stripe": create_stripe_app,
+    "paypal": create_paypal_app,
+    "sendgrid": create_sendgrid_app,
+    "telegram": create_telegram_app,
+    "sheets": create_sheets_app
+}
+
+
+def create_fakes_app(profiles: Optional[Dict[str, FaultProfile]] = None, app_url: Optional[str] = None,
+                     stripe_webhook_secret: str = "whsec_fake", auto_complete: Optional[float] = None) -> FastAPI:
+    """One ASGI app serving every fake under its own prefix, plus /_fake/config and /_fake/stats"""
+    profiles = profiles or {}
+    for service in SERVICES:
+        profiles.setdefault(service, FaultProfile())
+    state = FakeState(app_url, stripe_webhook_secret, auto_complete)
+
+    root = FastAPI(title="Exclusive Gulf Float integration fakes")
+    for service in SERVICES:
+        root.mount(f"/{service}", FaultInjectionMiddleware(APP_FACTORIES[service](state), profiles[service], service))
+
+    @root.get("/_fake/stats")
+    async def stats():
+        return {service: profile.to_dict() for service, profile in profiles.items()}
+
+    @root.post("/_fake/config")
+    async def configure(request: Request):
+        changes = await request.json()
+        for service, settings in changes.items():
+            if service not in profiles:
+                return JSONResponse({"detail": f"Unknown fake '{service}'"}, status_code=400)
+            try:
+                profiles[service].update(**settings)
+            except (TypeError, ValueError) as e:
+                return JSONResponse({"detail": str(e)}, status_code=400)
+        return {service: profile.to_dict() for service, profile in profiles.items()}
+
+    return root
+
+
+def fake_environment(base_url: str) -> Dict[str, str]:
+    """Environment variables that switch server.py to the fakes at base_url"""
+    base_url = base_url.rstrip("/")
+    return {
+        "STRIPE_API_BASE": f"{base_url}/stripe",
+        "PAYPAL_API_BASE": f"{base_url}/paypal",
+        "PAYPAL_WEBHOOK_ID": FAKE_PAYPAL_WEBHOOK_ID,
+        "SENDGRID_API_BASE": f"{base_url}/sendgrid",
+        "TELEGRAM_API_BASE": f"{base_url}/telegram",
+        "GOOGLE_SHEETS_API_BASE": f"{base_url}/sheets"
+    }
+
+
+def _parse_per_service(values, cast) -> Dict[str, Any]:
+    parsed = {}
+    for value in values or []:
+        service, _, setting = value.partition("=")
+        if service == "all":
+            for name in SERVICES:
+                parsed[name] = cast(setting)
+        elif service in SERVICES:
+            parsed[service] = cast(setting)
+        else:
+            raise SystemExit(f"Unknown fake '{service}', choose from {', '.join(SERVICES)} or all")
+    return parsed
+
+
+def build_profiles(options: argparse.Namespace) -> Dict[str, FaultProfile]:
+    latencies = _parse_per_service(options.latency, str)
+    error_rates = _parse_per_service(options.error_rate, float)
+    quotas = _parse_per_service(options.quota, float)
+    return {
+        service: FaultProfile(
+            latency=latencies.get(service, "fixed:0"),
+            error_rate=error_rates.get(service, 0.0),
+            quota_per_second=quotas.get(service),
+            seed=options.seed
+        )
+        for service in SERVICES
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run local fakes for the app's external integrations")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SPEC",
+                        help="Latency distribution per service (or all=SPEC), e.g. stripe=lognormal:300:0.5")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATE", help="Fraction of requests answered with 503")
+    parser.add_argument("--quota", action="append", metavar="SERVICE=RPS", help="Requests per second before answering 429")
+    parser.add_argument("--app-url", help="Deliver Stripe/PayPal webhooks to this app base URL")
+    parser.add_argument("--stripe-webhook-secret", default="whsec_fake")
+    parser.add_argument("--auto-complete", type=float, metavar="SECONDS",
+                        help="Complete payments and send their webhooks this long after creation")
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import uvicorn
+
+    options = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    app = create_fakes_app(build_profiles(options), options.app_url, options.stripe_webhook_secret, options.auto_complete)
+
+    print("Point the app at the fakes with:")
+    for key, value in fake_environment(f"http://{options.host}:{options.port}").items():
+        print(f"  export {key}={value}")
+    uvicorn.run(app, host=options.host, port=options.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Best first; the overall status is the worst of the checks
+STATUS_ORDER = ("ok", "degraded", "fail")
+
+# Backlog name -> (count it, degraded at, fail at or None to never fail)
+BacklogCheck = Tuple[Callable[[], Awaitable[int]], int, Optional[int]]
+
+
+def worst(statuses: Iterable[str]) -> str:
+    return max(statuses, key=STATUS_ORDER.index, default="ok")
+
+
+class HealthChecker:
+    """Readiness for the load balancer, cached for `ttl` seconds
+
+    Probes arriving while a check runs wait for that check, so each worker pings
+    Mongo at most once per ttl however often it is probed. Only this worker's own
+    problems fail readiness (Mongo unreachable or too slow, a local backlog past its
+    limit, a required integration's circuit open); a failing optional integration
+    or a shared backlog only reports "degraded", since every worker would see the
+    same and taking them all out of rotation would not help.
+    """
+
+    def __init__(self, get_db: Callable, integration_health, backlogs: Dict[str, BacklogCheck],
+                 required_integrations: Iterable[str] = (), ttl: float = 5.0,
+                 mongo_timeout: float = 2.0, mongo_degraded_ms: float = 250):
+        self.get_db = get_db
+        self.integration_health = integration_health
+        self.backlogs = backlogs
+        self.required_integrations = set(required_integrations)
+        self.ttl = ttl
+        self.mongo_timeout = mongo_timeout
+        self.mongo_degraded_ms = mongo_degraded_ms
+        self.started_at = time.monotonic()
+        self.draining = False
+        self._cached: Optional[Dict[str, Any]] = None
+        self._cached_at = 0.0
+        self._last_status = "ok"
+        self._lock = asyncio.Lock()
+
+    def live(self) -> Dict[str, Any]:
+        """Liveness: answering at all means the event loop is running"""
+        return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.monotonic() - self.started_at, 1)}
+
+    async def _check_mongo(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.get_db().command("ping"), timeout=self.mongo_timeout)
+        except Exception as e:
+            return {"status": "fail", "error": f"{type(e).__name__}: {e}"}
+        latency_ms = (time.perf_counter() - start) * 1000
+        return {"status": "degraded" if latency_ms > self.mongo_degraded_ms else "ok", "latency_ms": round(latency_ms, 1)}
+
+    def _check_integrations(self) -> Dict[str, Any]:
+        results = {}
+        for integration, state in self.integration_health.states().items():
+            required = integration in self.required_integrations
+            if state["circuit"] == "closed":
+                status = "ok"
+            elif state["circuit"] == "open" and required:
+                status = "fail"
+            else:
+                status = "degraded"
+            results[integration] = {"status": status, "required": required, **state}
+        return results
+
+    async def _check_backlog(self, check: BacklogCheck) -> Dict[str, Any]:
+        count, degraded_at, fail_at = check
+        try:
+            size = await count()
+        except Exception as e:
+            return {"status": "degraded", "error": f"{type(e).__name__}: {e}"}
+        if fail_at is not None and size >= fail_at:
+            status = "fail"
+        elif size >= degraded_at:
+            status = "degraded"
+        else:
+            status = "ok"
+        return {"status": status, "size": size}
+
+    async def _run_checks(self) -> Dict[str, Any]:
+        names = list(self.backlogs)
+        mongo, *backlogs = await asyncio.gather(
+            self._check_mongo(), *(self._check_backlog(self.backlogs[name]) for name in names)
+        )
+        checks = {"mongo": mongo, "integrations": self._check_integrations(), "backlogs": dict(zip(names, backlogs))}
+        status = worst([mongo["status"]]
+                       + [result["status"] for result in checks["integrations"].values()]
+                       + [result["status"] for result in backlogs])
+        return {"status": status, "checked_at": datetime.now(timezone.utc).isoformat(), "checks": checks}
+
+    async def ready(self) -> Dict[str, Any]:
+        """Readiness report; status "fail" (or draining) should be answered with 503"""
+        if self.draining:
+            return {"status": "fail", "draining": True}
+        async with self._lock:
+            if self._cached is None or time.monotonic() - self._cached_at >= self.ttl:
+                self._cached = await self._run_checks()
+                self._cached_at = time.monotonic()
+                if self._cached["status"] != self._last_status:
+                    logger.warning(f"Readiness {self._last_status} -> {self._cached['status']}: {self._cached['checks']}")
+                    self._last_status = self._cached["status"]
+        return {**self._cached, "cached_for": round(time.monotonic() - self._cached_at, 2)}
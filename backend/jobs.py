@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from metrics import BACKGROUND_JOBS_REQUEUED, track_task
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_JOBS_COLLECTION = "background_jobs"
+
+
+async def ensure_job_indexes(db):
+    await db[BACKGROUND_JOBS_COLLECTION].create_index([("id", ASCENDING)], unique=True)
+    await db[BACKGROUND_JOBS_COLLECTION].create_index([("status", ASCENDING), ("queued_at", ASCENDING)])
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class _Job:
+    __slots__ = ("name", "func", "encode", "decode")
+
+    def __init__(self, name: str, func: Callable, encode: Callable, decode: Callable):
+        self.name = name
+        self.func = func
+        self.encode = encode
+        self.decode = decode
+
+
+class BackgroundJobs:
+    """Side effects that run after the response (Sheets appends, waiver PDFs, notifications)
+
+    Jobs run as tasks owned by this object rather than by the request, so a worker
+    being recycled doesn't cut them off: drain() gives running jobs until a deadline,
+    then writes the ones still unfinished to the background_jobs collection. Every
+    worker picks queued jobs up from there and runs them again, so a job runs at
+    least once. Each job takes one argument, which `encode` turns into a document.
+
+    Jobs that must not be lost between a database write and the response go
+    through enqueue() instead: the queued document is written before the caller
+    returns, and is keyed so the job runs once per key.
+    """
+
+    def __init__(self, get_db: Callable, poll_interval: float = 30, lease: timedelta = timedelta(minutes=10),
+                 batch_size: int = 20):
+        self.get_db = get_db
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.accepting = True
+        self._jobs: Dict[str, _Job] = {}
+        # Running task -> (job name, argument, queued document id when it came from the collection)
+        self._running: Dict[asyncio.Task, Tuple[str, Any, Optional[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return self.get_db()[BACKGROUND_JOBS_COLLECTION]
+
+    def register(self, func: Callable, encode: Callable = lambda arg: arg, decode: Callable = lambda data: data):
+        self._jobs[func.__name__] = _Job(func.__name__, func, encode, decode)
+        return func
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    def add(self, background_tasks, func: Callable, arg: Any):
+        """Run func(arg) once the response has been sent"""
+        job = self._jobs[func.__name__]
+        background_tasks.add_task(self._submit, job, track_task(job.func), arg)
+
+    async def enqueue(self, func: Callable, arg: Any, key: str) -> bool:
+        """Queue func(arg) durably under key and start it here; returns False if the key was already queued
+
+        The document stays behind as done once the job has run, so a caller replayed
+        after a crash can enqueue again without the job running twice.
+        """
+        job = self._jobs[func.__name__]
+        job_id = f"{job.name}:{key}"
+        try:
+            result = await self.collection.update_one(
+                {"id": job_id},
+                {"$setOnInsert": {
+                    "name": job.name,
+                    "key": key,
+                    "argument": job.encode(arg),
+                    "status": "pending",
+                    "queued_at": _now().isoformat(),
+                    "queued_by": self.owner
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        if result.upserted_id is None:
+            return False
+        # Shutting down, or another worker's poll got it first: it runs from the queue
+        if self.accepting and await self._claim({"id": job_id}) is not None:
+            await self._submit(job, track_task(job.func), arg, job_id=job_id)
+        return True
+
+    async def _submit(self, job: _Job, run: Callable, arg: Any, job_id: Optional[str] = None):
+        if not self.accepting:
+            await self._queue([(job.name, arg, job_id)])
+            return
+        task = asyncio.create_task(self._run(job, run, arg, job_id))
+        self._running[task] = (job.name, arg, job_id)
+        task.add_done_callback(lambda finished: self._running.pop(finished, None))
+
+    async def _run(self, job: _Job, run: Callable, arg: Any, job_id: Optional[str]):
+        try:
+            await run(arg)
+        except Exception as e:
+            logger.error(f"Background job {job.name} failed: {str(e)}")
+        if job_id is not None:
+            await self._finish(job_id)
+
+    async def _finish(self, job_id: str):
+        """Queued jobs are removed once run; keyed ones are kept as the record that their key has run"""
+        owned = {"id": job_id, "claimed_by": self.owner}
+        result = await self.collection.delete_one({**owned, "key": {"$exists": False}})
+        if not result.deleted_count:
+            await self.collection.update_one(owned, {"$set": {"status": "done", "finished_at": _now().isoformat()}})
+
+    async def _queue(self, entries):
+        """Hand jobs to the durable queue; ones that came from it go back to pending"""
+        now = _now().isoformat()
+        for name, arg, job_id in entries:
+            BACKGROUND_JOBS_REQUEUED.labels(name).inc()
+            if job_id is not None:
+                await self.collection.update_one(
+                    {"id": job_id},
+                    {"$set": {"status": "pending", "queued_at": now}, "$unset": {"claimed_at": "", "claimed_by": ""}}
+                )
+            else:
+                await self.collection.insert_one({
+                    "id": str(uuid.uuid4()),
+                    "name": name,
+                    "argument": self._jobs[name].encode(arg),
+                    "status": "pending",
+                    "queued_at": now,
+                    "queued_by": self.owner
+                })
+
+    async def _claim(self, query: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        now = _now()
+        claim = {"status": "running", "claimed_at": now.isoformat(), "claimed_by": self.owner}
+        job = await self.collection.find_one_and_update(
+            {**(query or {}), "$or": [
+                {"status": "pending"},
+                # Claimed by a worker that died before finishing or requeueing it
+                {"status": "running", "claimed_at": {"$lt": (now - self.lease).isoformat()}}
+            ]},
+            {"$set": claim},
+            projection={"_id": 0},
+            sort=[("queued_at", ASCENDING)]
+        )
+        if job is not None:
+            job.update(claim)
+        return job
+
+    async def run_queued(self) -> int:
+        """Start up to batch_size jobs from the durable queue; returns how many"""
+        started = 0
+        while self.accepting and started < self.batch_size:
+            job = await self._claim()
+            if job is None:
+                break
+            registered = self._jobs.get(job["name"])
+            if registered is None:
+                logger.error(f"Queued background job {job['id']} has unknown name {job['name']}")
+                await self.collection.update_one({"id": job["id"]}, {"$set": {"status": "failed"}})
+                continue
+            await self._submit(registered, track_task(registered.func), registered.decode(job["argument"]), job_id=job["id"])
+            started += 1
+        return started
+
+    async def _loop(self):
+        while True:
+            try:
+                if await self.run_queued():
+                    logger.info("Started background jobs queued by a previous shutdown")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Background job queue poll failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def drain(self, timeout: float) -> Dict[str, int]:
+        """Stop taking jobs, wait up to timeout for running ones, queue the rest"""
+        self.accepting = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        running = list(self._running)
+        if not running:
+            return {"finished": 0, "requeued": 0}
+        done, pending = await asyncio.wait(running, timeout=timeout)
+        leftovers = [self._running[task] for task in pending if task in self._running]
+        # Queue first, then cancel: a job finishing in between runs twice rather than never
+        await self._queue(leftovers)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if leftovers:
+            logger.warning(f"Shutdown deadline reached; queued {len(leftovers)} unfinished background jobs")
+        return {"finished": len(done), "requeued": len(leftovers)}
+
+    async def close(self):
+        if self.accepting:
+            await self.drain(0)
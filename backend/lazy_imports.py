@@ -0,0 +1,87 @@
+import asyncio
+import importlib
+import logging
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from metrics import SDK_IMPORT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class _LazyModule:
+    __slots__ = ("alias", "module_name", "on_load", "module", "import_seconds", "loaded_by")
+
+    def __init__(self, alias: str, module_name: str, on_load: Optional[Callable[[ModuleType], None]]):
+        self.alias = alias
+        self.module_name = module_name
+        self.on_load = on_load
+        self.module: Optional[ModuleType] = None
+        self.import_seconds: Optional[float] = None
+        self.loaded_by: Optional[str] = None
+
+
+class LazyImporter:
+    """Defers importing integration SDKs until first use or a post-startup warm-up
+
+    Import time is recorded per SDK so the startup report shows what each one
+    costs and whether a request or the warm-up paid for it.
+    """
+
+    def __init__(self):
+        self._modules: Dict[str, _LazyModule] = {}
+        self._lock = threading.Lock()
+
+    def register(self, alias: str, module_name: str, on_load: Optional[Callable[[ModuleType], None]] = None):
+        self._modules[alias] = _LazyModule(alias, module_name, on_load)
+
+    def load(self, alias: str, loaded_by: str = "on_demand") -> ModuleType:
+        """Import (once) and return the module registered under alias"""
+        entry = self._modules[alias]
+        if entry.module is not None:
+            return entry.module
+
+        already_imported = entry.module_name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(entry.module_name)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            if entry.module is None:
+                if entry.on_load is not None:
+                    entry.on_load(module)
+                entry.import_seconds = elapsed
+                entry.loaded_by = "preloaded" if already_imported else loaded_by
+                entry.module = module
+                SDK_IMPORT_SECONDS.labels(alias).set(elapsed)
+                logger.info(f"Imported {entry.module_name} in {elapsed * 1000:.1f}ms ({entry.loaded_by})")
+        return entry.module
+
+    async def aload(self, alias: str) -> ModuleType:
+        """load() for coroutines: a first import runs in a thread instead of blocking the event loop"""
+        entry = self._modules[alias]
+        if entry.module is not None:
+            return entry.module
+        return await asyncio.to_thread(self.load, alias)
+
+    def warm_up(self, aliases: Optional[Iterable[str]] = None):
+        """Import every registered SDK that hasn't been loaded yet"""
+        for alias in aliases or list(self._modules):
+            try:
+                self.load(alias, loaded_by="warmup")
+            except Exception as e:
+                logger.error(f"Failed to import {self._modules[alias].module_name}: {str(e)}")
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            alias: {
+                "module": entry.module_name,
+                "loaded": entry.module is not None,
+                "loaded_by": entry.loaded_by,
+                "import_ms": round(entry.import_seconds * 1000, 1) if entry.import_seconds is not None else None
+            }
+            for alias, entry in self._modules.items()
+        }
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DeleteOne, ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+BOOKINGS_ARCHIVE = "bookings_archive"
+TRANSACTIONS_ARCHIVE = "payment_transactions_archive"
+
+# Fields added to archived documents and removed again on restore
+ARCHIVE_FIELDS = ("archived_at", "archive_reason")
+
+
+async def ensure_archive_indexes(db):
+    await db.bookings.create_index([("status", ASCENDING), ("payment_status", ASCENDING), ("created_at", ASCENDING)])
+    await db[BOOKINGS_ARCHIVE].create_index([("id", ASCENDING)], unique=True)
+    await db[BOOKINGS_ARCHIVE].create_index([("payment_session_id", ASCENDING)])
+    await db[BOOKINGS_ARCHIVE].create_index([("booking_reference", ASCENDING)])
+    await db[BOOKINGS_ARCHIVE].create_index([("archived_at", ASCENDING)])
+    await db[TRANSACTIONS_ARCHIVE].create_index([("id", ASCENDING)], unique=True)
+    await db[TRANSACTIONS_ARCHIVE].create_index([("booking_id", ASCENDING)])
+
+
+class PendingBookingPolicy:
+    """Which unpaid bookings count as abandoned: still pending (or failed) after `pending_for`
+
+    Payment methods listed in `pending_for_method` get their own age, e.g. longer
+    for Venmo/Zelle where the money can arrive days after checkout.
+    """
+
+    def __init__(self, pending_for: timedelta = timedelta(hours=48),
+                 pending_for_method: Optional[Dict[str, timedelta]] = None,
+                 payment_statuses=("pending", "failed")):
+        self.pending_for = pending_for
+        self.pending_for_method = pending_for_method or {}
+        self.payment_statuses = tuple(payment_statuses)
+
+    def query(self, now: datetime) -> Dict[str, Any]:
+        ages = [{
+            "payment_method": {"$nin": list(self.pending_for_method)},
+            "created_at": {"$lt": (now - self.pending_for).isoformat()}
+        }]
+        ages += [
+            {"payment_method": method, "created_at": {"$lt": (now - pending_for).isoformat()}}
+            for method, pending_for in self.pending_for_method.items()
+        ]
+        return {
+            "status": "pending",
+            "payment_status": {"$in": list(self.payment_statuses)},
+            "$or": ages,
+            # A restored booking gets a fresh grace period
+            "restored_at": {"$not": {"$gte": (now - self.pending_for).isoformat()}}
+        }
+
+
+async def _move(db, source: str, target: str, documents: List[Dict[str, Any]], guard: Dict[str, Any], extra: Dict[str, Any]) -> List[str]:
+    """Copy documents to target, then delete them from source where guard still holds
+
+    The copy is an idempotent upsert, so a run cut off halfway is simply redone.
+    Documents whose guard stopped holding in between (a booking paid mid-sweep)
+    stay in source and their copy is removed again. Returns the ids moved.
+    """
+    if not documents:
+        return []
+    ids = [document["id"] for document in documents]
+    await db[target].bulk_write([
+        ReplaceOne({"id": document["id"]}, {**document, **extra}, upsert=True) for document in documents
+    ], ordered=False)
+    await db[source].bulk_write([DeleteOne({**guard, "id": document_id}) for document_id in ids], ordered=False)
+
+    kept = {document["id"] async for document in db[source].find({"id": {"$in": ids}}, {"_id": 0, "id": 1})}
+    if kept:
+        await db[target].delete_many({"id": {"$in": list(kept)}})
+    return [document_id for document_id in ids if document_id not in kept]
+
+
+class BookingArchiver:
+    """Moves abandoned pending bookings and their payment transactions out of the hot collections
+
+    Runs every `interval` seconds, `batch_size` bookings per bulk_write. Archived
+    bookings can be restored (restore()), which also happens automatically when a
+    late payment arrives for one (see apply_payment_status in server.py).
+    """
+
+    def __init__(self, get_db, policy: PendingBookingPolicy, interval: float = 3600, batch_size: int = 500):
+        self.get_db = get_db
+        self.policy = policy
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.archive()
+            except Exception as e:
+                logger.error(f"Booking archive sweep failed: {str(e)}")
+
+    async def archive(self, dry_run: bool = False, max_batches: Optional[int] = None) -> Dict[str, Any]:
+        """Archive every booking matching the policy; with dry_run only count them"""
+        db = self.get_db()
+        now = datetime.now(timezone.utc)
+        query = self.policy.query(now)
+        if dry_run:
+            return {"dry_run": True, "bookings": await db.bookings.count_documents(query)}
+
+        archived = {"bookings": 0, "payment_transactions": 0}
+        extra = {"archived_at": now.isoformat(), "archive_reason": "pending_expired"}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            bookings = await db.bookings.find(query, {"_id": 0}).sort("created_at", ASCENDING).limit(self.batch_size).to_list(length=None)
+            if not bookings:
+                break
+            moved = await _move(db, "bookings", BOOKINGS_ARCHIVE, bookings, query, extra)
+            if moved:
+                transactions = await db.payment_transactions.find({"booking_id": {"$in": moved}}, {"_id": 0}).to_list(length=None)
+                archived["payment_transactions"] += len(await _move(
+                    db, "payment_transactions", TRANSACTIONS_ARCHIVE, transactions, {"payment_status": {"$ne": "completed"}}, extra
+                ))
+            archived["bookings"] += len(moved)
+            batches += 1
+            if len(bookings) < self.batch_size or not moved:
+                break
+
+        logger.info(f"Archived {archived['bookings']} abandoned bookings and {archived['payment_transactions']} transactions")
+        return {"dry_run": False, **archived}
+
+    async def restore(self, query: Dict[str, Any]) -> List[str]:
+        """Move archived bookings matching query (and their transactions) back to the hot collections"""
+        db = self.get_db()
+        bookings = await db[BOOKINGS_ARCHIVE].find(query, {"_id": 0}).to_list(length=None)
+        if not bookings:
+            return []
+        ids = [booking["id"] for booking in bookings]
+        restored_at = datetime.now(timezone.utc).isoformat()
+        restored = [
+            {**{key: value for key, value in booking.items() if key not in ARCHIVE_FIELDS}, "restored_at": restored_at}
+            for booking in bookings
+        ]
+        await db.bookings.bulk_write([ReplaceOne({"id": booking["id"]}, booking, upsert=True) for booking in restored], ordered=False)
+        await db[BOOKINGS_ARCHIVE].delete_many({"id": {"$in": ids}})
+
+        transactions = await db[TRANSACTIONS_ARCHIVE].find({"booking_id": {"$in": ids}}, {"_id": 0}).to_list(length=None)
+        if transactions:
+            await db.payment_transactions.bulk_write([
+                ReplaceOne({"id": transaction["id"]}, {key: value for key, value in transaction.items() if key not in ARCHIVE_FIELDS}, upsert=True)
+                for transaction in transactions
+            ], ordered=False)
+            await db[TRANSACTIONS_ARCHIVE].delete_many({"booking_id": {"$in": ids}})
+        logger.info(f"Restored {len(ids)} archived bookings")
+        return ids
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Load-generation harness for the booking API.
+
+Boots the app in-process (against a local mongod or a mongomock-motor
+stand-in) or targets a running server, drives a weighted mix of realistic
+scenarios with N concurrent virtual users, and reports throughput and
+p50/p95/p99 latency per endpoint. Results are written as JSON so runs can
+be compared with --compare.
+
+Examples:
+    python loadtest.py --mongo mock --concurrency 20 --duration 30
+    python loadtest.py --mongo-url mongodb://localhost:27017 --mix browse=4,cart=3,checkout=2,webhook=1
+    python loadtest.py --mongo mock --fakes --fake-latency all=lognormal:150:0.5 --payment-method stripe
+    python loadtest.py --base-url http://localhost:8001 --output run.json --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent
+
+DEFAULT_MIX = "browse=4,cart=3,checkout=2,webhook=1"
+
+
+class Stats:
+    """Per-endpoint latency samples and error counts"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.status_codes: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, elapsed_ms: float, status_code: Optional[int], ok: bool):
+        self.latencies[endpoint].append(elapsed_ms)
+        if status_code is not None:
+            self.status_codes[endpoint][status_code] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(samples))))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class ApiClient:
+    """Thin wrapper that times every call and files it under its route template"""
+
+    def __init__(self, http: httpx.AsyncClient, stats: Stats):
+        self.http = http
+        self.stats = stats
+
+    async def call(self, method: str, endpoint: str, url: str, expected=(200,), **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.http.request(method, url, **kwargs)
+            return response
+        except Exception:
+            return None
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            status_code = response.status_code if response is not None else None
+            self.stats.record(f"{method} {endpoint}", elapsed_ms, status_code, status_code in expected)
+
+
+def random_cart_item(rng: random.Random, services: List[str]) -> dict:
+    booking_day = date.today() + timedelta(days=rng.randint(1, 60))
+    return {
+        "service_id": rng.choice(services),
+        "quantity": rng.randint(1, 6),
+        "booking_date": booking_day.isoformat(),
+        "booking_time": f"{rng.randint(8, 19):02d}:00:00"
+    }
+
+
+async def fetch_services(api: ApiClient) -> List[str]:
+    response = await api.call("GET", "/api/services", "/api/services")
+    if response is None or response.status_code != 200:
+        return ["crystal_kayak", "canoe", "paddle_board"]
+    return list(response.json().get("services", {}).keys())
+
+
+async def build_cart(api: ApiClient, rng: random.Random, services: List[str]) -> Optional[str]:
+    response = await api.call("POST", "/api/cart/create", "/api/cart/create")
+    if response is None or response.status_code != 200:
+        return None
+    cart_id = response.json()["cart_id"]
+    for _ in range(rng.randint(1, 4)):
+        await api.call("POST", "/api/cart/{cart_id}/add", f"/api/cart/{cart_id}/add", json=random_cart_item(rng, services))
+    await api.call("GET", "/api/cart/{cart_id}", f"/api/cart/{cart_id}")
+    return cart_id
+
+
+async def checkout(api: ApiClient, rng: random.Random, services: List[str], payment_method: str) -> Optional[dict]:
+    cart_id = await build_cart(api, rng, services)
+    if not cart_id:
+        return None
+    response = await api.call(
+        "POST", "/api/cart/{cart_id}/checkout", f"/api/cart/{cart_id}/checkout",
+        json={
+            "customer_info": {
+                "name": "Load Test",
+                "email": f"load-{uuid.uuid4().hex[:8]}@example.com",
+                "phone": "850-555-0100"
+            },
+            "payment_method": payment_method
+        }
+    )
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()
+
+
+async def scenario_browse(api: ApiClient, rng: random.Random, services: List[str], options: argparse.Namespace):
+    """Landing page and booking page views"""
+    await api.call("GET", "/api/", "/api/")
+    await api.call("GET", "/api/services", "/api/services")
+
+
+async def scenario_cart(api: ApiClient, rng: random.Random, services: List[str], options: argparse.Namespace):
+    """Build a cart and abandon it, polling it a couple of times like an open tab would"""
+    cart_id = await build_cart(api, rng, services)
+    if cart_id:
+        for _ in range(rng.randint(0, 2)):
+            await api.call("GET", "/api/cart/{cart_id}", f"/api/cart/{cart_id}")
+
+
+async def scenario_checkout(api: ApiClient, rng: random.Random, services: List[str], options: argparse.Namespace):
+    """Build a cart and check out with the configured payment method"""
+    await checkout(api, rng, services, options.payment_method)
+
+
+async def scenario_webhook(api: ApiClient, rng: random.Random, services: List[str], options: argparse.Namespace):
+    """Check out with PayPal and deliver the PAYMENT.SALE.COMPLETED webhook for it"""
+    import fakes
+
+    result = await checkout(api, rng, services, "paypal")
+    if not result or not result.get("payment_id"):
+        return
+    event = {
+        "id": f"WH-{uuid.uuid4().hex[:12]}",
+        "event_type": "PAYMENT.SALE.COMPLETED",
+        "resource": {"parent_payment": result["payment_id"], "state": "completed"}
+    }
+    # Signed the way the fake PayPal's verify-webhook-signature expects
+    await api.call("POST", "/api/webhook/paypal", "/api/webhook/paypal", json=event, headers=fakes.paypal_webhook_headers(event))
+    await api.call("GET", "/api/bookings/{booking_id}", f"/api/bookings/{result['booking_id']}")
+
+
+SCENARIOS = {
+    "browse": scenario_browse,
+    "cart": scenario_cart,
+    "checkout": scenario_checkout,
+    "webhook": scenario_webhook
+}
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', choose from {', '.join(SCENARIOS)}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+async def virtual_user(user_id: int, api: ApiClient, services: List[str], weights: Dict[str, int],
+                       deadline: float, options: argparse.Namespace, scenario_counts: Dict[str, int]):
+    rng = random.Random(options.seed + user_id)
+    names = list(weights)
+    population = [weights[name] for name in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, population)[0]
+        scenario_counts[name] += 1
+        await SCENARIOS[name](api, rng, services, options)
+        if options.think_time:
+            await asyncio.sleep(rng.uniform(0, options.think_time))
+
+
+@asynccontextmanager
+async def integration_fakes(options: argparse.Namespace):
+    """Serve fakes.py on a local port and point the app's integration settings at it"""
+    import uvicorn
+    import fakes
+
+    fake_options = fakes.parse_args(
+        [f"--latency={value}" for value in options.fake_latency or []]
+        + [f"--error-rate={value}" for value in options.fake_error_rate or []]
+        + [f"--quota={value}" for value in options.fake_quota or []]
+        + [f"--seed={options.seed}"]
+    )
+    app = fakes.create_fakes_app(fakes.build_profiles(fake_options))
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=options.fakes_port, log_level="warning"))
+    # Own thread and event loop: the PayPal, SendGrid and Sheets SDKs make blocking calls
+    # from the app's loop, which would otherwise deadlock against an in-loop fake
+    thread = threading.Thread(target=server.run, name="integration-fakes", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit(f"Integration fakes failed to start on port {options.fakes_port}")
+        await asyncio.sleep(0.05)
+
+    os.environ.update(fakes.fake_environment(f"http://127.0.0.1:{options.fakes_port}"))
+    for key, value in {
+        "STRIPE_API_KEY": "sk_test_fake",
+        "SENDGRID_API_KEY": "SG.fake",
+        "SENDER_EMAIL": "bookings@example.com",
+        "TELEGRAM_BOT_TOKEN": "123456:fake",
+        "TELEGRAM_CHAT_ID": "-100000"
+    }.items():
+        os.environ.setdefault(key, value)
+    try:
+        yield app
+    finally:
+        server.should_exit = True
+        await asyncio.to_thread(thread.join, 5)
+
+
+@asynccontextmanager
+async def in_process_app(options: argparse.Namespace):
+    """Import server.py and run its lifespan, pointing it at mongomock or a local mongod"""
+    os.environ.setdefault("MONGO_URL", options.mongo_url)
+    os.environ.setdefault("DB_NAME", options.db_name)
+    # Every virtual user shares one client address, so the per-IP limits would throttle the run
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("CART_TOKEN_SECRET", "loadtest")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    if options.mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+
+        mock_client = AsyncMongoMockClient()
+        server.services.register("db", lambda: mock_client[options.db_name])
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=options.timeout) as http:
+            yield http
+
+
+@asynccontextmanager
+async def remote_app(options: argparse.Namespace):
+    limits = httpx.Limits(max_connections=options.concurrency * 2)
+    async with httpx.AsyncClient(base_url=options.base_url, timeout=options.timeout, limits=limits) as http:
+        yield http
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def summarize(stats: Stats, elapsed: float) -> dict:
+    endpoints = {}
+    total_requests = 0
+    total_errors = 0
+    for endpoint, samples in sorted(stats.latencies.items()):
+        ordered = sorted(samples)
+        total_requests += len(ordered)
+        total_errors += stats.errors[endpoint]
+        endpoints[endpoint] = {
+            "requests": len(ordered),
+            "errors": stats.errors[endpoint],
+            "throughput_rps": round(len(ordered) / elapsed, 2),
+            "mean_ms": round(sum(ordered) / len(ordered), 2),
+            "p50_ms": round(percentile(ordered, 50), 2),
+            "p95_ms": round(percentile(ordered, 95), 2),
+            "p99_ms": round(percentile(ordered, 99), 2),
+            "max_ms": round(ordered[-1], 2),
+            "status_codes": {str(code): count for code, count in sorted(stats.status_codes[endpoint].items())}
+        }
+    return {
+        "total_requests": total_requests,
+        "total_errors": total_errors,
+        "throughput_rps": round(total_requests / elapsed, 2),
+        "endpoints": endpoints
+    }
+
+
+def print_report(results: dict, baseline: Optional[dict] = None):
+    summary = results["summary"]
+    print(f"\nDuration: {results['elapsed_seconds']}s  Concurrency: {results['config']['concurrency']}  "
+          f"Requests: {summary['total_requests']}  Errors: {summary['total_errors']}  "
+          f"Throughput: {summary['throughput_rps']} req/s")
+    print(f"Scenarios: {results['scenarios']}\n")
+    header = f"{'endpoint':<42}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if baseline:
+        header += f"{'p95 Δ':>10}"
+    print(header)
+    print("-" * len(header))
+    baseline_endpoints = (baseline or {}).get("summary", {}).get("endpoints", {})
+    for endpoint, row in summary["endpoints"].items():
+        line = (f"{endpoint:<42}{row['requests']:>8}{row['errors']:>6}{row['throughput_rps']:>9}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+        if baseline:
+            previous = baseline_endpoints.get(endpoint)
+            if previous and previous["p95_ms"]:
+                change = (row["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100
+                line += f"{change:>+9.1f}%"
+            else:
+                line += f"{'n/a':>10}"
+        print(line)
+    if baseline:
+        previous_rps = baseline.get("summary", {}).get("throughput_rps") or 0
+        if previous_rps:
+            change = (summary["throughput_rps"] - previous_rps) / previous_rps * 100
+            print(f"\nThroughput vs baseline ({baseline.get('revision')}): {change:+.1f}%")
+
+
+async def run(options: argparse.Namespace) -> dict:
+    weights = parse_mix(options.mix)
+    stats = Stats()
+    scenario_counts: Dict[str, int] = defaultdict(int)
+    app_context = remote_app(options) if options.base_url else in_process_app(options)
+
+    async with AsyncExitStack() as stack:
+        if options.fakes:
+            sys.path.insert(0, str(BACKEND_DIR))
+            await stack.enter_async_context(integration_fakes(options))
+        http = await stack.enter_async_context(app_context)
+        api = ApiClient(http, stats)
+        services = await fetch_services(api)
+
+        # Warm-up requests are not counted
+        for _ in range(options.warmup):
+            await scenario_browse(api, random.Random(0), services, options)
+        stats.__init__()
+
+        start = time.perf_counter()
+        deadline = start + options.duration
+        await asyncio.gather(*[
+            virtual_user(user_id, api, services, weights, deadline, options, scenario_counts)
+            for user_id in range(options.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            "target": options.base_url or f"in-process ({options.mongo})",
+            "concurrency": options.concurrency,
+            "duration": options.duration,
+            "mix": weights,
+            "payment_method": options.payment_method,
+            "fakes": {
+                "latency": options.fake_latency,
+                "error_rate": options.fake_error_rate,
+                "quota": options.fake_quota
+            } if options.fakes else None,
+            "seed": options.seed
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "scenarios": dict(scenario_counts),
+        "summary": summarize(stats, elapsed)
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the Exclusive Gulf Float booking API")
+    parser.add_argument("--base-url", help="Target a running server instead of booting the app in-process")
+    parser.add_argument("--mongo", choices=["local", "mock"], default="local",
+                        help="In-process only: use MONGO_URL/--mongo-url, or a mongomock-motor stand-in")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="egf_loadtest")
+    parser.add_argument("--concurrency", type=int, default=10, help="Number of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--warmup", type=int, default=5, help="Uncounted warm-up iterations")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted scenario mix (default {DEFAULT_MIX})")
+    parser.add_argument("--payment-method", default="venmo",
+                        help="Payment method for the checkout scenario (venmo avoids provider calls)")
+    parser.add_argument("--think-time", type=float, default=0, help="Max random pause between scenarios, seconds")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fakes", action="store_true",
+                        help="In-process only: run fakes.py and route Stripe/PayPal/SendGrid/Telegram/Sheets to it")
+    parser.add_argument("--fakes-port", type=int, default=9100)
+    parser.add_argument("--fake-latency", action="append", metavar="SERVICE=SPEC", help="Passed to fakes.py --latency")
+    parser.add_argument("--fake-error-rate", action="append", metavar="SERVICE=RATE", help="Passed to fakes.py --error-rate")
+    parser.add_argument("--fake-quota", action="append", metavar="SERVICE=RPS", help="Passed to fakes.py --quota")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    results = asyncio.run(run(options))
+
+    baseline = None
+    if options.compare:
+        baseline = json.loads(Path(options.compare).read_text())
+    print_report(results, baseline)
+
+    if options.output:
+        Path(options.output).write_text(json.dumps(results, indent=2))
+        print(f"\nResults written to {options.output}")
+
+
+if __name__ == "__main__":
+    main()
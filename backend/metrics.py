@@ -0,0 +1,413 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    REGISTRY
+)
+from pymongo import monitoring
+from starlette.requests import Request
+from starlette.responses import Response
+
+from tracing import start_span, traced_task
+
+logger = logging.getLogger(__name__)
+
+# Buckets tuned for an API whose handlers range from sub-millisecond cache hits
+# to multi-second payment provider calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template and status",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests currently being handled",
+    multiprocess_mode="livesum"
+)
+
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection and command",
+    ["collection", "command"],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "mongo_command_errors_total",
+    "MongoDB commands that failed, by collection and command",
+    ["collection", "command"]
+)
+
+# Pool wait buckets start lower: an idle connection is handed out in microseconds
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time from asking the pool for a connection to getting one (or giving up)",
+    ["address"],
+    buckets=POOL_WAIT_BUCKETS
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections",
+    "Pool connections by server and state (open, in_use, waiting checkouts)",
+    ["address", "state"],
+    multiprocess_mode="livesum"
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Connection checkouts that failed, by reason (timeout means the wait queue timed out)",
+    ["address", "reason"]
+)
+MONGO_POOL_CLEARED = Counter(
+    "mongo_pool_cleared_total",
+    "Times a server's pool was cleared after a network error or failover",
+    ["address"]
+)
+
+INTEGRATION_LATENCY = Histogram(
+    "integration_call_duration_seconds",
+    "Outbound integration call latency",
+    ["integration", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+INTEGRATION_ERRORS = Counter(
+    "integration_call_errors_total",
+    "Outbound integration calls that raised or returned a failure",
+    ["integration", "operation"]
+)
+
+BACKGROUND_TASKS_QUEUED = Gauge(
+    "background_tasks_queued",
+    "Background tasks started but not yet finished",
+    ["task"],
+    multiprocess_mode="livesum"
+)
+BACKGROUND_TASK_LATENCY = Histogram(
+    "background_task_duration_seconds",
+    "Background task run time",
+    ["task"],
+    buckets=LATENCY_BUCKETS
+)
+BACKGROUND_TASK_ERRORS = Counter(
+    "background_task_errors_total",
+    "Background tasks that raised",
+    ["task"]
+)
+BACKGROUND_JOBS_REQUEUED = Counter(
+    "background_jobs_requeued_total",
+    "Background jobs handed to the durable queue at shutdown instead of finishing, by task",
+    ["task"]
+)
+
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected with 429, by rate limit policy",
+    ["policy"]
+)
+
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests_total",
+    "Read endpoint calls by single-flight outcome (leader computed, follower shared, cached reused)",
+    ["endpoint", "outcome"]
+)
+
+CART_STORE_LOOKUPS = Counter(
+    "cart_store_lookups_total",
+    "Cart reads by store tier and whether the cart was found there",
+    ["tier", "result"]
+)
+CART_STORE_DIRTY = Gauge(
+    "cart_store_dirty_carts",
+    "Carts changed in memory and not yet written behind to Mongo",
+    multiprocess_mode="livesum"
+)
+
+WEBHOOK_INBOX_EVENTS = Counter(
+    "webhook_inbox_events_total",
+    "Webhook inbox events by provider and outcome (received, duplicate, processed, retry, failed)",
+    ["provider", "outcome"]
+)
+WEBHOOK_PROCESSING_LAG = Histogram(
+    "webhook_processing_lag_seconds",
+    "Time from webhook receipt to successful processing",
+    ["provider"],
+    buckets=LATENCY_BUCKETS
+)
+
+DB_ROUTED_REQUESTS = Counter(
+    "db_routed_requests_total",
+    "Requests whose reads were routed to the primary or to secondaries",
+    ["role"]
+)
+
+RECONCILE_CHECKS = Counter(
+    "payment_reconcile_checks_total",
+    "Pending transactions looked up with the payment provider, by provider and result",
+    ["provider", "result"]
+)
+
+SERVICE_STARTUP_SECONDS = Gauge(
+    "service_startup_seconds",
+    "Time taken to build each integration client at startup or first use",
+    ["component"],
+    multiprocess_mode="max"
+)
+SDK_IMPORT_SECONDS = Gauge(
+    "sdk_import_seconds",
+    "Time taken to import each deferred integration SDK",
+    ["sdk"],
+    multiprocess_mode="max"
+)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Motor/PyMongo command listener feeding the per-collection latency histogram"""
+
+    # Commands whose first value isn't a collection name
+    _NON_COLLECTION_COMMANDS = {"getMore"}
+
+    def __init__(self):
+        self._collections: Dict[Any, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name in self._NON_COLLECTION_COMMANDS:
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "_admin"
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event) -> str:
+        return self._collections.pop((event.connection_id, event.request_id), "_unknown")
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+        MONGO_COMMAND_ERRORS.labels(collection, event.command_name).inc()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """CMAP listener feeding the pool gauges and the checkout wait histogram
+
+    PyMongo emits the check-out events on the thread doing the checkout, so the
+    wait is timed per thread. Counts are also kept here for /api/admin/db/pool.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.pools: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _adjust(self, address: str, state: str, delta: int):
+        with self._lock:
+            counts = self.pools.setdefault(address, {"open": 0, "in_use": 0, "waiting": 0, "checkouts": 0, "failures": 0})
+            counts[state] += delta
+        if state in ("open", "in_use", "waiting"):
+            MONGO_POOL_CONNECTIONS.labels(address, state).inc(delta)
+
+    def pool_created(self, event):
+        self._adjust(self._address(event), "open", 0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        MONGO_POOL_CLEARED.labels(self._address(event)).inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._adjust(self._address(event), "open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._adjust(self._address(event), "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        self._adjust(self._address(event), "waiting", 1)
+
+    def _checkout_finished(self, address: str):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        self._adjust(address, "waiting", -1)
+        if started is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels(address).observe(time.perf_counter() - started)
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        self._checkout_finished(address)
+        self._adjust(address, "in_use", 1)
+        self._adjust(address, "checkouts", 1)
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        self._checkout_finished(address)
+        self._adjust(address, "failures", 1)
+        MONGO_POOL_CHECKOUT_FAILURES.labels(address, str(event.reason)).inc()
+
+    def connection_checked_in(self, event):
+        self._adjust(self._address(event), "in_use", -1)
+
+
+class IntegrationHealth:
+    """Recent outcomes of outbound calls per integration, for the readiness check
+
+    Calls are not short-circuited; the circuit state only reports what is failing
+    right now: "open" after `open_after` consecutive failures, "degraded" while any
+    of the calls in the last `window` seconds failed, otherwise "closed".
+    """
+
+    def __init__(self, window: float = 300, open_after: int = 5, max_outcomes: int = 200):
+        self.window = window
+        self.open_after = open_after
+        self.max_outcomes = max_outcomes
+        self._outcomes: Dict[str, Deque[Tuple[float, bool]]] = {}
+        self._consecutive_failures: Dict[str, int] = defaultdict(int)
+
+    def record(self, integration: str, ok: bool):
+        outcomes = self._outcomes.setdefault(integration, deque(maxlen=self.max_outcomes))
+        outcomes.append((time.monotonic(), ok))
+        self._consecutive_failures[integration] = 0 if ok else self._consecutive_failures[integration] + 1
+
+    def state(self, integration: str) -> Dict[str, Any]:
+        since = time.monotonic() - self.window
+        recent = [ok for at, ok in self._outcomes.get(integration, ()) if at >= since]
+        failures = recent.count(False)
+        consecutive = self._consecutive_failures[integration]
+        if consecutive >= self.open_after:
+            circuit = "open"
+        elif failures:
+            circuit = "degraded"
+        else:
+            circuit = "closed"
+        return {"circuit": circuit, "recent_calls": len(recent), "recent_failures": failures, "consecutive_failures": consecutive}
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        return {integration: self.state(integration) for integration in sorted(self._outcomes)}
+
+
+integration_health = IntegrationHealth()
+
+# Background tasks running in this process
+_tasks_in_flight: Dict[str, int] = defaultdict(int)
+
+
+def background_tasks_in_flight() -> int:
+    return sum(_tasks_in_flight.values())
+
+
+class IntegrationCall:
+    """Handle yielded by track_integration so callers can flag non-exception failures"""
+
+    def __init__(self):
+        self.error = False
+
+    def failed(self):
+        self.error = True
+
+
+@contextmanager
+def track_integration(integration: str, operation: str):
+    """Time an outbound call to Stripe, PayPal, SendGrid, Telegram or Sheets"""
+    call = IntegrationCall()
+    start = time.perf_counter()
+    try:
+        with start_span(f"{integration}.{operation}", integration=integration) as span:
+            yield call
+            if call.error and span is not None:
+                span.status = "error"
+    except Exception:
+        call.failed()
+        raise
+    finally:
+        INTEGRATION_LATENCY.labels(integration, operation).observe(time.perf_counter() - start)
+        integration_health.record(integration, not call.error)
+        if call.error:
+            INTEGRATION_ERRORS.labels(integration, operation).inc()
+
+
+def track_task(func: Callable) -> Callable:
+    """Wrap a background coroutine so it keeps the running-task gauge and run-time histogram up to date
+
+    Call it where the task is scheduled: the span of the request doing so becomes
+    the task's parent.
+    """
+    task_name = getattr(func, "__name__", "task")
+    traced = traced_task(func, name=f"task.{task_name}")
+
+    @functools.wraps(func)
+    async def run(*run_args, **run_kwargs):
+        BACKGROUND_TASKS_QUEUED.labels(task_name).inc()
+        _tasks_in_flight[task_name] += 1
+        start = time.perf_counter()
+        try:
+            return await traced(*run_args, **run_kwargs)
+        except Exception:
+            BACKGROUND_TASK_ERRORS.labels(task_name).inc()
+            raise
+        finally:
+            BACKGROUND_TASK_LATENCY.labels(task_name).observe(time.perf_counter() - start)
+            BACKGROUND_TASKS_QUEUED.labels(task_name).dec()
+            _tasks_in_flight[task_name] -= 1
+
+    return run
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Record request latency labelled by the matched route template rather than the raw path"""
+    start = time.perf_counter()
+    HTTP_REQUESTS_IN_PROGRESS.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_PROGRESS.dec()
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_LATENCY.labels(request.method, route_path, str(status)).observe(time.perf_counter() - start)
+
+
+def _registry():
+    # With several uvicorn/gunicorn workers each process writes to
+    # PROMETHEUS_MULTIPROC_DIR and the scrape aggregates them
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,149 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# payment_status -> the statuses it may be reached from. Anything else (a late
+# "pending" after "completed", a second "completed") is rejected by the filter.
+PAYMENT_TRANSITIONS: Dict[str, tuple] = {
+    "completed": ("pending", "failed"),
+    "failed": ("pending",),
+    "cancelled": ("pending", "failed"),
+    "refunded": ("completed",),
+}
+
+# Booking status that goes with each payment status; failed payments leave the booking pending
+BOOKING_STATUS_FOR: Dict[str, str] = {
+    "completed": "confirmed",
+    "cancelled": "cancelled",
+    "refunded": "cancelled",
+}
+
+
+async def ensure_payment_indexes(db):
+    await db.bookings.create_index([("id", ASCENDING)])
+    await db.bookings.create_index([("payment_session_id", ASCENDING)])
+    await db.bookings.create_index([("booking_reference", ASCENDING)])
+    await db.payment_transactions.create_index([("session_id", ASCENDING)])
+
+
+def _transition(to_status: str, source: str, reference: Optional[str], note: Optional[str]):
+    """Guard, field changes and history entry for moving a booking to to_status"""
+    allowed_from = PAYMENT_TRANSITIONS.get(to_status)
+    if allowed_from is None:
+        raise ValueError(f"Unknown payment status {to_status}")
+    now = datetime.now(timezone.utc).isoformat()
+    changes = {"payment_status": to_status, "payment_updated_at": now}
+    if to_status in BOOKING_STATUS_FOR:
+        changes["status"] = BOOKING_STATUS_FOR[to_status]
+    entry = {
+        "transition_id": uuid.uuid4().hex,
+        "to": to_status,
+        "source": source,
+        "reference": reference,
+        "note": note,
+        "at": now
+    }
+    return list(allowed_from), changes, entry
+
+
+async def transition_payment(
+    db,
+    query: Dict[str, Any],
+    to_status: str,
+    source: str,
+    reference: Optional[str] = None,
+    note: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Move one booking to to_status if its current payment status allows it
+
+    The allowed-from check, the status change and the append to payment_history
+    happen in a single find_one_and_update on the booking, which is the source of
+    truth; the payment transaction mirrors it in a second write. If the process
+    stops in between, sync_transaction_status (run by the reconciler) repairs the
+    transaction. Returns the updated booking, or None if nothing matched or the
+    transition isn't allowed.
+    """
+    allowed_from, changes, entry = _transition(to_status, source, reference, note)
+
+    # The document comes back as matched; the update is applied to it locally below
+    before = await db.bookings.find_one_and_update(
+        {**query, "payment_status": {"$in": allowed_from}},
+        {"$set": changes, "$push": {"payment_history": entry}},
+        projection={"_id": 0}
+    )
+    if before is None:
+        return None
+
+    booking = {**before, **changes, "payment_history": before.get("payment_history", []) + [entry]}
+    logger.info(f"Booking {booking['id']} payment {before.get('payment_status')} -> {to_status} ({source})")
+
+    if booking.get("payment_session_id"):
+        await db.payment_transactions.update_one(
+            {"session_id": booking["payment_session_id"], "payment_status": {"$in": allowed_from}},
+            {"$set": {"payment_status": to_status, "updated_at": changes["payment_updated_at"]}}
+        )
+    return booking
+
+
+async def transition_payments_bulk(
+    db,
+    transitions: List[Tuple[str, Optional[str]]],
+    to_status: str,
+    source: str,
+    note: Optional[str] = None
+) -> List[str]:
+    """Apply the same transition to many bookings, given as (booking id, reference) pairs, in one bulk_write
+
+    Each booking keeps the same guard as transition_payment. Returns the ids of
+    the bookings that actually moved; the others had already changed status.
+    """
+    if not transitions:
+        return []
+    operations = []
+    marks = []
+    for booking_id, reference in transitions:
+        allowed_from, changes, entry = _transition(to_status, source, reference, note)
+        operations.append(UpdateOne(
+            {"id": booking_id, "payment_status": {"$in": allowed_from}},
+            {"$set": changes, "$push": {"payment_history": entry}}
+        ))
+        marks.append(entry["transition_id"])
+    await db.bookings.bulk_write(operations, ordered=False)
+
+    moved = await db.bookings.find(
+        {"id": {"$in": [booking_id for booking_id, _ in transitions]}, "payment_history.transition_id": {"$in": marks}},
+        {"_id": 0, "id": 1, "payment_session_id": 1}
+    ).to_list(length=None)
+    sessions = [booking["payment_session_id"] for booking in moved if booking.get("payment_session_id")]
+    if sessions:
+        await db.payment_transactions.update_many(
+            {"session_id": {"$in": sessions}, "payment_status": {"$in": list(PAYMENT_TRANSITIONS[to_status])}},
+            {"$set": {"payment_status": to_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    logger.info(f"{len(moved)} of {len(transitions)} bookings moved to payment {to_status} ({source})")
+    return [booking["id"] for booking in moved]
+
+
+async def sync_transaction_status(db, session_id: str) -> Optional[str]:
+    """Bring a payment transaction in line with its booking; returns the status it was moved to
+
+    Idempotent: returns None when the two already agree, the booking is still
+    pending, or there is no booking for the session.
+    """
+    booking = await db.bookings.find_one({"payment_session_id": session_id}, {"_id": 0, "id": 1, "payment_status": 1})
+    if booking is None or booking.get("payment_status") in (None, "pending"):
+        return None
+    to_status = booking["payment_status"]
+    result = await db.payment_transactions.update_one(
+        {"session_id": session_id, "payment_status": {"$ne": to_status}},
+        {"$set": {"payment_status": to_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    if not result.modified_count:
+        return None
+    logger.warning(f"Payment transaction {session_id} was behind booking {booking['id']}; moved it to {to_status}")
+    return to_status
@@ -0,0 +1,194 @@
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from metrics import RATE_LIMIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_COLLECTION = "rate_limits"
+
+
+class RateLimitPolicy:
+    """Token bucket for one route: `capacity` requests in a burst, refilled at `refill_per_second`
+
+    key_by picks what a bucket belongs to: "ip" for the client address, or a path
+    parameter captured by the route pattern (e.g. "cart_id").
+    """
+
+    def __init__(self, name: str, method: str, path_pattern: str, capacity: int, refill_per_second: float, key_by: str = "ip"):
+        self.name = name
+        self.method = method
+        self.path_regex = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", path_pattern) + "$")
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.key_by = key_by
+
+    def match(self, method: str, path: str) -> Optional[Dict[str, str]]:
+        if method != self.method:
+            return None
+        match = self.path_regex.match(path)
+        return match.groupdict() if match else None
+
+    def seconds_until_token(self, tokens: float) -> int:
+        return max(1, math.ceil((1 - tokens) / self.refill_per_second))
+
+
+# Cart creation writes a document and checkout calls Stripe/PayPal, so both are
+# limited per client; checkout is also limited per cart so one IP rotating carts
+# and many IPs hammering one cart are both caught
+DEFAULT_POLICIES = [
+    RateLimitPolicy("cart_create_ip", "POST", "/api/cart/create", capacity=10, refill_per_second=10 / 60),
+    RateLimitPolicy("cart_add_ip", "POST", "/api/cart/{cart_id}/add", capacity=60, refill_per_second=1),
+    # A batch carries up to CART_BATCH_MAX_OPERATIONS changes, so it gets a smaller bucket than /add
+    RateLimitPolicy("cart_batch_ip", "POST", "/api/cart/{cart_id}/items:batch", capacity=20, refill_per_second=20 / 60),
+    RateLimitPolicy("checkout_ip", "POST", "/api/cart/{cart_id}/checkout", capacity=10, refill_per_second=10 / 600),
+    RateLimitPolicy("checkout_cart", "POST", "/api/cart/{cart_id}/checkout", capacity=5, refill_per_second=5 / 600, key_by="cart_id"),
+    RateLimitPolicy("contact_ip", "POST", "/api/contact", capacity=5, refill_per_second=5 / 600),
+]
+
+
+class MemoryBucketStore:
+    """Per-process buckets; with several workers each enforces its own share of the limit"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, refill_per_second: float, now: float) -> Tuple[bool, float]:
+        tokens, updated = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    async def refund(self, key: str, capacity: int):
+        """Give back a token taken for a request that another bucket rejected"""
+        if key in self._buckets:
+            tokens, updated = self._buckets[key]
+            self._buckets[key] = (min(capacity, tokens + 1), updated)
+
+
+class MongoBucketStore:
+    """Buckets shared by all workers, updated atomically with one pipeline update per request"""
+
+    def __init__(self, get_collection: Callable):
+        self.get_collection = get_collection
+
+    async def take(self, key: str, capacity: int, refill_per_second: float, now: float) -> Tuple[bool, float]:
+        idle_seconds = capacity / refill_per_second
+        bucket = await self.get_collection().find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [capacity, {"$add": [
+                        {"$ifNull": ["$tokens", capacity]},
+                        {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, refill_per_second]}
+                    ]}]},
+                    "updated_at": now
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    # A bucket idle long enough to refill completely can be dropped
+                    "expires_at": datetime.fromtimestamp(now, timezone.utc) + timedelta(seconds=idle_seconds)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bucket["allowed"], bucket["tokens"]
+
+    async def refund(self, key: str, capacity: int):
+        """Give back a token taken for a request that another bucket rejected"""
+        await self.get_collection().update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [capacity, {"$add": ["$tokens", 1]}]}}}]
+        )
+
+
+async def ensure_rate_limit_indexes(db):
+    await db[RATE_LIMIT_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+
+
+class RateLimiter:
+    """Applies every matching policy to a request
+
+    trusted_proxies is how many reverse proxies sit in front of the app, each
+    appending the address it saw to X-Forwarded-For; the client is the entry the
+    outermost of them added. Entries further left come from the client itself and
+    are ignored. With 0 the header isn't trusted at all.
+    """
+
+    def __init__(self, policies: List[RateLimitPolicy], store, trusted_proxies: int = 0):
+        self.policies = policies
+        self.store = store
+        self.trusted_proxies = trusted_proxies
+
+    def client_ip(self, request: Request) -> str:
+        if self.trusted_proxies:
+            forwarded = request.headers.get("x-forwarded-for")
+            entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()] if forwarded else []
+            if entries:
+                return entries[max(0, len(entries) - self.trusted_proxies)]
+        return request.client.host if request.client else "unknown"
+
+    async def check(self, request: Request) -> Optional[int]:
+        """Take a token from every bucket the request falls under; returns Retry-After seconds if any is empty
+
+        A rejected request gives back the tokens it took from the other buckets,
+        so it doesn't count against limits it didn't get past.
+        """
+        retry_after = None
+        now = time.time()
+        taken = []
+        for policy in self.policies:
+            params = policy.match(request.method, request.url.path)
+            if params is None:
+                continue
+            subject = self.client_ip(request) if policy.key_by == "ip" else params.get(policy.key_by)
+            if not subject:
+                continue
+            key = f"{policy.name}:{subject}"
+            try:
+                allowed, tokens = await self.store.take(key, policy.capacity, policy.refill_per_second, now)
+            except Exception as e:
+                # Fail open: a store outage shouldn't take cart and checkout down with it
+                logger.error(f"Rate limit store error for {policy.name}: {str(e)}")
+                continue
+            if allowed:
+                taken.append((key, policy))
+            else:
+                RATE_LIMIT_REJECTIONS.labels(policy.name).inc()
+                retry_after = max(retry_after or 0, policy.seconds_until_token(tokens))
+        if retry_after is not None:
+            for key, policy in taken:
+                try:
+                    await self.store.refund(key, policy.capacity)
+                except Exception as e:
+                    logger.error(f"Rate limit refund failed for {policy.name}: {str(e)}")
+        return retry_after
+
+    async def middleware(self, request: Request, call_next):
+        """Reject over-limit requests with 429 before they reach Mongo or a payment provider"""
+        retry_after = await self.check(request)
+        if retry_after is not None:
+            logger.warning(f"Rate limited {request.method} {request.url.path} from {self.client_ip(request)}")
+            return JSONResponse(
+                {"detail": "Too many requests, please retry later"},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)}
+            )
+        return await call_next(request)
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from metrics import RECONCILE_CHECKS
+from payment_state import sync_transaction_status
+from tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_RUNS_COLLECTION = "payment_reconcile_runs"
+RECONCILE_LOCK_ID = "payment_reconciler_lock"
+
+# Provider lookup: session id -> payment status to move to, or None if still pending
+StatusLookup = Callable[[str], Awaitable[Optional[str]]]
+
+
+async def ensure_reconcile_indexes(db):
+    await db.payment_transactions.create_index([("payment_status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)])
+    await db[RECONCILE_RUNS_COLLECTION].create_index([("started_at", ASCENDING)])
+
+
+class PaymentReconciler:
+    """Polls Stripe/PayPal for transactions still pending after their webhook should have arrived
+
+    Pending transactions older than min_age are paged oldest first and looked up
+    in batches, at most `concurrency` calls at a time per provider and no faster
+    than `rate_per_second` per provider (shared across workers when the bucket
+    store is). Each transaction is checked again no sooner than `recheck`, and one
+    run makes at most max_checks lookups, so a backlog after an outage is cleared
+    over a few runs instead of one burst. Results go through `apply`, the same
+    status path the webhooks use.
+    """
+
+    def __init__(self, get_db: Callable, lookups: Dict[str, StatusLookup],
+                 apply: Callable[[str, str, str], Awaitable[Any]], bucket_store,
+                 interval: float = 600, min_age: timedelta = timedelta(minutes=15),
+                 max_age: timedelta = timedelta(days=14), recheck: timedelta = timedelta(minutes=30),
+                 batch_size: int = 50, concurrency: int = 4, rate_per_second: float = 5,
+                 max_checks: int = 500):
+        self.get_db = get_db
+        self.lookups = lookups
+        self.apply = apply
+        self.bucket_store = bucket_store
+        self.interval = interval
+        self.min_age = min_age
+        self.max_age = max_age
+        self.recheck = recheck
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.max_checks = max_checks
+        self._semaphores = {provider: asyncio.Semaphore(concurrency) for provider in lookups}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Payment reconciliation failed: {str(e)}")
+
+    async def _acquire_lease(self, db, now: datetime) -> bool:
+        """Only one worker sweeps at a time; the lease expires if that worker dies mid-run"""
+        try:
+            await db[RECONCILE_RUNS_COLLECTION].update_one(
+                {"_id": RECONCILE_LOCK_ID, "lease_until": {"$lt": now.isoformat()}},
+                {"$set": {"lease_until": (now + timedelta(seconds=max(self.interval, 300))).isoformat()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _release_lease(self, db):
+        await db[RECONCILE_RUNS_COLLECTION].update_one(
+            {"_id": RECONCILE_LOCK_ID},
+            {"$set": {"lease_until": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def _take_token(self, provider: str):
+        while True:
+            allowed, _ = await self.bucket_store.take(
+                f"reconcile:{provider}", max(1, int(self.rate_per_second)), self.rate_per_second, time.time()
+            )
+            if allowed:
+                return
+            await asyncio.sleep(1 / self.rate_per_second)
+
+    async def _check(self, db, transaction: Dict[str, Any], counts: Dict[str, Dict[str, int]]):
+        provider = transaction.get("payment_provider")
+        session_id = transaction["session_id"]
+        lookup = self.lookups.get(provider)
+        if lookup is None:
+            counts[provider or "unknown"]["skipped"] += 1
+            return
+        if await sync_transaction_status(db, session_id) is not None:
+            # The booking had already moved; only the transaction's mirror write was missing
+            result = "repaired"
+        else:
+            result = await self._lookup(provider, lookup, session_id)
+        counts[provider][result] += 1
+        RECONCILE_CHECKS.labels(provider, result).inc()
+        await db.payment_transactions.update_one(
+            {"id": transaction["id"]},
+            {"$set": {"reconcile_checked_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"reconcile_checks": 1}}
+        )
+
+    async def _lookup(self, provider: str, lookup: StatusLookup, session_id: str) -> str:
+        async with self._semaphores[provider]:
+            await self._take_token(provider)
+            try:
+                to_status = await lookup(session_id)
+            except Exception as e:
+                logger.error(f"Reconcile lookup {provider} {session_id} failed: {str(e)}")
+                result = "error"
+            else:
+                if to_status is None:
+                    result = "unchanged"
+                elif await self.apply(session_id, to_status, provider) is not None:
+                    result = to_status
+                else:
+                    # A webhook got there first, or the transition isn't allowed
+                    result = "already_applied"
+        return result
+
+    async def run(self) -> Optional[Dict[str, Any]]:
+        """One sweep; returns its report, or None if another worker is already sweeping"""
+        db = self.get_db()
+        started = datetime.now(timezone.utc)
+        if not await self._acquire_lease(db, started):
+            return None
+
+        counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        query = {
+            "payment_status": "pending",
+            "created_at": {"$gte": (started - self.max_age).isoformat(), "$lte": (started - self.min_age).isoformat()},
+            "reconcile_checked_at": {"$not": {"$gte": (started - self.recheck).isoformat()}}
+        }
+        checked = 0
+        last_key = None
+        try:
+            with start_span("reconcile.run"):
+                while checked < self.max_checks:
+                    page_query = dict(query)
+                    if last_key is not None:
+                        # Keyset paging on (created_at, id) so rows updated mid-run don't shift pages
+                        page_query["$or"] = [
+                            {"created_at": {"$gt": last_key[0]}},
+                            {"created_at": last_key[0], "id": {"$gt": last_key[1]}}
+                        ]
+                    limit = min(self.batch_size, self.max_checks - checked)
+                    batch: List[Dict[str, Any]] = await db.payment_transactions.find(
+                        page_query, {"_id": 0, "id": 1, "session_id": 1, "payment_provider": 1, "created_at": 1}
+                    ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).limit(limit).to_list(length=None)
+                    if not batch:
+                        break
+                    await asyncio.gather(*(self._check(db, transaction, counts) for transaction in batch))
+                    checked += len(batch)
+                    last_key = (batch[-1]["created_at"], batch[-1]["id"])
+                    if len(batch) < limit:
+                        break
+        finally:
+            await self._release_lease(db)
+
+        report = {
+            "started_at": started.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "checked": checked,
+            "max_checks_reached": checked >= self.max_checks,
+            "providers": {provider: dict(results) for provider, results in counts.items()}
+        }
+        await db[RECONCILE_RUNS_COLLECTION].insert_one(dict(report))
+        logger.info(f"Payment reconciliation checked {checked} pending transactions: {report['providers']}")
+        return report
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
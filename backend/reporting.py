@@ -0,0 +1,183 @@
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Rollup collections, all maintained with $inc when a booking is confirmed. Each rollup
+# document lists the bookings counted in it (applied_ids), which guards every $inc:
+#   report_service_daily        - per service per service date (booking_date): revenue, units, guests
+#   report_payment_method_daily - per payment method per confirmation date: revenue, bookings
+#   report_hourly               - per confirmation hour (UTC): revenue, bookings, guests
+SERVICE_DAILY = "report_service_daily"
+PAYMENT_METHOD_DAILY = "report_payment_method_daily"
+HOURLY = "report_hourly"
+
+
+async def ensure_report_indexes(db):
+    """Range reads are by day; the _id is the composite rollup key used for upserts"""
+    await db[SERVICE_DAILY].create_index([("day", ASCENDING), ("service_id", ASCENDING)])
+    await db[PAYMENT_METHOD_DAILY].create_index([("day", ASCENDING), ("payment_method", ASCENDING)])
+    await db[HOURLY].create_index([("day", ASCENDING), ("hour", ASCENDING)])
+
+
+def rollup_changes(booking: Dict[str, Any], confirmed_at: datetime) -> Dict[str, Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]]:
+    """What one confirmed booking adds to each rollup: collection -> _id -> (fields on insert, increments)"""
+    confirmed_day = confirmed_at.date().isoformat()
+    confirmed_hour = confirmed_at.hour
+    items = booking.get('items') or []
+    total_amount = float(booking.get('total_amount') or 0)
+    total_guests = sum(int(item.get('quantity') or 0) for item in items)
+
+    # Items for the same service and day share one rollup document, so they are summed here
+    service_changes: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+    for item in items:
+        service_day = str(item.get('booking_date') or confirmed_day)[:10]
+        quantity = int(item.get('quantity') or 0)
+        revenue = float(item.get('subtotal') or item.get('price', 0) * quantity)
+        key = f"{service_day}|{item.get('service_id')}"
+        on_insert, increments = service_changes.setdefault(key, (
+            {"day": service_day, "service_id": item.get('service_id'), "name": item.get('name')},
+            {"revenue": 0.0, "units": 0, "guests": 0}
+        ))
+        increments["revenue"] += revenue
+        increments["units"] += 1
+        increments["guests"] += quantity
+
+    payment_method = booking.get('payment_method') or 'unknown'
+    return {
+        SERVICE_DAILY: service_changes,
+        PAYMENT_METHOD_DAILY: {f"{confirmed_day}|{payment_method}": (
+            {"day": confirmed_day, "payment_method": payment_method},
+            {"revenue": total_amount, "bookings": 1}
+        )},
+        HOURLY: {f"{confirmed_day}|{confirmed_hour:02d}": (
+            {"day": confirmed_day, "hour": confirmed_hour},
+            {"revenue": total_amount, "bookings": 1, "guests": total_guests}
+        )},
+    }
+
+
+def build_rollup_operations(booking: Dict[str, Any], confirmed_at: datetime) -> Dict[str, List[UpdateOne]]:
+    """Build the guarded $inc upserts for one confirmed booking, grouped by rollup collection
+
+    If the booking is already in a document's applied_ids the filter misses and the
+    upsert collides with the existing _id: a duplicate key error instead of a second count.
+    """
+    booking_id = booking['id']
+    return {
+        collection: [
+            UpdateOne(
+                {"_id": key, "applied_ids": {"$ne": booking_id}},
+                {"$setOnInsert": on_insert, "$inc": increments, "$addToSet": {"applied_ids": booking_id}},
+                upsert=True
+            )
+            for key, (on_insert, increments) in changes.items()
+        ]
+        for collection, changes in rollup_changes(booking, confirmed_at).items()
+    }
+
+
+async def _bulk_write_counted_once(db, collection: str, operations: List[UpdateOne]):
+    """bulk_write that treats "already counted" duplicate key errors as success"""
+    try:
+        await db[collection].bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if errors:
+            raise
+
+
+async def apply_booking_rollups(db, booking_id: str, confirmed_at: Optional[datetime] = None) -> bool:
+    """Add a confirmed booking to the rollups exactly once; returns False if it was already counted
+
+    The $inc upserts are guarded per rollup document by applied_ids, so they can be
+    retried after a crash; the booking is only marked rollup_applied once they have
+    all gone through. The confirmation time that picks the day and hour buckets is
+    stored first, so a retry lands in the same buckets.
+    """
+    booking = await db.bookings.find_one(
+        {"id": booking_id},
+        {"_id": 0, "id": 1, "items": 1, "total_amount": 1, "payment_method": 1,
+         "rollup_applied": 1, "rollup_applied_at": 1, "rollup_reversed_at": 1}
+    )
+    if not booking or booking.get("rollup_applied") or booking.get("rollup_reversed_at"):
+        return False
+
+    if not booking.get("rollup_applied_at"):
+        confirmed_at = confirmed_at or datetime.now(timezone.utc)
+        await db.bookings.update_one(
+            {"id": booking_id, "rollup_applied_at": {"$exists": False}},
+            {"$set": {"rollup_applied_at": confirmed_at.isoformat()}}
+        )
+        # A concurrent retry may have stored its time first; everyone uses that one
+        booking["rollup_applied_at"] = (await db.bookings.find_one({"id": booking_id}, {"_id": 0, "rollup_applied_at": 1}))["rollup_applied_at"]
+    confirmed_at = datetime.fromisoformat(booking["rollup_applied_at"])
+
+    for collection, operations in build_rollup_operations(booking, confirmed_at).items():
+        if operations:
+            await _bulk_write_counted_once(db, collection, operations)
+
+    result = await db.bookings.update_one({"id": booking_id, "rollup_applied": {"$ne": True}}, {"$set": {"rollup_applied": True}})
+    return result.modified_count == 1
+
+
+async def reverse_booking_rollups(db, booking_id: str) -> bool:
+    """Take a refunded booking back out of the rollups; returns False if there was nothing to take out
+
+    Each $inc is guarded by the booking being in the document's applied_ids and
+    pulls it from there, so a retry doesn't subtract twice. The booking is marked
+    rollup_reversed_at first, which stops a late apply_booking_rollups adding it back.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    await db.bookings.update_one(
+        {"id": booking_id, "rollup_reversed_at": {"$exists": False}},
+        {"$set": {"rollup_reversed_at": now}}
+    )
+    booking = await db.bookings.find_one(
+        {"id": booking_id},
+        {"_id": 0, "id": 1, "items": 1, "total_amount": 1, "payment_method": 1, "rollup_applied_at": 1}
+    )
+    if not booking or not booking.get("rollup_applied_at"):
+        return False
+    confirmed_at = datetime.fromisoformat(booking["rollup_applied_at"])
+
+    reversed_any = False
+    for collection, changes in rollup_changes(booking, confirmed_at).items():
+        operations = [
+            UpdateOne(
+                {"_id": key, "applied_ids": booking_id},
+                {"$inc": {field: -value for field, value in increments.items()}, "$pull": {"applied_ids": booking_id}}
+            )
+            for key, (_, increments) in changes.items()
+        ]
+        if operations:
+            result = await db[collection].bulk_write(operations, ordered=False)
+            reversed_any = reversed_any or result.modified_count > 0
+    return reversed_any
+
+
+async def read_reports(db, start_date: date, end_date: date) -> Dict[str, Any]:
+    """Read the rollups for an inclusive date range; cost is proportional to days, not bookings"""
+    day_range = {"day": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}}
+
+    projection = {"_id": 0, "applied_ids": 0}
+    by_service = await db[SERVICE_DAILY].find(day_range, projection).sort([("day", 1), ("service_id", 1)]).to_list(length=None)
+    by_payment_method = await db[PAYMENT_METHOD_DAILY].find(day_range, projection).sort([("day", 1), ("payment_method", 1)]).to_list(length=None)
+    by_hour = await db[HOURLY].find(day_range, projection).sort([("day", 1), ("hour", 1)]).to_list(length=None)
+
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "totals": {
+            "revenue": round(sum(row.get('revenue', 0) for row in by_payment_method), 2),
+            "bookings": sum(row.get('bookings', 0) for row in by_payment_method),
+            "guests": sum(row.get('guests', 0) for row in by_hour)
+        },
+        "by_service": by_service,
+        "by_payment_method": by_payment_method,
+        "by_hour": by_hour
+    }
@@ -1,4 +1,9 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, BackgroundTasks, Depends
+from time import perf_counter
+SERVER_IMPORT_STARTED = perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Request, BackgroundTasks, Depends, Header, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -6,18 +11,37 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone, date, time, timedelta
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
-import sendgrid
-from sendgrid.helpers.mail import Mail
+import asyncio
 import httpx
 import json
-import paypalrestsdk
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import hmac
+from waiver_pdf import WaiverPdfPipeline
+from reporting import apply_booking_rollups, ensure_report_indexes, read_reports, reverse_booking_rollups
+from lazy_imports import LazyImporter
+from metrics import (
+    MongoCommandMetrics, MongoPoolMetrics, background_tasks_in_flight, integration_health,
+    metrics_endpoint, metrics_middleware, track_integration
+)
+from tracing import configure_tracing, set_booking_id, start_span, tracer, tracing_middleware
+from coalesce import coalesce
+from capacity import SlotBusy, check_capacity, ensure_capacity_indexes, hold_slots, load_capacities, requested_quantities
+from cart_store import MongoCartStore, TieredCartStore
+from cart_tokens import CartTokenSigner, InvalidCartToken
+from rate_limit import DEFAULT_POLICIES, MemoryBucketStore, MongoBucketStore, RateLimiter, ensure_rate_limit_indexes
+from db_routing import ReadRouter, parse_read_routes
+from health import HealthChecker
+from jobs import BackgroundJobs, ensure_job_indexes
+from cold_storage import COLD_COLLECTIONS, ColdStore, ensure_cold_indexes, load_codec
+from lifecycle import BOOKINGS_ARCHIVE, BookingArchiver, PendingBookingPolicy, ensure_archive_indexes
+from statements import MANUAL_PAYMENT_METHODS, import_statement
+from reconcile import RECONCILE_RUNS_COLLECTION, PaymentReconciler, ensure_reconcile_indexes
+from payment_state import PAYMENT_TRANSITIONS, ensure_payment_indexes, transition_payment
+from webhook_inbox import INBOX_STATUSES, WEBHOOK_INBOX_COLLECTION, WebhookInbox, ensure_inbox_indexes
+from exports import EXPORT_COLLECTIONS, EXPORT_FORMATS, build_export_query, ensure_export_indexes, resolve_columns, stream_export
+from services import ServiceContainer
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -29,13 +53,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Integration clients (Mongo, Google Sheets, PayPal, waiver PDF workers) are built
+# by the lifespan below rather than at import time; see "Global services"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start integration services, then close them in reverse order on shutdown"""
+    check_required_config()
+    await services.startup(include_lazy=SERVICE_WARMUP)
+    await ensure_indexes()
+    warmup_task = asyncio.create_task(warm_up_sdks()) if SDK_WARMUP else None
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await graceful_shutdown()
+    tracer.shutdown()
+
+def check_required_config():
+    """Refuse to start with settings that would break once several workers or a restart are involved"""
+    if not CART_TOKEN_SECRET and not (WEB_CONCURRENCY_KNOWN and WEB_CONCURRENCY == 1):
+        # Each worker would sign with its own random key and reject the others' cart ids
+        raise RuntimeError("CART_TOKEN_SECRET must be set (the same value on every worker) unless WEB_CONCURRENCY=1")
 
 # Create the main app without a prefix
-app = FastAPI(title="Exclusive Gulf Float Enhanced API")
+app = FastAPI(title="Exclusive Gulf Float Enhanced API", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -51,17 +91,147 @@ TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
 PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID', 'paypal_client_id_here')
 PAYPAL_CLIENT_SECRET = os.environ.get('PAYPAL_CLIENT_SECRET', 'paypal_client_secret_here')
 PAYPAL_MODE = os.environ.get('PAYPAL_MODE', 'sandbox')  # 'sandbox' or 'live'
+# Id of the webhook registered in the PayPal app; webhooks are rejected until it is set
+PAYPAL_WEBHOOK_ID = os.environ.get('PAYPAL_WEBHOOK_ID')
 
 # Google Sheets Configuration
 GOOGLE_CREDENTIALS_FILE = os.environ.get('GOOGLE_CREDENTIALS_FILE', 'google_credentials.json')
 GOOGLE_SPREADSHEET_ID = os.environ.get('GOOGLE_SPREADSHEET_ID', 'your_spreadsheet_id_here')
 
+# Integration endpoint overrides, used to point the app at the local fakes (see fakes.py)
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+PAYPAL_API_BASE = os.environ.get('PAYPAL_API_BASE')
+SENDGRID_API_BASE = os.environ.get('SENDGRID_API_BASE', 'https://api.sendgrid.com')
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+GOOGLE_SHEETS_API_BASE = os.environ.get('GOOGLE_SHEETS_API_BASE')
+
+# Admin Configuration: state-changing /api/admin endpoints need "Authorization: Bearer <ADMIN_API_TOKEN>";
+# without a token configured they are disabled
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+
+# Cart Configuration
+# Signs cart ids; must be the same on every worker and survive restarts. Required unless
+# WEB_CONCURRENCY=1 is set explicitly (see check_required_config)
+CART_TOKEN_SECRET = os.environ.get('CART_TOKEN_SECRET')
+CART_TTL = timedelta(hours=int(os.environ.get('CART_TTL_HOURS', '1')))
+CART_BATCH_MAX_OPERATIONS = int(os.environ.get('CART_BATCH_MAX_OPERATIONS', '50'))
+# 'tiered' keeps hot carts in memory and writes behind to Mongo; 'auto' picks it when it is safe
+CART_STORE = os.environ.get('CART_STORE', 'auto')  # 'auto', 'tiered' or 'mongo'
+CART_STORE_AFFINITY = os.environ.get('CART_STORE_AFFINITY', 'false').lower() == 'true'  # LB pins each cart to one worker
+CART_STORE_CAPACITY = int(os.environ.get('CART_STORE_CAPACITY', '10000'))
+CART_STORE_MAX_LAG = float(os.environ.get('CART_STORE_MAX_LAG', '2.0'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))  # uvicorn/gunicorn worker count
+WEB_CONCURRENCY_KNOWN = 'WEB_CONCURRENCY' in os.environ  # unset means "maybe several workers" to the cart store
+
+# Capacity Configuration: JSON units per slot, e.g. {"crystal_kayak": 4}; unlisted services are unlimited
+SERVICE_CAPACITY = load_capacities(os.environ.get('SERVICE_CAPACITY'))
+CAPACITY_PENDING_HOLD = timedelta(minutes=int(os.environ.get('CAPACITY_PENDING_HOLD_MINUTES', '60')))
+
+# Waiver PDF Configuration
+WAIVER_PDF_CACHE_DIR = Path(os.environ.get('WAIVER_PDF_CACHE_DIR', str(ROOT_DIR / 'waiver_pdfs')))
+WAIVER_PDF_WORKERS = int(os.environ.get('WAIVER_PDF_WORKERS', '2'))
+
+# Tracing Configuration
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '10000'))
+TRACE_FILE = os.environ.get('TRACE_FILE')  # e.g. /var/log/egf/traces.ndjson
+
+# Service startup: lazy services (Sheets, PayPal) are built on first use unless warmed up
+SERVICE_WARMUP = os.environ.get('SERVICE_WARMUP', 'false').lower() == 'true'
+# Integration SDKs are imported on first use; the warm-up imports the rest once the app is serving
+SDK_WARMUP = os.environ.get('SDK_WARMUP', 'true').lower() == 'true'
+SDK_WARMUP_DELAY = float(os.environ.get('SDK_WARMUP_DELAY', '2.0'))
+
+# Rate limiting Configuration
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')  # 'memory' or 'mongo' (shared across workers)
+# Reverse proxies in front of the app that append to X-Forwarded-For; 0 ignores the header.
+# RATE_LIMIT_TRUST_FORWARDED=true is the older spelling of one proxy.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES') or (
+    '1' if os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true' else '0'))
+
+# Health check Configuration: /healthz (liveness) and /readyz (readiness, cached per worker)
+READY_CACHE_SECONDS = float(os.environ.get('READY_CACHE_SECONDS', '5'))
+READY_MONGO_TIMEOUT = float(os.environ.get('READY_MONGO_TIMEOUT_SECONDS', '2'))
+READY_MONGO_DEGRADED_MS = float(os.environ.get('READY_MONGO_DEGRADED_MS', '250'))
+# Integrations whose open circuit takes the worker out of rotation; the rest only report degraded
+READY_REQUIRED_INTEGRATIONS = [name.strip() for name in os.environ.get('READY_REQUIRED_INTEGRATIONS', '').split(',') if name.strip()]
+READY_BACKGROUND_TASKS_DEGRADED = int(os.environ.get('READY_BACKGROUND_TASKS_DEGRADED', '50'))
+READY_BACKGROUND_TASKS_FAIL = int(os.environ.get('READY_BACKGROUND_TASKS_FAIL', '500'))
+
+# Shutdown Configuration: background jobs and webhook events get this long to finish before they
+# are handed back to their durable queues; keep it below the process manager's kill timeout
+# (gunicorn --graceful-timeout, Kubernetes terminationGracePeriodSeconds)
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '20'))
+
+# Webhook inbox Configuration
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+
+# Payment reconciliation Configuration: polls providers for pending payments whose webhook never came
+RECONCILE_ENABLED = os.environ.get('RECONCILE_ENABLED', 'true').lower() == 'true'
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '600'))
+RECONCILE_MIN_AGE = timedelta(minutes=int(os.environ.get('RECONCILE_MIN_AGE_MINUTES', '15')))
+RECONCILE_MAX_AGE = timedelta(days=int(os.environ.get('RECONCILE_MAX_AGE_DAYS', '14')))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '4'))  # per provider
+RECONCILE_RATE = float(os.environ.get('RECONCILE_RATE_PER_SECOND', '5'))  # per provider
+RECONCILE_MAX_CHECKS = int(os.environ.get('RECONCILE_MAX_CHECKS', '500'))  # per run
+
+# Booking lifecycle Configuration: unpaid bookings older than this move to bookings_archive
+BOOKING_ARCHIVE_ENABLED = os.environ.get('BOOKING_ARCHIVE_ENABLED', 'true').lower() == 'true'
+BOOKING_ARCHIVE_PENDING = timedelta(hours=int(os.environ.get('BOOKING_ARCHIVE_PENDING_HOURS', '48')))
+BOOKING_ARCHIVE_MANUAL_PENDING = timedelta(days=int(os.environ.get('BOOKING_ARCHIVE_MANUAL_PENDING_DAYS', '14')))  # Venmo, Cash App, Zelle
+BOOKING_ARCHIVE_INTERVAL = float(os.environ.get('BOOKING_ARCHIVE_INTERVAL_SECONDS', '3600'))
+BOOKING_ARCHIVE_BATCH_SIZE = int(os.environ.get('BOOKING_ARCHIVE_BATCH_SIZE', '500'))
+# Capacity holds for unpaid manual-method bookings last as long as the archiver leaves them in bookings
+CAPACITY_PENDING_HOLD_FOR_METHOD = {method: BOOKING_ARCHIVE_MANUAL_PENDING for method in MANUAL_PAYMENT_METHODS}
+
+# Read routing Configuration: admin/report/export reads go to secondaries (see db_routing.py). To try it
+# locally, start a replica set (e.g. mongod --replSet rs0 on three ports, rs.initiate()) and point
+# MONGO_URL at it with ?replicaSet=rs0, then check GET /api/admin/db/routing?probe=true
+DB_READ_ROUTES = os.environ.get('DB_READ_ROUTES')  # JSON, e.g. {"GET /api/admin/webhooks": "primary"}
+DB_READ_MAX_STALENESS = int(os.environ.get('DB_READ_MAX_STALENESS_SECONDS', '90'))
+
+# Mongo pool Configuration: each worker process has its own pool, so MONGO_MAX_CONNECTIONS
+# (the budget for this host) is split across WEB_CONCURRENCY workers unless MONGO_MAX_POOL_SIZE is set
+MONGO_MAX_CONNECTIONS = int(os.environ.get('MONGO_MAX_CONNECTIONS', '0'))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE') or (max(1, MONGO_MAX_CONNECTIONS // WEB_CONCURRENCY) if MONGO_MAX_CONNECTIONS else 100))
+MONGO_MIN_POOL_SIZE = min(int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')), MONGO_MAX_POOL_SIZE)
+MONGO_MAX_IDLE_TIME_MS = os.environ.get('MONGO_MAX_IDLE_TIME_MS')  # unset keeps idle connections open
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS')  # unset waits for a free connection indefinitely
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS')  # e.g. 'zstd,zlib'; zstd and snappy need their packages
+
+# Cold archive Configuration: months older than ARCHIVE_HOT_MONTHS move from Mongo to compressed files
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'cold_archive')))  # shared by all worker hosts
+ARCHIVE_CODEC = os.environ.get('ARCHIVE_CODEC', 'gzip')  # 'gzip' or 'zstd' (needs the zstandard package)
+ARCHIVE_HOT_MONTHS = int(os.environ.get('ARCHIVE_HOT_MONTHS', '12'))
+ARCHIVE_TIERING_ENABLED = os.environ.get('ARCHIVE_TIERING_ENABLED', 'false').lower() == 'true'
+ARCHIVE_TIERING_INTERVAL = float(os.environ.get('ARCHIVE_TIERING_INTERVAL_SECONDS', '86400'))
+
 # PayPal Configuration
-paypalrestsdk.configure({
+paypal_options = {
     "mode": PAYPAL_MODE,
     "client_id": PAYPAL_CLIENT_ID,
     "client_secret": PAYPAL_CLIENT_SECRET
-})
+}
+if PAYPAL_API_BASE:
+    paypal_options["endpoint"] = PAYPAL_API_BASE
+
+# Stripe calls made by emergentintegrations go through the stripe library's global api_base
+def configure_stripe(module):
+    if STRIPE_API_BASE:
+        import stripe
+        stripe.api_base = STRIPE_API_BASE
+
+# Integration SDKs, imported on first use (see lazy_imports.py)
+sdk = LazyImporter()
+sdk.register("stripe_checkout", "emergentintegrations.payments.stripe.checkout", on_load=configure_stripe)
+sdk.register("sendgrid", "sendgrid")
+sdk.register("paypal", "paypalrestsdk")
+sdk.register("google_service_account", "google.oauth2.service_account")
+sdk.register("google_discovery", "googleapiclient.discovery")
+sdk.register("google_errors", "googleapiclient.errors")
 
 # Service Categories and Pricing
 SERVICES = {
@@ -226,6 +396,7 @@ class Cart(BaseModel):
     customer_phone: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     expires_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc) + timedelta(hours=1))
+    version: int = 0
 
 class CartItemAdd(BaseModel):
     service_id: str
@@ -234,6 +405,14 @@ class CartItemAdd(BaseModel):
     booking_time: time
     special_requests: Optional[str] = None
 
+class CartBatchOperation(BaseModel):
+    op: str  # 'add', 'update' or 'remove'
+    index: Optional[int] = None  # position in the cart before the batch, for update/remove
+    item: Optional[CartItemAdd] = None  # for add/update
+
+class CartBatchRequest(BaseModel):
+    operations: List[CartBatchOperation]
+
 class CustomerInfo(BaseModel):
     name: str
     email: EmailStr
@@ -256,6 +435,7 @@ class BookingConfirmation(BaseModel):
     payment_method: str
     payment_status: str = "pending"
     payment_session_id: Optional[str] = None
+    payment_history: List[Dict[str, Any]] = []
     booking_reference: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     status: str = "pending"
@@ -273,6 +453,11 @@ class PaymentTransaction(BaseModel):
     customer_email: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class PaymentStatusUpdate(BaseModel):
+    status: str  # completed, failed, cancelled, refunded
+    reference: Optional[str] = None  # e.g. the Venmo/Zelle transaction id
+    note: Optional[str] = None
+
 class ContactMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -319,6 +504,30 @@ class Waiver(BaseModel):
     total_guests: int
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+def calculate_cart_totals(cart: Cart):
+    """Price the cart items against SERVICES; returns (cart_items, total_amount)"""
+    total_amount = 0
+    cart_items = []
+    
+    for item in cart.items:
+        if item.service_id in SERVICES:
+            service = SERVICES[item.service_id]
+            item_total = service['price'] * item.quantity
+            total_amount += item_total
+            
+            cart_items.append({
+                "service_id": item.service_id,
+                "name": service['name'],
+                "price": service['price'],
+                "quantity": item.quantity,
+                "booking_date": item.booking_date,
+                "booking_time": item.booking_time,
+                "special_requests": item.special_requests,
+                "subtotal": item_total
+            })
+    
+    return cart_items, total_amount
+
 # Google Sheets Service
 class GoogleSheetsService:
     def __init__(self):
@@ -330,12 +539,24 @@ class GoogleSheetsService:
     def _initialize_service(self):
         """Initialize Google Sheets service with service account credentials"""
         try:
-            if os.path.exists(GOOGLE_CREDENTIALS_FILE):
+            if GOOGLE_SHEETS_API_BASE and not os.path.exists(GOOGLE_CREDENTIALS_FILE):
+                # Local fake: no service account needed
+                from google.auth.credentials import AnonymousCredentials
+                self.credentials = AnonymousCredentials()
+                self.service = sdk.load("google_discovery").build(
+                    'sheets', 'v4',
+                    credentials=self.credentials,
+                    client_options={"api_endpoint": GOOGLE_SHEETS_API_BASE.rstrip('/') + '/'}
+                )
+                logger.info(f"Google Sheets service using {GOOGLE_SHEETS_API_BASE}")
+            elif os.path.exists(GOOGLE_CREDENTIALS_FILE):
+                service_account = sdk.load("google_service_account")
                 self.credentials = service_account.Credentials.from_service_account_file(
                     GOOGLE_CREDENTIALS_FILE,
                     scopes=['https://www.googleapis.com/auth/spreadsheets']
                 )
-                self.service = build('sheets', 'v4', credentials=self.credentials)
+                client_options = {"api_endpoint": GOOGLE_SHEETS_API_BASE.rstrip('/') + '/'} if GOOGLE_SHEETS_API_BASE else None
+                self.service = sdk.load("google_discovery").build('sheets', 'v4', credentials=self.credentials, client_options=client_options)
                 logger.info("Google Sheets service initialized successfully")
             else:
                 logger.warning("Google credentials file not found, Google Sheets integration disabled")
@@ -372,17 +593,18 @@ class GoogleSheetsService:
             }
             
             # Make API call
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range='Bookings!A:J',
-                valueInputOption='RAW',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
+            with track_integration("sheets", "append_booking"):
+                result = self.service.spreadsheets().values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range='Bookings!A:J',
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body=body
+                ).execute()
             
             logger.info(f"Successfully recorded booking to Google Sheets: {booking.booking_reference}")
             
-        except HttpError as error:
+        except sdk.load("google_errors").HttpError as error:
             logger.error(f"Google Sheets API error: {error}")
         except Exception as error:
             logger.error(f"Unexpected error recording to sheets: {error}")
@@ -424,35 +646,277 @@ class GoogleSheetsService:
             }
             
             # Make API call to Waivers sheet
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range='Waivers!A:K',
-                valueInputOption='RAW',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
+            with track_integration("sheets", "append_waiver"):
+                result = self.service.spreadsheets().values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range='Waivers!A:K',
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body=body
+                ).execute()
             
             logger.info(f"Successfully recorded waiver to Google Sheets: {waiver.id}")
             
-        except HttpError as error:
+        except sdk.load("google_errors").HttpError as error:
             logger.error(f"Google Sheets API error recording waiver: {error}")
         except Exception as error:
             logger.error(f"Unexpected error recording waiver to sheets: {error}")
 
 # Global services
-google_sheets = GoogleSheetsService()
+mongo_pool_metrics = MongoPoolMetrics()
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Pool and transport options for the Motor client; they override the same options in MONGO_URL"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = int(MONGO_MAX_IDLE_TIME_MS)
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = int(MONGO_WAIT_QUEUE_TIMEOUT_MS)
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+async def create_database():
+    """Motor client for MONGO_URL; built on the event loop it will run on"""
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'], event_listeners=[MongoCommandMetrics(), mongo_pool_metrics], **mongo_client_options()
+    )
+    return client[os.environ['DB_NAME']]
+
+def configure_paypal():
+    """Configure the PayPal SDK and return its API handle"""
+    return sdk.load("paypal").configure(paypal_options)
+
+async def create_read_router():
+    return ReadRouter(services["db"], parse_read_routes(DB_READ_ROUTES), max_staleness=DB_READ_MAX_STALENESS)
+
+async def create_cart_store():
+    """Mongo-backed cart store, fronted by the in-memory tier when carts can't straddle workers
+
+    In auto mode that needs either CART_STORE_AFFINITY or WEB_CONCURRENCY=1 set
+    explicitly; with the worker count unknown, carts stay in Mongo only.
+    """
+    durable = MongoCartStore(
+        lambda: services["db"].carts,
+        lambda cart: prepare_for_mongo(cart.dict()),
+        lambda cart_data: Cart(**parse_from_mongo(cart_data))
+    )
+    mode = CART_STORE
+    if mode == "auto":
+        mode = "tiered" if (WEB_CONCURRENCY_KNOWN and WEB_CONCURRENCY <= 1) or CART_STORE_AFFINITY else "mongo"
+    elif mode == "tiered" and WEB_CONCURRENCY > 1 and not CART_STORE_AFFINITY:
+        # Without affinity another worker could serve a stale copy or overwrite a pending write
+        logger.warning("CART_STORE=tiered with several workers and no CART_STORE_AFFINITY; using Mongo only")
+        mode = "mongo"
+    logger.info(f"Cart store: {mode}")
+    if mode == "tiered":
+        return TieredCartStore(durable, capacity=CART_STORE_CAPACITY, max_lag=CART_STORE_MAX_LAG).start()
+    return durable
+
+async def create_webhook_inbox():
+    handlers = {"stripe": process_stripe_event, "paypal": process_paypal_event}
+    return WebhookInbox(lambda: services["db"], handlers, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS).start()
+
+async def create_payment_reconciler():
+    lookups = {"stripe": fetch_stripe_payment_status, "paypal": fetch_paypal_payment_status}
+    bucket_store = MongoBucketStore(lambda: services["db"].rate_limits) if RATE_LIMIT_STORE == "mongo" else MemoryBucketStore()
+    reconciler = PaymentReconciler(
+        lambda: services["db"], lookups,
+        lambda session_id, to_status, source: apply_payment_status(services["db"], {"payment_session_id": session_id}, to_status, source, reference="reconcile"),
+        bucket_store, interval=RECONCILE_INTERVAL, min_age=RECONCILE_MIN_AGE, max_age=RECONCILE_MAX_AGE,
+        concurrency=RECONCILE_CONCURRENCY, rate_per_second=RECONCILE_RATE, max_checks=RECONCILE_MAX_CHECKS
+    )
+    return reconciler.start() if RECONCILE_ENABLED else reconciler
+
+async def create_booking_archiver():
+    policy = PendingBookingPolicy(
+        pending_for=BOOKING_ARCHIVE_PENDING,
+        pending_for_method={method: BOOKING_ARCHIVE_MANUAL_PENDING for method in MANUAL_PAYMENT_METHODS}
+    )
+    archiver = BookingArchiver(lambda: services["db"], policy, interval=BOOKING_ARCHIVE_INTERVAL, batch_size=BOOKING_ARCHIVE_BATCH_SIZE)
+    return archiver.start() if BOOKING_ARCHIVE_ENABLED else archiver
+
+async def create_cold_store():
+    cold_store = ColdStore(
+        lambda: services["db"], ARCHIVE_DIR, load_codec(ARCHIVE_CODEC),
+        hot_months=ARCHIVE_HOT_MONTHS, interval=ARCHIVE_TIERING_INTERVAL
+    )
+    return cold_store.start() if ARCHIVE_TIERING_ENABLED else cold_store
+
+async def create_background_jobs():
+    jobs = BackgroundJobs(lambda: services["db"])
+    jobs.register(
+        add_booking_to_sheets,
+        encode=lambda booking: prepare_for_mongo(booking.dict()),
+        decode=lambda booking_data: BookingConfirmation(**parse_from_mongo(booking_data))
+    )
+    jobs.register(render_waiver_pdf_task)
+    jobs.register(notify_booking_paid)
+    jobs.register(remove_booking_rollups)
+    return jobs.start()
+
+async def create_http_client():
+    """Shared HTTP connection pool for outbound calls made with httpx (Telegram)"""
+    return httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+
+def create_waiver_pdf_pipeline():
+    return WaiverPdfPipeline(WAIVER_PDF_CACHE_DIR, max_workers=WAIVER_PDF_WORKERS)
+
+services = ServiceContainer()
+services.register("db", create_database, close=lambda database: database.client.close())
+services.register("google_sheets", GoogleSheetsService, lazy=True)
+services.register("paypal", configure_paypal, lazy=True)
+services.register("read_router", create_read_router, after=("db",))
+services.register("http_client", create_http_client, close=lambda client: client.aclose())
+services.register("background_jobs", create_background_jobs, close=lambda jobs: jobs.close(), after=("db", "http_client"))
+services.register("cart_store", create_cart_store, close=lambda store: store.close(), after=("db",))
+services.register("webhook_inbox", create_webhook_inbox, close=lambda inbox: inbox.close(), after=("db", "background_jobs"))
+services.register("payment_reconciler", create_payment_reconciler, close=lambda reconciler: reconciler.close(), after=("db", "background_jobs"))
+services.register("booking_archiver", create_booking_archiver, close=lambda archiver: archiver.close(), after=("db",))
+services.register("cold_store", create_cold_store, close=lambda cold_store: cold_store.close(), after=("db",))
+services.register("waiver_pdf_pipeline", create_waiver_pdf_pipeline, close=lambda pipeline: pipeline.shutdown())
+trace_buffer = configure_tracing(TRACING_ENABLED, TRACE_BUFFER_SIZE, TRACE_FILE)
+
+# Dependencies
+def get_db():
+    """Application database"""
+    return services["db"]
+
+def get_read_db(request: Request):
+    """Database handle for a read-only endpoint: primary or secondaryPreferred, per DB_READ_ROUTES"""
+    return services["read_router"].for_request(request)
+
+def get_cart_store():
+    """Cart store (memory + Mongo, or Mongo only)"""
+    return services["cart_store"]
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Bearer ADMIN_API_TOKEN, for every /api/admin endpoint"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API is disabled: ADMIN_API_TOKEN is not set")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+def get_background_jobs() -> BackgroundJobs:
+    return services["background_jobs"]
+
+def get_webhook_inbox() -> WebhookInbox:
+    return services["webhook_inbox"]
+
+def get_payment_reconciler() -> PaymentReconciler:
+    return services["payment_reconciler"]
+
+def get_booking_archiver() -> BookingArchiver:
+    return services["booking_archiver"]
+
+def get_cold_store() -> ColdStore:
+    return services["cold_store"]
+
+async def get_waiver_pdf_pipeline() -> WaiverPdfPipeline:
+    return await services.get("waiver_pdf_pipeline")
+
+async def warm_up_sdks():
+    """Import the integration SDKs no request has needed yet, once the app is serving"""
+    await asyncio.sleep(SDK_WARMUP_DELAY)
+    await asyncio.to_thread(sdk.warm_up)
+    logger.info(f"SDK warm-up finished: {sdk.report()}")
 
 # Cart storage - now using MongoDB for persistence
 # carts_storage = {} # Old in-memory storage - replaced with MongoDB
+cart_tokens = CartTokenSigner(CART_TOKEN_SECRET)
+
+async def load_cart(carts, cart_id: str, check_expiry: bool = True) -> Cart:
+    """Fetch a cart; a signed cart id with no document yet is an empty cart"""
+    try:
+        token_expires_at = cart_tokens.verify(cart_id)
+    except InvalidCartToken:
+        # Possibly signed under another secret (rotated, or a worker started without one);
+        # a cart that was already saved is still served, by its stored expiry
+        token_expires_at = None
+    if check_expiry and token_expires_at and datetime.now(timezone.utc) > token_expires_at:
+        raise HTTPException(status_code=410, detail="Cart expired")
+    
+    cart = await carts.get(cart_id)
+    if cart is None:
+        if token_expires_at is None:
+            raise HTTPException(status_code=404, detail="Cart not found")
+        return Cart(id=cart_id, expires_at=token_expires_at)
+    
+    # Check expiration
+    if check_expiry and datetime.now(timezone.utc) > cart.expires_at:
+        await carts.delete(cart_id)
+        raise HTTPException(status_code=410, detail="Cart expired")
+    
+    return cart
+
+async def save_cart(carts, cart: Cart, expected_version: Optional[int] = None) -> bool:
+    """Write a cart back, creating its document on first save
+
+    With expected_version the write only happens if nobody else saved the cart
+    since it was loaded; returns False if it was changed underneath.
+    """
+    cart.version += 1
+    saved = await carts.save(cart, expected_version)
+    if saved:
+        # A get_cart that started before this write must not be handed to later readers
+        get_cart.invalidate(cart_id=cart.id)
+    return saved
+
+async def ensure_capacity(db, items: List[CartItem]):
+    """409 if the cart's items would overbook any capacity-limited slot"""
+    problems = await check_capacity(db, SERVICE_CAPACITY, requested_quantities(items), CAPACITY_PENDING_HOLD, CAPACITY_PENDING_HOLD_FOR_METHOD)
+    if problems:
+        raise HTTPException(status_code=409, detail={"message": "Not enough availability", "slots": problems})
 
 # Waiver service
 async def add_waiver_to_sheets(waiver: Waiver):
     """Add waiver to Google Sheets"""
     try:
+        google_sheets = await services.get("google_sheets")
         await google_sheets.record_waiver(waiver)
     except Exception as e:
         logger.error(f"Failed to add waiver to Google Sheets: {str(e)}")
 
+async def add_booking_to_sheets(booking: BookingConfirmation):
+    """Add booking to Google Sheets"""
+    try:
+        google_sheets = await services.get("google_sheets")
+        await google_sheets.record_booking(booking)
+    except Exception as e:
+        logger.error(f"Failed to add booking to Google Sheets: {str(e)}")
+
+async def render_waiver_pdf_task(waiver_dict: Dict[str, Any]):
+    """Render the signed waiver PDF off the event loop and record its digest"""
+    try:
+        waiver_pdf_pipeline = await services.get("waiver_pdf_pipeline")
+        digest = await waiver_pdf_pipeline.render(waiver_dict)
+        await services["db"].waivers.update_one(
+            {"id": waiver_dict['id']},
+            {"$set": {"pdf_digest": digest, "pdf_rendered_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to render waiver PDF {waiver_dict.get('id')}: {str(e)}")
+
+# Reporting rollups
+async def record_booking_rollups(booking_id: str):
+    """Add a confirmed booking to the reporting rollups"""
+    try:
+        await apply_booking_rollups(services["db"], booking_id)
+    except Exception as e:
+        logger.error(f"Failed to update reporting rollups for booking {booking_id}: {str(e)}")
+
+async def remove_booking_rollups(booking_id: str):
+    """Take a refunded booking back out of the reporting rollups"""
+    try:
+        await reverse_booking_rollups(services["db"], booking_id)
+    except Exception as e:
+        logger.error(f"Failed to reverse reporting rollups for booking {booking_id}: {str(e)}")
+
 # Email service
 async def send_booking_confirmation_email(booking: BookingConfirmation):
     """Send booking confirmation email using SendGrid"""
@@ -522,15 +986,19 @@ async def send_booking_confirmation_email(booking: BookingConfirmation):
         </html>
         """
         
-        message = Mail(
+        sendgrid = await sdk.aload("sendgrid")
+        message = sendgrid.Mail(
             from_email=SENDER_EMAIL,
             to_emails=booking.customer_email,
             subject=f"Booking Confirmed - Exclusive Gulf Float - {booking.booking_reference}",
             html_content=html_content
         )
         
-        sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-        response = sg.send(message)
+        sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY, host=SENDGRID_API_BASE)
+        with track_integration("sendgrid", "send") as call:
+            response = sg.send(message)
+            if response.status_code != 202:
+                call.failed()
         return response.status_code == 202
         
     except Exception as e:
@@ -564,16 +1032,18 @@ async def send_telegram_notification(booking: BookingConfirmation):
 🆔 Booking Reference: {booking.booking_reference}
 🆔 Booking ID: {booking.id}"""
 
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         data = {
             "chat_id": TELEGRAM_CHAT_ID,
             "text": message,
             "parse_mode": "HTML"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data)
-            return response.status_code == 200
+        with track_integration("telegram", "send_message") as call:
+            response = await services["http_client"].post(url, json=data)
+            if response.status_code != 200:
+                call.failed()
+        return response.status_code == 200
             
     except Exception as e:
         logger.error(f"Failed to send Telegram notification: {str(e)}")
@@ -597,6 +1067,8 @@ class PayPalService:
             
             total_amount = sum(item['price'] * item['quantity'] for item in booking.items)
             
+            paypalrestsdk = await sdk.aload("paypal")
+            paypal_api = await services.get("paypal")
             payment = paypalrestsdk.Payment({
                 "intent": "sale",
                 "payer": {"payment_method": "paypal"},
@@ -612,9 +1084,14 @@ class PayPalService:
                     },
                     "description": f"Booking {booking.booking_reference} - Exclusive Gulf Float"
                 }]
-            })
+            }, api=paypal_api)
+            
+            with track_integration("paypal", "create_payment") as call:
+                created = payment.create()
+                if not created:
+                    call.failed()
             
-            if payment.create():
+            if created:
                 return {
                     "payment_id": payment.id,
                     "approval_url": next(link.href for link in payment.links if link.rel == "approval_url"),
@@ -631,9 +1108,15 @@ class PayPalService:
     async def execute_payment(payment_id: str, payer_id: str):
         """Execute PayPal payment"""
         try:
-            payment = paypalrestsdk.Payment.find(payment_id)
+            paypalrestsdk = await sdk.aload("paypal")
+            paypal_api = await services.get("paypal")
+            with track_integration("paypal", "execute_payment") as call:
+                payment = paypalrestsdk.Payment.find(payment_id, api=paypal_api)
+                executed = payment.execute({"payer_id": payer_id})
+                if not executed:
+                    call.failed()
             
-            if payment.execute({"payer_id": payer_id}):
+            if executed:
                 return {
                     "payment_id": payment_id,
                     "status": "completed",
@@ -658,52 +1141,18 @@ async def get_services():
 
 @api_router.post("/cart/create")
 async def create_cart():
-    """Create a new shopping cart"""
-    cart = Cart()
-    
-    # Store in MongoDB
-    cart_dict = prepare_for_mongo(cart.dict())
-    await db.carts.insert_one(cart_dict)
-    
-    return {"cart_id": cart.id, "expires_at": cart.expires_at}
+    """Issue a new shopping cart id; nothing is stored until the first item is added"""
+    cart_id, expires_at = cart_tokens.issue(CART_TTL)
+    return {"cart_id": cart_id, "expires_at": expires_at}
 
 @api_router.get("/cart/{cart_id}")
-async def get_cart(cart_id: str):
+@coalesce()
+async def get_cart(cart_id: str, carts=Depends(get_cart_store)):
     """Get cart contents"""
-    # Get cart from MongoDB
-    cart_data = await db.carts.find_one({"id": cart_id})
-    if not cart_data:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    # Parse cart from MongoDB
-    parsed_cart = parse_from_mongo(cart_data)
-    cart = Cart(**parsed_cart)
-    
-    # Check expiration
-    if datetime.now(timezone.utc) > cart.expires_at:
-        await db.carts.delete_one({"id": cart_id})
-        raise HTTPException(status_code=410, detail="Cart expired")
+    cart = await load_cart(carts, cart_id)
     
     # Calculate totals
-    total_amount = 0
-    cart_items = []
-    
-    for item in cart.items:
-        if item.service_id in SERVICES:
-            service = SERVICES[item.service_id]
-            item_total = service['price'] * item.quantity
-            total_amount += item_total
-            
-            cart_items.append({
-                "service_id": item.service_id,
-                "name": service['name'],
-                "price": service['price'],
-                "quantity": item.quantity,
-                "booking_date": item.booking_date,
-                "booking_time": item.booking_time,
-                "special_requests": item.special_requests,
-                "subtotal": item_total
-            })
+    cart_items, total_amount = calculate_cart_totals(cart)
     
     return {
         "cart_id": cart.id,
@@ -717,21 +1166,9 @@ async def get_cart(cart_id: str):
     }
 
 @api_router.post("/cart/{cart_id}/add")
-async def add_to_cart(cart_id: str, item: CartItemAdd):
+async def add_to_cart(cart_id: str, item: CartItemAdd, db=Depends(get_db), carts=Depends(get_cart_store)):
     """Add item to cart"""
-    # Get cart from MongoDB
-    cart_data = await db.carts.find_one({"id": cart_id})
-    if not cart_data:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    # Parse cart from MongoDB
-    parsed_cart = parse_from_mongo(cart_data)
-    cart = Cart(**parsed_cart)
-    
-    # Check expiration
-    if datetime.now(timezone.utc) > cart.expires_at:
-        await db.carts.delete_one({"id": cart_id})
-        raise HTTPException(status_code=410, detail="Cart expired")
+    cart = await load_cart(carts, cart_id)
     
     if item.service_id not in SERVICES:
         raise HTTPException(status_code=400, detail="Invalid service ID")
@@ -745,24 +1182,17 @@ async def add_to_cart(cart_id: str, item: CartItemAdd):
     )
     
     cart.items.append(cart_item)
+    await ensure_capacity(db, cart.items)
     
-    # Update cart in MongoDB
-    cart_dict = prepare_for_mongo(cart.dict())
-    await db.carts.replace_one({"id": cart_id}, cart_dict)
+    # Update cart in MongoDB (the first add creates the document)
+    await save_cart(carts, cart)
     
     return {"message": "Item added to cart", "cart_id": cart_id}
 
 @api_router.delete("/cart/{cart_id}/item/{item_index}")
-async def remove_from_cart(cart_id: str, item_index: int):
+async def remove_from_cart(cart_id: str, item_index: int, carts=Depends(get_cart_store)):
     """Remove item from cart"""
-    # Get cart from MongoDB
-    cart_data = await db.carts.find_one({"id": cart_id})
-    if not cart_data:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    # Parse cart from MongoDB
-    parsed_cart = parse_from_mongo(cart_data)
-    cart = Cart(**parsed_cart)
+    cart = await load_cart(carts, cart_id, check_expiry=False)
     
     if item_index < 0 or item_index >= len(cart.items):
         raise HTTPException(status_code=400, detail="Invalid item index")
@@ -770,22 +1200,14 @@ async def remove_from_cart(cart_id: str, item_index: int):
     cart.items.pop(item_index)
     
     # Update cart in MongoDB
-    cart_dict = prepare_for_mongo(cart.dict())
-    await db.carts.replace_one({"id": cart_id}, cart_dict)
+    await save_cart(carts, cart)
     
     return {"message": "Item removed from cart"}
 
 @api_router.put("/cart/{cart_id}/customer")
-async def update_cart_customer(cart_id: str, customer_info: CustomerInfo):
+async def update_cart_customer(cart_id: str, customer_info: CustomerInfo, carts=Depends(get_cart_store)):
     """Update customer information in cart"""
-    # Get cart from MongoDB
-    cart_data = await db.carts.find_one({"id": cart_id})
-    if not cart_data:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    # Parse cart from MongoDB
-    parsed_cart = parse_from_mongo(cart_data)
-    cart = Cart(**parsed_cart)
+    cart = await load_cart(carts, cart_id, check_expiry=False)
     
     # Update customer info
     cart.customer_name = customer_info.name
@@ -793,14 +1215,64 @@ async def update_cart_customer(cart_id: str, customer_info: CustomerInfo):
     cart.customer_phone = customer_info.phone
     
     # Update cart in MongoDB
-    cart_dict = prepare_for_mongo(cart.dict())
-    await db.carts.replace_one({"id": cart_id}, cart_dict)
+    await save_cart(carts, cart)
     
     return {"message": "Customer information updated"}
 
+@api_router.post("/cart/{cart_id}/items:batch")
+async def batch_cart_items(cart_id: str, batch: CartBatchRequest, db=Depends(get_db), carts=Depends(get_cart_store)):
+    """Add, update and remove several cart items at once; the batch is applied entirely or not at all"""
+    if not batch.operations:
+        raise HTTPException(status_code=400, detail="No operations")
+    if len(batch.operations) > CART_BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {CART_BATCH_MAX_OPERATIONS} operations per batch")
+    
+    cart = await load_cart(carts, cart_id)
+    loaded_version = cart.version
+    
+    # Indexes refer to the cart as loaded, so removals don't shift later operations
+    items: List[Optional[CartItem]] = list(cart.items)
+    added: List[CartItem] = []
+    touched = set()
+    results = []
+    for position, operation in enumerate(batch.operations):
+        error = None
+        if operation.op not in ("add", "update", "remove"):
+            error = "op must be add, update or remove"
+        elif operation.op in ("update", "remove") and (operation.index is None or not 0 <= operation.index < len(items)):
+            error = "Invalid item index"
+        elif operation.op in ("update", "remove") and operation.index in touched:
+            error = "Item already changed by an earlier operation in this batch"
+        elif operation.op in ("add", "update") and operation.item is None:
+            error = "item is required"
+        elif operation.op in ("add", "update") and operation.item.service_id not in SERVICES:
+            error = "Invalid service ID"
+        elif operation.op in ("add", "update") and operation.item.quantity < 1:
+            error = "Quantity must be at least 1"
+        
+        if error is None:
+            if operation.op == "add":
+                added.append(CartItem(**operation.item.dict()))
+            else:
+                touched.add(operation.index)
+                items[operation.index] = CartItem(**operation.item.dict()) if operation.op == "update" else None
+        results.append({"operation": position, "op": operation.op, "status": "error" if error else "ok", "detail": error})
+    
+    if any(result["status"] == "error" for result in results):
+        raise HTTPException(status_code=400, detail={"message": "Batch rejected", "results": results})
+    
+    cart.items = [item for item in items if item is not None] + added
+    await ensure_capacity(db, cart.items)
+    
+    if not await save_cart(carts, cart, expected_version=loaded_version):
+        raise HTTPException(status_code=409, detail="Cart was modified concurrently, please retry")
+    
+    cart_items, total_amount = calculate_cart_totals(cart)
+    return {"cart_id": cart_id, "results": results, "items": cart_items, "total_amount": total_amount}
+
 # Waiver Endpoints
 @api_router.post("/waiver/submit")
-async def submit_waiver(waiver_submission: WaiverSubmission):
+async def submit_waiver(waiver_submission: WaiverSubmission, background_tasks: BackgroundTasks, db=Depends(get_db), jobs=Depends(get_background_jobs)):
     """Submit electronic waiver"""
     try:
         # Create waiver document
@@ -819,6 +1291,10 @@ async def submit_waiver(waiver_submission: WaiverSubmission):
         # Add to Google Sheets
         await add_waiver_to_sheets(waiver)
         
+        # Render the signed PDF for legal retention
+        waiver_dict.pop('_id', None)
+        jobs.add(background_tasks, render_waiver_pdf_task, waiver_dict)
+        
         return {
             "message": "Waiver submitted successfully",
             "waiver_id": waiver.id,
@@ -830,10 +1306,12 @@ async def submit_waiver(waiver_submission: WaiverSubmission):
         raise HTTPException(status_code=500, detail="Failed to submit waiver")
 
 @api_router.get("/waiver/{waiver_id}")
-async def get_waiver(waiver_id: str):
+async def get_waiver(waiver_id: str, db=Depends(get_read_db), cold_store=Depends(get_cold_store)):
     """Get waiver by ID"""
     try:
         waiver = await db.waivers.find_one({"id": waiver_id}, {"_id": 0})
+        if not waiver:
+            waiver = await cold_store.get("waivers", waiver_id)
         if not waiver:
             raise HTTPException(status_code=404, detail="Waiver not found")
         
@@ -847,8 +1325,49 @@ async def get_waiver(waiver_id: str):
         logger.error(f"Error fetching waiver: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch waiver")
 
+@api_router.get("/waiver/{waiver_id}/pdf")
+async def get_waiver_pdf(
+    waiver_id: str,
+    request: Request,
+    db=Depends(get_db),
+    cold_store=Depends(get_cold_store),
+    waiver_pdf_pipeline: WaiverPdfPipeline = Depends(get_waiver_pdf_pipeline)
+):
+    """Download the signed waiver PDF"""
+    waiver = await db.waivers.find_one({"id": waiver_id}, {"_id": 0})
+    if not waiver:
+        waiver = await cold_store.get("waivers", waiver_id)
+    if not waiver:
+        raise HTTPException(status_code=404, detail="Waiver not found")
+    
+    digest = waiver.get('pdf_digest')
+    if not digest or not waiver_pdf_pipeline.cache.exists(digest):
+        # Not rendered yet (or evicted from the cache): render now, still in the process pool
+        try:
+            digest = await waiver_pdf_pipeline.render(waiver)
+        except Exception as e:
+            logger.error(f"Error rendering waiver PDF: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to render waiver PDF")
+        await db.waivers.update_one(
+            {"id": waiver_id},
+            {"$set": {"pdf_digest": digest, "pdf_rendered_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        waiver_pdf_pipeline.cache.path_for(digest),
+        media_type="application/pdf",
+        filename=f"waiver-{waiver_id}.pdf",
+        headers=headers
+    )
+
 @api_router.get("/waivers")
-async def get_all_waivers():
+@coalesce(ttl=2)
+async def get_all_waivers(db=Depends(get_read_db)):
     """Get all waivers for admin"""
     try:
         waivers = await db.waivers.find({}, {"_id": 0}).sort("created_at", -1).to_list(length=None)
@@ -862,16 +1381,9 @@ async def get_all_waivers():
         raise HTTPException(status_code=500, detail="Failed to fetch waivers")
 
 @api_router.post("/cart/{cart_id}/checkout")
-async def checkout_cart(cart_id: str, checkout_request: CheckoutRequest, background_tasks: BackgroundTasks):
+async def checkout_cart(cart_id: str, checkout_request: CheckoutRequest, background_tasks: BackgroundTasks, db=Depends(get_db), carts=Depends(get_cart_store), jobs=Depends(get_background_jobs)):
     """Checkout cart and create booking"""
-    # Get cart from MongoDB
-    cart_data = await db.carts.find_one({"id": cart_id})
-    if not cart_data:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    # Parse cart from MongoDB
-    parsed_cart = parse_from_mongo(cart_data)
-    cart = Cart(**parsed_cart)
+    cart = await load_cart(carts, cart_id, check_expiry=False)
     if not cart.items:
         raise HTTPException(status_code=400, detail="Cart is empty")
     
@@ -909,18 +1421,30 @@ async def checkout_cart(cart_id: str, checkout_request: CheckoutRequest, backgro
         booking_reference=booking_ref
     )
     
-    # Save booking to database
+    set_booking_id(booking.id)
+    
+    # Re-check capacity under the slot locks: holds in the cart may have expired and
+    # other carts were checked separately, so only this check stops an overbooking
+    limited_slots = [slot for slot in requested_quantities(cart.items) if slot[0] in SERVICE_CAPACITY]
     booking_data = prepare_for_mongo(booking.dict())
-    await db.bookings.insert_one(booking_data)
+    try:
+        async with hold_slots(db, limited_slots):
+            await ensure_capacity(db, cart.items)
+            with start_span("db.bookings.insert_one"):
+                await db.bookings.insert_one(booking_data)
+    except SlotBusy:
+        raise HTTPException(status_code=409, detail="This time slot is being booked right now, please retry")
     
     # Record in Google Sheets
-    background_tasks.add_task(google_sheets.record_booking, booking)
+    jobs.add(background_tasks, add_booking_to_sheets, booking)
     
     # Handle payment based on method
     if checkout_request.payment_method == "stripe":
-        return await handle_stripe_checkout(booking, checkout_request)
+        with start_span("handle_stripe_checkout"):
+            return await handle_stripe_checkout(db, booking, checkout_request)
     elif checkout_request.payment_method == "paypal":
-        return await handle_paypal_checkout(booking, checkout_request)
+        with start_span("handle_paypal_checkout"):
+            return await handle_paypal_checkout(db, booking, checkout_request)
     else:
         # For now, other payment methods return pending status
         return {
@@ -932,15 +1456,16 @@ async def checkout_cart(cart_id: str, checkout_request: CheckoutRequest, backgro
             "message": f"Please complete payment using {checkout_request.payment_method}"
         }
 
-async def handle_stripe_checkout(booking: BookingConfirmation, checkout_request: CheckoutRequest):
+async def handle_stripe_checkout(db, booking: BookingConfirmation, checkout_request: CheckoutRequest):
     """Handle Stripe checkout process"""
     try:
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
+        stripe_sdk = await sdk.aload("stripe_checkout")
+        stripe_checkout = stripe_sdk.StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
         
         success_url = checkout_request.success_url or f"{os.environ.get('BASE_URL', 'http://localhost:8000')}/booking-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = checkout_request.cancel_url or f"{os.environ.get('BASE_URL', 'http://localhost:8000')}/cart/{booking.cart_id}"
         
-        checkout_session_request = CheckoutSessionRequest(
+        checkout_session_request = stripe_sdk.CheckoutSessionRequest(
             amount=booking.total_amount,
             currency="usd",
             success_url=success_url,
@@ -952,14 +1477,16 @@ async def handle_stripe_checkout(booking: BookingConfirmation, checkout_request:
             }
         )
         
-        session = await stripe_checkout.create_checkout_session(checkout_session_request)
+        with track_integration("stripe", "create_checkout_session"):
+            session = await stripe_checkout.create_checkout_session(checkout_session_request)
         
         # Update booking with payment session
         booking.payment_session_id = session.session_id
-        await db.bookings.update_one(
-            {"id": booking.id},
-            {"$set": {"payment_session_id": session.session_id}}
-        )
+        with start_span("db.bookings.update_one"):
+            await db.bookings.update_one(
+                {"id": booking.id},
+                {"$set": {"payment_session_id": session.session_id}}
+            )
         
         # Create payment transaction record
         transaction = PaymentTransaction(
@@ -974,7 +1501,8 @@ async def handle_stripe_checkout(booking: BookingConfirmation, checkout_request:
         )
         
         transaction_data = prepare_for_mongo(transaction.dict())
-        await db.payment_transactions.insert_one(transaction_data)
+        with start_span("db.payment_transactions.insert_one"):
+            await db.payment_transactions.insert_one(transaction_data)
         
         return {
             "booking_id": booking.id,
@@ -989,7 +1517,7 @@ async def handle_stripe_checkout(booking: BookingConfirmation, checkout_request:
         logger.error(f"Stripe checkout error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Payment processing error: {str(e)}")
 
-async def handle_paypal_checkout(booking: BookingConfirmation, checkout_request: CheckoutRequest):
+async def handle_paypal_checkout(db, booking: BookingConfirmation, checkout_request: CheckoutRequest):
     """Handle PayPal checkout process"""
     try:
         success_url = checkout_request.success_url or f"{os.environ.get('BASE_URL', 'http://localhost:8000')}/booking-success"
@@ -999,10 +1527,11 @@ async def handle_paypal_checkout(booking: BookingConfirmation, checkout_request:
         
         # Update booking with payment session
         booking.payment_session_id = payment_result['payment_id']
-        await db.bookings.update_one(
-            {"id": booking.id},
-            {"$set": {"payment_session_id": payment_result['payment_id']}}
-        )
+        with start_span("db.bookings.update_one"):
+            await db.bookings.update_one(
+                {"id": booking.id},
+                {"$set": {"payment_session_id": payment_result['payment_id']}}
+            )
         
         # Create payment transaction record
         transaction = PaymentTransaction(
@@ -1016,7 +1545,8 @@ async def handle_paypal_checkout(booking: BookingConfirmation, checkout_request:
         )
         
         transaction_data = prepare_for_mongo(transaction.dict())
-        await db.payment_transactions.insert_one(transaction_data)
+        with start_span("db.payment_transactions.insert_one"):
+            await db.payment_transactions.insert_one(transaction_data)
         
         return {
             "booking_id": booking.id,
@@ -1032,7 +1562,7 @@ async def handle_paypal_checkout(booking: BookingConfirmation, checkout_request:
         raise HTTPException(status_code=500, detail=f"PayPal processing error: {str(e)}")
 
 @api_router.get("/bookings", response_model=List[BookingConfirmation])
-async def get_bookings():
+async def get_bookings(db=Depends(get_read_db)):
     """Get all bookings"""
     try:
         bookings = await db.bookings.find().to_list(length=None)
@@ -1042,10 +1572,13 @@ async def get_bookings():
         raise HTTPException(status_code=500, detail="Failed to fetch bookings")
 
 @api_router.get("/bookings/{booking_id}")
-async def get_booking(booking_id: str):
+@coalesce()
+async def get_booking(booking_id: str, db=Depends(get_read_db), cold_store=Depends(get_cold_store)):
     """Get booking by ID"""
     try:
         booking = await db.bookings.find_one({"id": booking_id})
+        if not booking:
+            booking = await cold_store.get("bookings", booking_id)
         if not booking:
             raise HTTPException(status_code=404, detail="Booking not found")
         return BookingConfirmation(**parse_from_mongo(booking))
@@ -1055,8 +1588,111 @@ async def get_booking(booking_id: str):
         logger.error(f"Error fetching booking: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch booking")
 
+# Admin reports
+@api_router.get("/admin/reports", dependencies=[Depends(require_admin)])
+@coalesce(ttl=5)
+async def get_reports(start_date: Optional[date] = None, end_date: Optional[date] = None, db=Depends(get_read_db)):
+    """Revenue, units and guests by service, payment method and hour from the rollups"""
+    end_date = end_date or datetime.now(timezone.utc).date()
+    start_date = start_date or end_date - timedelta(days=30)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+    
+    try:
+        return await read_reports(db, start_date, end_date)
+    except Exception as e:
+        logger.error(f"Error reading reports: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read reports")
+
+@api_router.post("/admin/reports/backfill", dependencies=[Depends(require_admin)])
+async def backfill_reports(db=Depends(get_db)):
+    """Add confirmed bookings that predate the rollups (or missed them) to the rollups"""
+    applied = 0
+    cursor = db.bookings.find(
+        {"status": "confirmed", "rollup_applied": {"$ne": True}},
+        {"_id": 0, "id": 1, "created_at": 1}
+    )
+    async for booking in cursor:
+        confirmed_at = None
+        if isinstance(booking.get('created_at'), str):
+            try:
+                confirmed_at = datetime.fromisoformat(booking['created_at'])
+            except ValueError:
+                pass
+        if await apply_booking_rollups(db, booking['id'], confirmed_at):
+            applied += 1
+    
+    return {"message": "Reports backfilled", "bookings_applied": applied}
+
+# Admin traces
+@api_router.get("/admin/traces", dependencies=[Depends(require_admin)])
+async def list_traces(booking_id: Optional[str] = None, min_duration_ms: float = 0, limit: int = 50):
+    """Recent traces from the in-process buffer, optionally for one booking or only slow ones"""
+    if trace_buffer is None:
+        raise HTTPException(status_code=404, detail="Tracing is disabled")
+    return {"traces": trace_buffer.find_traces(booking_id=booking_id, min_duration_ms=min_duration_ms, limit=limit)}
+
+@api_router.get("/admin/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def get_trace(trace_id: str):
+    """All spans of one trace, in start order"""
+    if trace_buffer is None:
+        raise HTTPException(status_code=404, detail="Tracing is disabled")
+    spans = trace_buffer.get_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "spans": spans}
+
+# Admin startup report
+@api_router.get("/admin/startup", dependencies=[Depends(require_admin)])
+async def get_startup_report():
+    """Module import time, per-service build time and per-SDK import time for this worker"""
+    return {
+        "pid": os.getpid(),
+        "server_import_ms": round(SERVER_IMPORT_SECONDS * 1000, 1),
+        "services_ms": {name: round(seconds * 1000, 1) for name, seconds in services.timings.items()},
+        "sdk_imports": sdk.report()
+    }
+
+# Admin exports
+@api_router.get("/admin/export/{collection}", dependencies=[Depends(require_admin)])
+async def export_collection(
+    collection: str,
+    format: str = "csv",
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    columns: Optional[str] = None,
+    include_archived: bool = True,
+    db=Depends(get_read_db),
+    cold_store=Depends(get_cold_store)
+):
+    """Stream a collection as CSV or NDJSON, optionally filtered by created date, archived months first"""
+    if collection not in EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown export collection")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    
+    try:
+        selected_columns = resolve_columns(collection, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not selected_columns:
+        raise HTTPException(status_code=400, detail="No columns selected")
+    
+    query = build_export_query(collection, start_date, end_date)
+    filename = f"{collection}-{start_date or 'all'}-{end_date or 'all'}.{format}"
+    archived = None
+    if include_archived and collection in COLD_COLLECTIONS:
+        bounds = query.get(COLD_COLLECTIONS[collection], {})
+        archived = cold_store.find(collection, bounds.get("$gte"), bounds.get("$lt"))
+    
+    return StreamingResponse(
+        stream_export(db, collection, format, selected_columns, query, archived=archived),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.post("/contact", response_model=ContactMessage)
-async def submit_contact_form(contact: ContactCreate):
+async def submit_contact_form(contact: ContactCreate, db=Depends(get_db)):
     """Submit contact form"""
     contact_dict = contact.dict()
     contact_obj = ContactMessage(**contact_dict)
@@ -1064,90 +1700,450 @@ async def submit_contact_form(contact: ContactCreate):
     await db.contacts.insert_one(contact_data)
     return contact_obj
 
+# Payment status changes (webhook events run on the inbox workers, see webhook_inbox.py)
+async def apply_payment_status(db, query: Dict[str, Any], to_status: str, source: str,
+                               reference: Optional[str] = None, note: Optional[str] = None):
+    """Transition a booking's payment status and queue its follow-up only if it actually changed"""
+    with start_span("payment.transition", to_status=to_status, source=source):
+        booking_data = await transition_payment(db, query, to_status, source, reference=reference, note=note)
+        if booking_data is None and await db[BOOKINGS_ARCHIVE].count_documents(query, limit=1):
+            # A late payment for a booking the lifecycle sweep already archived
+            await services["booking_archiver"].restore(query)
+            booking_data = await transition_payment(db, query, to_status, source, reference=reference, note=note)
+    if booking_data is None:
+        if reference is not None:
+            # A replay of a transition that committed before its follow-up was queued
+            replayed = await db.bookings.find_one(
+                {**query, "payment_status": to_status, "payment_history": {"$elemMatch": {"to": to_status, "reference": reference}}},
+                {"_id": 0, "id": 1}
+            )
+            if replayed is not None:
+                await queue_payment_follow_up(replayed["id"], to_status)
+        return None
+    
+    booking = BookingConfirmation(**parse_from_mongo(booking_data))
+    set_booking_id(booking.id)
+    await queue_payment_follow_up(booking.id, to_status)
+    return booking
+
+async def queue_payment_follow_up(booking_id: str, to_status: str):
+    """Durably queue what a payment transition triggers, once per booking"""
+    follow_up = PAYMENT_FOLLOW_UPS.get(to_status)
+    if follow_up is not None:
+        await services["background_jobs"].enqueue(follow_up, booking_id, key=booking_id)
+
+async def notify_booking_paid(booking_id: str):
+    """Background job: notify_payment_completed for a booking, loaded by id"""
+    booking_data = await services["db"].bookings.find_one({"id": booking_id}, {"_id": 0})
+    if booking_data is None:
+        logger.warning(f"Booking {booking_id} not found for payment notifications")
+        return
+    await notify_payment_completed(BookingConfirmation(**parse_from_mongo(booking_data)))
+
+async def notify_payment_completed(booking: BookingConfirmation):
+    """Confirmation email, Telegram notification and report rollups for a newly paid booking"""
+    await asyncio.gather(
+        send_booking_confirmation_email(booking),
+        send_telegram_notification(booking),
+        record_booking_rollups(booking.id)
+    )
+
+# payment_status -> background job run once per booking after a transition to it
+PAYMENT_FOLLOW_UPS = {
+    "completed": notify_booking_paid,
+    "refunded": remove_booking_rollups,
+}
+
+# Provider status lookups for the reconciler (reconcile.py)
+async def fetch_stripe_payment_status(session_id: str) -> Optional[str]:
+    """Payment status a Stripe checkout session leads to, or None while it is still open"""
+    stripe_sdk = await sdk.aload("stripe_checkout")
+    stripe_checkout = stripe_sdk.StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
+    with track_integration("stripe", "get_checkout_status"):
+        status = await stripe_checkout.get_checkout_status(session_id)
+    if status.payment_status == "paid":
+        return "completed"
+    if status.status == "expired":
+        return "cancelled"
+    return None
+
+def paypal_payment_status(payment: Dict[str, Any]) -> Optional[str]:
+    """Payment status a PayPal payment resource leads to, or None while the buyer hasn't paid"""
+    if payment.get("state") == "failed":
+        return "failed"
+    sale_states = [
+        resource["sale"].get("state")
+        for transaction in payment.get("transactions", [])
+        for resource in transaction.get("related_resources", [])
+        if "sale" in resource
+    ]
+    if "completed" in sale_states:
+        return "completed"
+    if "denied" in sale_states:
+        return "failed"
+    if payment.get("state") == "approved" and not sale_states:
+        return "completed"
+    return None
+
+async def fetch_paypal_payment_status(payment_id: str) -> Optional[str]:
+    paypalrestsdk = await sdk.aload("paypal")
+    paypal_api = await services.get("paypal")
+    with track_integration("paypal", "find_payment"):
+        payment = await asyncio.to_thread(paypalrestsdk.Payment.find, payment_id, api=paypal_api)
+    return paypal_payment_status(payment.to_dict())
+
+# PayPal webhook event types and the payment status they lead to
+PAYPAL_EVENT_STATUSES = {
+    "PAYMENT.SALE.COMPLETED": "completed",
+    "PAYMENT.SALE.DENIED": "failed",
+    "PAYMENT.SALE.REFUNDED": "refunded",
+    "PAYMENT.SALE.REVERSED": "refunded",
+}
+
+async def process_paypal_event(event: Dict[str, Any]):
+    """Apply a stored PayPal webhook event"""
+    to_status = PAYPAL_EVENT_STATUSES.get(event["event_type"])
+    parent_payment = event["payload"].get("resource", {}).get("parent_payment")
+    if to_status and parent_payment:
+        await apply_payment_status(services["db"], {"payment_session_id": parent_payment}, to_status, "paypal", reference=event["event_id"])
+
+def stripe_event_session(payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """(checkout session id, payment status) of a stored Stripe event
+
+    The inbox keeps the verified event as Stripe sent it; entries stored before
+    that hold just the two fields.
+    """
+    if "data" not in payload:
+        return payload.get("session_id"), payload.get("payment_status")
+    session = payload["data"].get("object") or {}
+    if session.get("object") != "checkout.session":
+        return None, None
+    return session.get("id"), session.get("payment_status")
+
+async def process_stripe_event(event: Dict[str, Any]):
+    """Apply a stored Stripe webhook event"""
+    session_id, payment_status = stripe_event_session(event["payload"])
+    if session_id and payment_status == "paid":
+        await apply_payment_status(services["db"], {"payment_session_id": session_id}, "completed", "stripe", reference=event["event_id"])
+
+# Headers PayPal signs a webhook delivery with -> field of the verify-webhook-signature request
+PAYPAL_SIGNATURE_HEADERS = {
+    "paypal-auth-algo": "auth_algo",
+    "paypal-cert-url": "cert_url",
+    "paypal-transmission-id": "transmission_id",
+    "paypal-transmission-sig": "transmission_sig",
+    "paypal-transmission-time": "transmission_time",
+}
+
+async def verify_paypal_webhook(headers, webhook_event: Dict[str, Any]) -> bool:
+    """Ask PayPal whether a delivery was signed by it for our webhook (raises if PayPal can't be reached)"""
+    if not PAYPAL_WEBHOOK_ID:
+        logger.error("PAYPAL_WEBHOOK_ID not set; rejecting PayPal webhook")
+        return False
+    fields = {field: headers.get(header) for header, field in PAYPAL_SIGNATURE_HEADERS.items()}
+    if not all(fields.values()):
+        return False
+    paypal_api = await services.get("paypal")
+    with track_integration("paypal", "verify_webhook_signature"):
+        result = await asyncio.to_thread(paypal_api.post, "v1/notifications/verify-webhook-signature", {
+            **fields, "webhook_id": PAYPAL_WEBHOOK_ID, "webhook_event": webhook_event
+        })
+    return result.get("verification_status") == "SUCCESS"
+
 # PayPal webhook endpoint
 @api_router.post("/webhook/paypal")
-async def paypal_webhook(request: Request, background_tasks: BackgroundTasks):
-    """Handle PayPal webhook notifications"""
+async def paypal_webhook(request: Request, inbox=Depends(get_webhook_inbox)):
+    """Verify PayPal webhooks, store them for processing and acknowledge straight away"""
+    body = await request.body()
     try:
-        body = await request.body()
         webhook_data = json.loads(body.decode())
-        
-        # Process webhook event
-        event_type = webhook_data.get("event_type")
-        
-        if event_type == "PAYMENT.SALE.COMPLETED":
-            # Handle payment completion
-            resource = webhook_data.get("resource", {})
-            parent_payment = resource.get("parent_payment")
-            
-            if parent_payment:
-                # Update booking and transaction status
-                await db.bookings.update_one(
-                    {"payment_session_id": parent_payment},
-                    {"$set": {"payment_status": "completed", "status": "confirmed"}}
-                )
-                
-                await db.payment_transactions.update_one(
-                    {"session_id": parent_payment},
-                    {"$set": {"payment_status": "completed"}}
-                )
-                
-                # Get booking for notifications
-                booking_data = await db.bookings.find_one({"payment_session_id": parent_payment})
-                if booking_data:
-                    booking = BookingConfirmation(**parse_from_mongo(booking_data))
-                    background_tasks.add_task(send_booking_confirmation_email, booking)
-                    background_tasks.add_task(send_telegram_notification, booking)
-        
-        return {"status": "success"}
-        
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    event_id = webhook_data.get("id") if isinstance(webhook_data, dict) else None
+    if not event_id:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    
+    try:
+        verified = await verify_paypal_webhook(request.headers, webhook_data)
+    except Exception as e:
+        # PayPal redelivers on a non-2xx response, so a failed check is retried later
+        logger.error(f"PayPal webhook verification for {event_id} failed: {str(e)}")
+        raise HTTPException(status_code=503, detail="Webhook verification unavailable")
+    if not verified:
+        logger.warning(f"PayPal webhook {event_id} failed signature verification")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+    
+    parent_payment = webhook_data.get("resource", {}).get("parent_payment")
+    try:
+        await inbox.record("paypal", event_id, webhook_data.get("event_type", ""), parent_payment, webhook_data)
     except Exception as e:
-        logger.error(f"PayPal webhook processing failed: {str(e)}")
+        logger.error(f"Failed to store PayPal webhook {event_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Webhook processing failed")
+    
+    return {"status": "success"}
 
 # Stripe webhook endpoint
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
-    """Handle Stripe webhooks"""
+async def stripe_webhook(request: Request, inbox=Depends(get_webhook_inbox)):
+    """Verify Stripe webhooks, store them for processing and acknowledge straight away"""
+    body = await request.body()
+    stripe_signature = request.headers.get("Stripe-Signature")
+    
     try:
-        body = await request.body()
-        stripe_signature = request.headers.get("Stripe-Signature")
-        
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-        webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
-        
-        # Update transaction and booking status
-        if webhook_response.payment_status == "paid":
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": "completed",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            # Update booking status
-            await db.bookings.update_one(
-                {"payment_session_id": webhook_response.session_id},
-                {"$set": {"payment_status": "completed", "status": "confirmed"}}
-            )
-            
-            # Get booking for notifications
-            booking_data = await db.bookings.find_one({"payment_session_id": webhook_response.session_id})
-            if booking_data:
-                booking = BookingConfirmation(**parse_from_mongo(booking_data))
-                background_tasks.add_task(send_booking_confirmation_email, booking)
-                background_tasks.add_task(send_telegram_notification, booking)
-        
-        return {"status": "success"}
-        
+        stripe_sdk = await sdk.aload("stripe_checkout")
+        stripe_checkout = stripe_sdk.StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
+        with track_integration("stripe", "handle_webhook"):
+            webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
     except Exception as e:
-        logger.error(f"Webhook processing failed: {str(e)}")
+        logger.error(f"Stripe webhook verification failed: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+    
+    try:
+        # The verified event as received, so a replay runs it exactly as Stripe sent it
+        await inbox.record("stripe", webhook_response.event_id, webhook_response.event_type, webhook_response.session_id, json.loads(body))
+    except Exception as e:
+        logger.error(f"Failed to store Stripe webhook {webhook_response.event_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Webhook processing failed")
+    
+    return {"status": "success"}
+
+# Admin payment status (manual methods: Venmo, Cash App, Zelle; also corrections)
+@api_router.post("/admin/bookings/{booking_id}/payment", dependencies=[Depends(require_admin)])
+async def update_booking_payment(booking_id: str, update: PaymentStatusUpdate, db=Depends(get_db)):
+    """Record a payment status change made outside Stripe/PayPal"""
+    if update.status not in PAYMENT_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(PAYMENT_TRANSITIONS)}")
+    
+    booking = await apply_payment_status(db, {"id": booking_id}, update.status, "manual", reference=update.reference, note=update.note)
+    if booking is None:
+        current = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "payment_status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Cannot change payment status from {current.get('payment_status')} to {update.status}"
+        )
+    return booking
+
+# Admin booking lifecycle
+@api_router.post("/admin/bookings/archive", dependencies=[Depends(require_admin)])
+async def archive_abandoned_bookings(dry_run: bool = False, archiver=Depends(get_booking_archiver)):
+    """Move unpaid bookings past the lifecycle policy (and their transactions) to the archive now"""
+    return await archiver.archive(dry_run=dry_run)
+
+@api_router.get("/admin/bookings/archived", dependencies=[Depends(require_admin)])
+async def list_archived_bookings(booking_reference: Optional[str] = None, customer_email: Optional[str] = None, limit: int = 50, db=Depends(get_read_db)):
+    """Archived bookings, most recently archived first"""
+    query = {}
+    if booking_reference:
+        query["booking_reference"] = booking_reference
+    if customer_email:
+        query["customer_email"] = customer_email
+    bookings = await db[BOOKINGS_ARCHIVE].find(query, {"_id": 0}).sort("archived_at", -1).limit(min(limit, 500)).to_list(length=None)
+    return {"bookings": bookings}
+
+@api_router.post("/admin/bookings/{booking_id}/restore", dependencies=[Depends(require_admin)])
+async def restore_archived_booking(booking_id: str, archiver=Depends(get_booking_archiver)):
+    """Bring an archived booking and its transactions back, e.g. before confirming a late manual payment"""
+    restored = await archiver.restore({"id": booking_id})
+    if not restored:
+        raise HTTPException(status_code=404, detail="Archived booking not found")
+    return {"message": "Booking restored", "booking_id": booking_id}
+
+# Admin database routing
+@api_router.get("/admin/db/routing", dependencies=[Depends(require_admin)])
+async def get_db_routing(probe: bool = False):
+    """Read routing table and read preferences; probe=true asks each handle which member answers"""
+    router = services["read_router"]
+    result = router.describe()
+    if probe:
+        try:
+            result["members"] = await router.probe()
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Probe failed: {str(e)}")
+    return result
+
+@api_router.get("/admin/db/pool", dependencies=[Depends(require_admin)])
+async def get_db_pool():
+    """Connection pool settings and this worker's pool state per server (open, in use, waiting checkouts)"""
+    return {
+        "options": mongo_client_options(),
+        "workers": WEB_CONCURRENCY,
+        "max_connections_per_host": MONGO_MAX_POOL_SIZE * WEB_CONCURRENCY,
+        "pid": os.getpid(),
+        "pools": mongo_pool_metrics.pools
+    }
+
+# Admin cold archive
+@api_router.get("/admin/archive/manifest", dependencies=[Depends(require_admin)])
+async def get_archive_manifest(collection: Optional[str] = None, cold_store=Depends(get_cold_store)):
+    """Archived month files: collection, month, document count, size and checksum"""
+    return {"hot_months": cold_store.hot_months, "files": await cold_store.manifest(collection)}
+
+@api_router.post("/admin/archive/tier", dependencies=[Depends(require_admin)])
+async def tier_archive(dry_run: bool = False, cold_store=Depends(get_cold_store)):
+    """Move every month older than the hot window to the cold archive now"""
+    result = await cold_store.tier(dry_run=dry_run)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A tiering run is already in progress")
+    return result
+
+@api_router.get("/admin/history/{collection}", dependencies=[Depends(require_admin)])
+async def get_history(
+    collection: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    customer_email: Optional[str] = None,
+    limit: int = 500,
+    db=Depends(get_read_db),
+    cold_store=Depends(get_cold_store)
+):
+    """Documents from both Mongo and the cold archive, oldest first; archived months are read on demand"""
+    if collection not in COLD_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown collection")
+    field = COLD_COLLECTIONS[collection]
+    bounds = build_export_query(collection, start_date, end_date).get(field, {})
+    match = {"customer_email": customer_email} if customer_email else None
+    limit = min(limit, 5000)
+    
+    documents = []
+    async for document in cold_store.find(collection, bounds.get("$gte"), bounds.get("$lt"), match):
+        documents.append(document)
+        if len(documents) >= limit:
+            return {"documents": documents, "truncated": True}
+    query = {field: bounds} if bounds else {}
+    if match:
+        query.update(match)
+    documents += await db[collection].find(query, {"_id": 0}).sort(field, 1).limit(limit - len(documents)).to_list(length=None)
+    return {"documents": documents, "truncated": len(documents) >= limit}
+
+# Admin statement import (Venmo, Cash App, Zelle)
+@api_router.post("/admin/payments/import", dependencies=[Depends(require_admin)])
+async def import_payment_statement(request: Request, method: str, dry_run: bool = False, db=Depends(get_db)):
+    """Confirm pending bookings from a CSV statement export sent as the request body"""
+    if method not in MANUAL_PAYMENT_METHODS:
+        raise HTTPException(status_code=400, detail=f"Method must be one of: {', '.join(MANUAL_PAYMENT_METHODS)}")
+    try:
+        report = await import_statement(db, request.stream(), method, dry_run=dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # The same keyed job a webhook queues, so a booking is notified once however its payment arrives
+    for booking_id in report["confirmed_booking_ids"]:
+        await queue_payment_follow_up(booking_id, "completed")
+    return report
+
+# Admin payment reconciliation
+@api_router.get("/admin/reconcile", dependencies=[Depends(require_admin)])
+async def list_reconcile_runs(limit: int = 20, db=Depends(get_read_db)):
+    """Recent reconciliation reports plus how many pending transactions are waiting"""
+    runs = await db[RECONCILE_RUNS_COLLECTION].find(
+        {"started_at": {"$exists": True}}, {"_id": 0}
+    ).sort("started_at", -1).limit(min(limit, 200)).to_list(length=None)
+    pending = await db.payment_transactions.count_documents({"payment_status": "pending"})
+    return {"pending_transactions": pending, "runs": runs}
+
+@api_router.post("/admin/reconcile", dependencies=[Depends(require_admin)])
+async def run_reconcile(reconciler=Depends(get_payment_reconciler)):
+    """Sweep pending transactions now instead of waiting for the next scheduled run"""
+    report = await reconciler.run()
+    if report is None:
+        raise HTTPException(status_code=409, detail="A reconciliation run is already in progress")
+    return report
+
+# Admin webhook inbox
+@api_router.get("/admin/webhooks", dependencies=[Depends(require_admin)])
+async def list_webhook_events(status: Optional[str] = None, provider: Optional[str] = None, limit: int = 50, db=Depends(get_read_db)):
+    """Recent inbox events, newest first, e.g. status=failed to see what needs replaying"""
+    query = {}
+    if status:
+        if status not in INBOX_STATUSES:
+            raise HTTPException(status_code=400, detail="Unknown status")
+        query["status"] = status
+    if provider:
+        query["provider"] = provider
+    events = await db[WEBHOOK_INBOX_COLLECTION].find(query, {"_id": 0}).sort("received_at", -1).limit(min(limit, 500)).to_list(length=None)
+    return {"events": events}
+
+@api_router.post("/admin/webhooks/replay", dependencies=[Depends(require_admin)])
+async def replay_webhook_events(
+    event_id: Optional[str] = None,
+    status: Optional[str] = None,
+    provider: Optional[str] = None,
+    received_after: Optional[datetime] = None,
+    inbox=Depends(get_webhook_inbox)
+):
+    """Run stored events again: one by inbox id, or every failed/processed event matching the filters"""
+    query: Dict[str, Any] = {}
+    if event_id:
+        query["id"] = event_id
+    if status:
+        if status not in ("processed", "failed"):
+            raise HTTPException(status_code=400, detail="Only processed or failed events can be replayed")
+        query["status"] = status
+    if provider:
+        query["provider"] = provider
+    if received_after:
+        query["received_at"] = {"$gte": received_after.astimezone(timezone.utc).isoformat()}
+    if not query:
+        raise HTTPException(status_code=400, detail="Give an event_id or at least one filter")
+    
+    replayed = await inbox.replay(query)
+    return {"message": "Events queued for replay", "replayed": replayed}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Rate limiting (innermost, so rejected requests still show up in metrics and traces)
+if RATE_LIMIT_ENABLED:
+    if RATE_LIMIT_STORE == "mongo":
+        rate_limit_store = MongoBucketStore(lambda: services["db"].rate_limits)
+    else:
+        rate_limit_store = MemoryBucketStore()
+    rate_limiter = RateLimiter(DEFAULT_POLICIES, rate_limit_store, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES)
+    app.middleware("http")(rate_limiter.middleware)
+
+# Prometheus metrics
+app.middleware("http")(metrics_middleware)
+app.middleware("http")(tracing_middleware)
+app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+# Health checks
+async def count_due_webhook_events():
+    return await services["db"][WEBHOOK_INBOX_COLLECTION].count_documents(
+        {"status": "pending", "next_attempt_at": {"$lte": datetime.now(timezone.utc).isoformat()}}
+    )
+
+async def count_background_tasks():
+    return background_tasks_in_flight()
+
+async def count_unflushed_carts():
+    return services["cart_store"].pending_writes
+
+health_checker = HealthChecker(
+    lambda: services["db"], integration_health,
+    backlogs={
+        # Shared by every worker, so it never fails readiness on its own
+        "webhook_inbox": (count_due_webhook_events, 100, None),
+        "background_tasks": (count_background_tasks, READY_BACKGROUND_TASKS_DEGRADED, READY_BACKGROUND_TASKS_FAIL),
+        "cart_write_behind": (count_unflushed_carts, 1000, 5000),
+    },
+    required_integrations=READY_REQUIRED_INTEGRATIONS, ttl=READY_CACHE_SECONDS,
+    mongo_timeout=READY_MONGO_TIMEOUT, mongo_degraded_ms=READY_MONGO_DEGRADED_MS
+)
+
+async def healthz():
+    """Liveness probe: no dependencies checked"""
+    return health_checker.live()
+
+async def readyz():
+    """Readiness probe: 503 when this worker shouldn't get traffic; degraded integrations still answer 200"""
+    report = await health_checker.ready()
+    return JSONResponse(report, status_code=503 if report["status"] == "fail" else 200)
+
+app.add_api_route("/healthz", healthz, methods=["GET"], include_in_schema=False)
+app.add_api_route("/readyz", readyz, methods=["GET"], include_in_schema=False)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1156,10 +2152,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def ensure_indexes():
+    try:
+        await services["db"].carts.create_index("id", unique=True)
+        await ensure_report_indexes(services["db"])
+        if RATE_LIMIT_STORE == "mongo":
+            await ensure_rate_limit_indexes(services["db"])
+        await ensure_inbox_indexes(services["db"])
+        await ensure_job_indexes(services["db"])
+        await ensure_payment_indexes(services["db"])
+        await ensure_reconcile_indexes(services["db"])
+        await ensure_archive_indexes(services["db"])
+        await ensure_cold_indexes(services["db"])
+        await ensure_export_indexes(services["db"])
+        await ensure_capacity_indexes(services["db"])
+    except Exception as e:
+        logger.error(f"Failed to create indexes: {str(e)}")
+
+async def graceful_shutdown():
+    """Runs once uvicorn has stopped accepting connections and finished in-flight requests
+
+    1. Fail readiness and stop taking new background jobs and webhook events
+    2. Give running jobs and webhook handlers SHUTDOWN_DRAIN_SECONDS to finish
+    3. Hand whatever is left back to background_jobs / webhook_inbox for another worker
+    4. Close the services: loops, cart write-behind flush, then HTTP and Mongo pools
+    """
+    health_checker.draining = True
+    drains = {}
+    for name in ("background_jobs", "webhook_inbox"):
+        if services.started(name):
+            drains[name] = services[name].drain(SHUTDOWN_DRAIN_SECONDS)
+    results = await asyncio.gather(*drains.values(), return_exceptions=True)
+    for name, result in zip(drains, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to drain {name}: {str(result)}")
+        else:
+            logger.info(f"Drained {name}: {result}")
+    await services.shutdown()
+
+SERVER_IMPORT_SECONDS = perf_counter() - SERVER_IMPORT_STARTED
+logger.info(f"server.py imported in {SERVER_IMPORT_SECONDS * 1000:.1f}ms")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,117 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import SERVICE_STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceNotReady(RuntimeError):
+    pass
+
+
+class _Registration:
+    __slots__ = ("name", "factory", "close", "lazy", "after")
+
+    def __init__(self, name: str, factory: Callable, close: Optional[Callable], lazy: bool, after: Tuple[str, ...]):
+        self.name = name
+        self.factory = factory
+        self.close = close
+        self.lazy = lazy
+        self.after = after
+
+
+class ServiceContainer:
+    """Integration clients built by the app lifespan instead of at import time
+
+    Eager services are built concurrently when the app starts; lazy ones on first
+    use. Blocking factories (credential files, discovery documents) run in a thread
+    so they overlap with each other and with the Mongo client setup.
+    """
+
+    def __init__(self):
+        self._registrations: Dict[str, _Registration] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._started_order: List[str] = []
+        self.timings: Dict[str, float] = {}
+
+    def register(self, name: str, factory: Callable, close: Optional[Callable] = None, lazy: bool = False, after: Tuple[str, ...] = ()):
+        """Register (or replace) how a service is built and closed
+
+        Services named in `after` are started before this one and closed after it.
+        """
+        self._registrations[name] = _Registration(name, factory, close, lazy, tuple(after))
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._instances[name]
+        except KeyError:
+            raise ServiceNotReady(f"Service '{name}' has not been started") from None
+
+    def started(self, name: str) -> bool:
+        return name in self._instances
+
+    async def _build(self, registration: _Registration) -> Any:
+        for dependency in registration.after:
+            await self.get(dependency)
+        start = time.perf_counter()
+        if inspect.iscoroutinefunction(registration.factory):
+            instance = await registration.factory()
+        else:
+            instance = await asyncio.to_thread(registration.factory)
+        elapsed = time.perf_counter() - start
+
+        self._instances[registration.name] = instance
+        self._started_order.append(registration.name)
+        self.timings[registration.name] = round(elapsed, 4)
+        SERVICE_STARTUP_SECONDS.labels(registration.name).set(elapsed)
+        logger.info(f"Service {registration.name} ready in {elapsed * 1000:.1f}ms")
+        return instance
+
+    async def get(self, name: str) -> Any:
+        """Return a service, building it on first use if it is lazy"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        registration = self._registrations.get(name)
+        if registration is None:
+            raise ServiceNotReady(f"Unknown service '{name}'")
+
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self._instances:
+                return self._instances[name]
+            return await self._build(registration)
+
+    async def startup(self, include_lazy: bool = False):
+        """Build every eager service (and the lazy ones too if include_lazy) concurrently"""
+        start = time.perf_counter()
+        names = [
+            name for name, registration in self._registrations.items()
+            if include_lazy or not registration.lazy
+        ]
+        await asyncio.gather(*(self.get(name) for name in names))
+        logger.info(
+            f"Services started in {(time.perf_counter() - start) * 1000:.1f}ms: "
+            + ", ".join(f"{name}={self.timings[name] * 1000:.1f}ms" for name in names)
+        )
+
+    async def shutdown(self):
+        """Close services in reverse start order; one failing close doesn't stop the rest"""
+        for name in reversed(self._started_order):
+            registration = self._registrations.get(name)
+            instance = self._instances.pop(name, None)
+            if registration is None or registration.close is None or instance is None:
+                continue
+            try:
+                result = registration.close(instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Failed to close service {name}: {str(e)}")
+        self._started_order.clear()
+        self._locks.clear()
@@ -0,0 +1,207 @@
+import codecs
+import csv
+import logging
+import re
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from lifecycle import BOOKINGS_ARCHIVE
+from payment_state import transition_payments_bulk
+
+logger = logging.getLogger(__name__)
+
+MANUAL_PAYMENT_METHODS = ("venmo", "cashapp", "zelle")
+
+# Rows are resolved against bookings and confirmed this many at a time
+STATEMENT_BATCH_SIZE = 200
+# Rows that couldn't be confirmed are listed in the report, up to this many
+MAX_REPORTED_EXCEPTIONS = 500
+# Statement amount may differ from the booking total by this much (rounding, fees)
+AMOUNT_TOLERANCE = 0.01
+
+# Booking references look like EGF20250614A1B2C3; customers type them with
+# spaces, dashes or in lower case, so all of those are accepted
+BOOKING_REFERENCE_PATTERN = re.compile(r"\bEGF[\s-]?(\d{8})[\s-]?([0-9A-F]{6})\b", re.IGNORECASE)
+
+# Header names used by the Venmo, Cash App and bank (Zelle) exports, lower-cased
+NOTE_COLUMNS = ("note", "notes", "memo", "description", "message")
+AMOUNT_COLUMNS = ("amount (total)", "amount", "net amount", "credit")
+ID_COLUMNS = ("id", "transaction id", "reference", "reference number", "confirmation number")
+NAME_COLUMNS = ("from", "name of sender/receiver", "sender", "payer")
+
+
+def extract_booking_reference(note: str) -> Optional[str]:
+    match = BOOKING_REFERENCE_PATTERN.search(note or "")
+    if not match:
+        return None
+    return f"EGF{match.group(1)}{match.group(2).upper()}"
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """'+ $1,250.00' -> 1250.0; '- $20.00' and '(20.00)' are outgoing and come back negative"""
+    text = (value or "").strip()
+    if not text:
+        return None
+    negative = text.startswith("-") or text.startswith("(")
+    digits = re.sub(r"[^0-9.]", "", text)
+    if not digits:
+        return None
+    try:
+        amount = float(digits)
+    except ValueError:
+        return None
+    return -amount if negative else amount
+
+
+async def _records(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Complete CSV records from a byte stream; quoted fields may span lines and chunks"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    record = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            record += line + "\n"
+            # An odd number of quotes so far means we're inside a quoted field
+            if record.count('"') % 2 == 0:
+                yield record
+                record = ""
+    pending += decoder.decode(b"", final=True)
+    record += pending
+    if record.strip():
+        yield record
+
+
+def _pick(header: List[str], candidates) -> Optional[int]:
+    for candidate in candidates:
+        if candidate in header:
+            return header.index(candidate)
+    return None
+
+
+async def parse_statement(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Incoming payments from a Venmo/Cash App/bank CSV export, one dict per row
+
+    Exports put account details above the header row, so rows are skipped until
+    one names a note and an amount column.
+    """
+    columns = None
+    line_number = 0
+    async for record in _records(chunks):
+        line_number += record.count("\n") or 1
+        row = next(csv.reader([record]), [])
+        if columns is None:
+            header = [cell.strip().lower() for cell in row]
+            note, amount = _pick(header, NOTE_COLUMNS), _pick(header, AMOUNT_COLUMNS)
+            if note is not None and amount is not None:
+                columns = {"note": note, "amount": amount, "id": _pick(header, ID_COLUMNS), "name": _pick(header, NAME_COLUMNS)}
+            continue
+        if not any(cell.strip() for cell in row):
+            continue
+
+        def cell(name):
+            index = columns[name]
+            return row[index].strip() if index is not None and index < len(row) else ""
+
+        amount = parse_amount(cell("amount"))
+        if amount is None or amount <= 0:
+            continue
+        yield {
+            "line": line_number,
+            "transaction_id": cell("id") or None,
+            "name": cell("name") or None,
+            "note": cell("note"),
+            "amount": amount,
+            "booking_reference": extract_booking_reference(cell("note"))
+        }
+    if columns is None:
+        raise ValueError("No header row with a note and an amount column found")
+
+
+async def _match_batch(db, rows: List[Dict[str, Any]], method: str, dry_run: bool,
+                       outcomes: Counter, exceptions: List[Dict[str, Any]], seen: Set[str]) -> List[str]:
+    references = sorted({row["booking_reference"] for row in rows if row["booking_reference"]})
+    bookings = {}
+    if references:
+        # A Venmo statement can only confirm bookings checked out with Venmo
+        async for booking in db.bookings.find(
+            {"booking_reference": {"$in": references}, "payment_method": method},
+            {"_id": 0, "id": 1, "booking_reference": 1, "total_amount": 1, "payment_status": 1}
+        ):
+            bookings[booking["booking_reference"]] = booking
+    missing = [reference for reference in references if reference not in bookings]
+    other_method = set()
+    archived = set()
+    if missing:
+        async for booking in db.bookings.find({"booking_reference": {"$in": missing}}, {"_id": 0, "booking_reference": 1}):
+            other_method.add(booking["booking_reference"])
+        async for booking in db[BOOKINGS_ARCHIVE].find({"booking_reference": {"$in": missing}}, {"_id": 0, "booking_reference": 1}):
+            archived.add(booking["booking_reference"])
+
+    transitions = []
+    for row in rows:
+        booking = bookings.get(row["booking_reference"])
+        if row["booking_reference"] is None:
+            outcome = "no_reference"
+        elif row["booking_reference"] in other_method:
+            # The booking exists but was paid some other way; never confirm it from this statement
+            outcome = "unmatched"
+        elif booking is None:
+            # Archived bookings need restoring (POST /api/admin/bookings/{id}/restore) before they can be confirmed
+            outcome = "booking_archived" if row["booking_reference"] in archived else "booking_not_found"
+        elif booking["id"] in seen:
+            outcome = "duplicate_row"
+        elif booking.get("payment_status") != "pending":
+            outcome = "already_paid" if booking.get("payment_status") == "completed" else "not_pending"
+        elif abs(row["amount"] - float(booking.get("total_amount") or 0)) > AMOUNT_TOLERANCE:
+            outcome = "amount_mismatch"
+        else:
+            outcome = "matched"
+            seen.add(booking["id"])
+            transitions.append((booking["id"], f"{method}:{row['transaction_id'] or 'line-' + str(row['line'])}"))
+        outcomes[outcome] += 1
+        if outcome != "matched" and len(exceptions) < MAX_REPORTED_EXCEPTIONS:
+            exceptions.append({**row, "outcome": outcome, "booking_total": booking.get("total_amount") if booking else None})
+
+    if dry_run:
+        return []
+    return await transition_payments_bulk(db, transitions, "completed", "manual", note=f"{method} statement import")
+
+
+async def import_statement(db, chunks: AsyncIterator[bytes], method: str, dry_run: bool = False) -> Dict[str, Any]:
+    """Match a statement export against pending bookings and confirm the ones that line up
+
+    A row is confirmed when its note carries a booking reference, the booking was
+    checked out with this payment method, is still pending and the amount equals
+    the booking total. Everything else is
+    returned in `exceptions` for a person to look at.
+    """
+    outcomes: Counter = Counter()
+    exceptions: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    confirmed: List[str] = []
+    rows = 0
+    batch: List[Dict[str, Any]] = []
+    async for row in parse_statement(chunks):
+        rows += 1
+        batch.append(row)
+        if len(batch) >= STATEMENT_BATCH_SIZE:
+            confirmed += await _match_batch(db, batch, method, dry_run, outcomes, exceptions, seen)
+            batch = []
+    if batch:
+        confirmed += await _match_batch(db, batch, method, dry_run, outcomes, exceptions, seen)
+
+    # A matched booking can still lose a race with another update between lookup and write
+    if not dry_run:
+        outcomes["changed_during_import"] = outcomes["matched"] - len(confirmed)
+    logger.info(f"Imported {method} statement: {rows} incoming payments, {len(confirmed)} bookings confirmed")
+    return {
+        "method": method,
+        "dry_run": dry_run,
+        "rows": rows,
+        "confirmed": len(confirmed),
+        "confirmed_booking_ids": confirmed,
+        "outcomes": dict(outcomes),
+        "exceptions": exceptions
+    }
@@ -0,0 +1,227 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage of a request, background task or webhook follow-up"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_time", "end_time", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_time if self.end_time is not None else time.time()
+        return round((end - self.start_time) * 1000, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory for the admin trace endpoints"""
+
+    def __init__(self, capacity: int = 10000):
+        self.spans: deque = deque(maxlen=capacity)
+
+    def export(self, span: Span):
+        self.spans.append(span.to_dict())
+
+    def get_trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        return sorted((s for s in list(self.spans) if s["trace_id"] == trace_id), key=lambda s: s["start_time"])
+
+    def find_traces(self, booking_id: Optional[str] = None, min_duration_ms: float = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """Summaries of root spans, newest first; booking_id pulls in every trace touching that booking"""
+        spans = list(self.spans)
+        trace_ids = None
+        if booking_id:
+            trace_ids = {s["trace_id"] for s in spans if s["attributes"].get("booking_id") == booking_id}
+
+        traces = []
+        for span in reversed(spans):
+            if span["parent_id"] is not None:
+                continue
+            if trace_ids is not None and span["trace_id"] not in trace_ids:
+                continue
+            if span["duration_ms"] < min_duration_ms:
+                continue
+            traces.append({
+                "trace_id": span["trace_id"],
+                "name": span["name"],
+                "start_time": span["start_time"],
+                "duration_ms": span["duration_ms"],
+                "status": span["status"],
+                "booking_id": span["attributes"].get("booking_id")
+            })
+            if len(traces) >= limit:
+                break
+        return traces
+
+
+class JsonFileExporter:
+    """Appends finished spans as NDJSON from a writer thread so the event loop never does file I/O"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-file-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.put(span.to_dict())
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as handle:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                handle.write(json.dumps(record, default=str))
+                handle.write("\n")
+                if self._queue.empty():
+                    handle.flush()
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = True
+        self.exporters: List[Any] = []
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def _export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.error(f"Trace exporter failed: {str(e)}")
+
+    @contextmanager
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes):
+        """Open a span as a child of the current (or given) span; a new trace starts if there is none"""
+        if not self.enabled:
+            yield None
+            return
+
+        parent = parent or _current_span.get()
+        if parent is not None:
+            # Booking id is the key that links checkout, webhook and background traces
+            if "booking_id" not in attributes and "booking_id" in parent.attributes:
+                attributes["booking_id"] = parent.attributes["booking_id"]
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        else:
+            span = Span(name, uuid.uuid4().hex, None, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_time = time.time()
+            _current_span.reset(token)
+            self._export(span)
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            if hasattr(exporter, "shutdown"):
+                exporter.shutdown()
+
+
+tracer = Tracer()
+start_span = tracer.start_span
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_booking_id(booking_id: str):
+    """Tag the current span with the booking id; spans opened beneath it inherit the tag"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute("booking_id", booking_id)
+
+
+def traced_task(func: Callable, name: Optional[str] = None) -> Callable:
+    """Wrap a background coroutine so it runs as a child span of the request that scheduled it"""
+    parent = _current_span.get()
+    span_name = name or f"task.{getattr(func, '__name__', 'task')}"
+
+    async def run(*args, **kwargs):
+        with start_span(span_name, parent=parent):
+            return await func(*args, **kwargs)
+
+    run.__name__ = getattr(func, "__name__", "task")
+    return run
+
+
+async def tracing_middleware(request, call_next):
+    """Root span per HTTP request, named by route template"""
+    with start_span(f"{request.method} {request.url.path}", method=request.method) as span:
+        response = await call_next(request)
+        if span is not None:
+            route = request.scope.get("route")
+            span.name = f"{request.method} {getattr(route, 'path', request.url.path)}"
+            span.set_attribute("status_code", response.status_code)
+            if response.status_code >= 500:
+                span.status = "error"
+        return response
+
+
+def configure_tracing(enabled: bool, buffer_size: int, file_path: Optional[str]) -> Optional[RingBufferExporter]:
+    """Install the ring-buffer exporter (and optionally the JSON file exporter); returns the ring buffer"""
+    tracer.enabled = enabled
+    if not enabled:
+        return None
+    ring_buffer = RingBufferExporter(buffer_size)
+    tracer.add_exporter(ring_buffer)
+    if file_path:
+        tracer.add_exporter(JsonFileExporter(file_path))
+    return ring_buffer
@@ -0,0 +1,321 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+# NOTE: this module is imported by the render worker processes, so it must not
+# import server.py or open any connections at import time.
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout changes so cached PDFs are re-rendered
+RENDERER_VERSION = "1"
+
+# Letter size at 150 DPI
+PAGE_DPI = 150
+PAGE_WIDTH = int(8.5 * PAGE_DPI)
+PAGE_HEIGHT = int(11 * PAGE_DPI)
+MARGIN = 100
+
+WAIVER_TITLE = "Waiver of Liability, Assumption of Risk, and Indemnity Agreement"
+
+WAIVER_SECTIONS = [
+    (None, "PLEASE READ THIS DOCUMENT CAREFULLY. IT IS A LEGALLY BINDING AGREEMENT THAT WILL AFFECT YOUR LEGAL RIGHTS."),
+    (None, "In consideration of being permitted to participate in the activities provided by Exclusive Water Sports & Lounge "
+           "(hereinafter referred to as \"The Company\"), located and operating in Panama City, Florida, and Panama City Beach, "
+           "Bay County, Florida, the undersigned participant (and/or Participant's legal guardian, if the Participant is under "
+           "18 years of age) hereby agrees to the following terms:"),
+    ("1. Assumption of Risk",
+     "The undersigned acknowledges and agrees that participation in all activities offered by The Company, including but not "
+     "limited to water sports, rentals (e.g., jet skis, kayaks, paddleboards, boats), swimming, sunbathing, use of lounge areas, "
+     "and general beach activities, carries inherent risks of injury, illness, property damage, and even death. These risks "
+     "include environmental hazards, marine and wildlife encounters, equipment and facility use, third-party actions, the use "
+     "or refusal of flotation devices, and the increased risks of nighttime activities. The Undersigned voluntarily accepts and "
+     "assumes all risks, whether known or unknown, foreseen or unforeseen, associated with participation in The Company's "
+     "activities and use of its facilities."),
+    ("2. Waiver and Release of Liability",
+     "The Undersigned, for themselves and their heirs, executors, administrators, personal representatives, and assigns, hereby "
+     "waives, releases, discharges, and forever relinquishes The Company, its owners, agents, officers, directors, employees, "
+     "volunteers, affiliates, and insurers (collectively, the \"Released Parties\") from any and all claims, demands, actions, "
+     "or causes of action of any kind arising out of or relating to participation in The Company's activities, EVEN IF CAUSED "
+     "IN WHOLE OR IN PART BY THE NEGLIGENCE, FAULT, OR CARELESSNESS OF THE RELEASED PARTIES. This includes claims for personal "
+     "injury, illness, or death; property damage or loss; and loss or theft of personal items. The Undersigned understands that "
+     "NO LIFEGUARDS ARE PRESENT at any time during The Company's operations or activities."),
+    ("3. Indemnification",
+     "The Undersigned hereby agrees to indemnify, defend, and hold harmless the Released Parties from and against any and all "
+     "losses, liabilities, damages, costs, or expenses (including reasonable attorneys' fees) that any of the Released Parties "
+     "may incur as a result of any claim, suit, or proceeding brought by the Undersigned, their family, or any third party "
+     "alleging injury, death, or property damage arising out of the Undersigned's participation in The Company's activities."),
+    ("4. Participant Obligations, Representations & Warranties",
+     "The Undersigned will inspect the equipment and premises before use and accepts them \"as is\"; is physically fit and has "
+     "no medical conditions that would prevent safe participation; will follow all posted rules, instructions, and safety "
+     "guidelines; is responsible for their own conduct and that of any minor under their supervision; may be charged for "
+     "damage caused to The Company's property; is not under the influence of alcohol, illegal drugs, or any impairing "
+     "medication; and is participating entirely voluntarily."),
+    ("5. Emergency Medical Authorization",
+     "In the event of an emergency, and if the Undersigned is unable to communicate, the Undersigned hereby authorizes The "
+     "Company and its staff to administer or obtain first aid and emergency medical care, including transportation to a "
+     "medical facility, and shall be solely responsible for any and all costs associated with such care."),
+    ("6. Photo and Video Release",
+     "The Undersigned hereby grants Exclusive Water Sports & Lounge permission to photograph and/or video record their "
+     "participation in activities and consents to the use of these images and recordings for promotional, marketing, or "
+     "archival purposes without further compensation or notification."),
+    ("7. Cancellation Policy",
+     "If The Company cancels a confirmed tour or activity due to unforeseen circumstances, including severe weather or "
+     "equipment malfunction, guests will be offered the opportunity to reschedule. If rescheduling is not possible or "
+     "desired, guests may request a full refund for the portion of the activity canceled."),
+    ("8. Governing Law and Severability",
+     "This Agreement shall be governed by and construed under the laws of the State of Florida, and any legal action relating "
+     "to this Agreement shall be brought in Bay County, Florida. If any provision of this Agreement is held to be invalid or "
+     "unenforceable, the remainder of the Agreement shall continue in full legal force and effect."),
+    (None, "BY SIGNING THIS DOCUMENT, I ACKNOWLEDGE THAT I HAVE CAREFULLY READ THIS WAIVER OF LIABILITY, ASSUMPTION OF RISK, "
+           "AND INDEMNITY AGREEMENT. I UNDERSTAND AND AGREE TO ITS TERMS, AND I AM SIGNING IT FREELY AND VOLUNTARILY WITHOUT "
+           "ANY INDUCEMENT."),
+]
+
+# Fields that make up the signed document; anything else (mongo ids, render
+# bookkeeping) must not change the digest
+DIGEST_FIELDS = ("id", "cart_id", "waiver_data", "guests", "signed_at", "total_guests")
+
+
+def waiver_content_digest(waiver: Dict[str, Any]) -> str:
+    """Content address of a waiver PDF: sha256 over the signed fields and renderer version"""
+    content = {field: waiver.get(field) for field in DIGEST_FIELDS}
+    payload = json.dumps(
+        {"renderer": RENDERER_VERSION, "waiver": content},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _load_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only ships the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _decode_signature(data_url: Optional[str]) -> Optional[Image.Image]:
+    """Decode a canvas data URL (data:image/png;base64,...) into an RGBA image"""
+    if not data_url:
+        return None
+    try:
+        encoded = data_url.split(",", 1)[1] if data_url.startswith("data:") else data_url
+        image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+        return image.convert("RGBA")
+    except Exception:
+        return None
+
+
+class _PdfCanvas:
+    """Minimal top-to-bottom page writer on top of Pillow"""
+
+    def __init__(self):
+        self.pages: List[Image.Image] = []
+        self.title_font = _load_font(30)
+        self.heading_font = _load_font(21)
+        self.body_font = _load_font(17)
+        self.small_font = _load_font(14)
+        self._new_page()
+
+    def _new_page(self):
+        self.page = Image.new("RGB", (PAGE_WIDTH, PAGE_HEIGHT), "white")
+        self.draw = ImageDraw.Draw(self.page)
+        self.pages.append(self.page)
+        self.y = MARGIN
+
+    def _ensure_space(self, height: int):
+        if self.y + height > PAGE_HEIGHT - MARGIN:
+            self._new_page()
+
+    def _wrap(self, text: str, font) -> List[str]:
+        max_width = PAGE_WIDTH - 2 * MARGIN
+        lines = []
+        current = ""
+        for word in text.split():
+            candidate = f"{current} {word}".strip()
+            if self.draw.textlength(candidate, font=font) <= max_width:
+                current = candidate
+            else:
+                if current:
+                    lines.append(current)
+                current = word
+        if current:
+            lines.append(current)
+        return lines
+
+    def text(self, text: str, font=None, spacing: int = 6, after: int = 12):
+        font = font or self.body_font
+        line_height = font.getbbox("Hg")[3] + spacing
+        for line in self._wrap(text, font):
+            self._ensure_space(line_height)
+            self.draw.text((MARGIN, self.y), line, fill="black", font=font)
+            self.y += line_height
+        self.y += after
+
+    def rule(self, after: int = 16):
+        self._ensure_space(2 + after)
+        self.draw.line((MARGIN, self.y, PAGE_WIDTH - MARGIN, self.y), fill="#1e7b85", width=2)
+        self.y += after
+
+    def signature(self, label: str, image: Optional[Image.Image], box=(420, 120)):
+        self._ensure_space(box[1] + 40)
+        self.draw.text((MARGIN, self.y), label, fill="black", font=self.small_font)
+        self.y += 22
+        self.draw.rectangle((MARGIN, self.y, MARGIN + box[0], self.y + box[1]), outline="#999999")
+        if image is not None:
+            image.thumbnail((box[0] - 10, box[1] - 10))
+            self.page.paste(image, (MARGIN + 5, self.y + 5), image)
+        else:
+            self.draw.text((MARGIN + 10, self.y + 10), "(not provided)", fill="#999999", font=self.small_font)
+        self.y += box[1] + 18
+
+    def to_pdf(self) -> bytes:
+        buffer = io.BytesIO()
+        self.pages[0].save(
+            buffer,
+            "PDF",
+            save_all=True,
+            append_images=self.pages[1:],
+            resolution=PAGE_DPI
+        )
+        return buffer.getvalue()
+
+
+def render_waiver_pdf(waiver: Dict[str, Any]) -> bytes:
+    """Render a signed waiver (as stored in MongoDB) into PDF bytes; runs in a worker process"""
+    canvas = _PdfCanvas()
+    waiver_data = waiver.get("waiver_data") or {}
+
+    canvas.text("Exclusive Gulf Float", font=canvas.title_font, after=4)
+    canvas.text(WAIVER_TITLE, font=canvas.heading_font, after=8)
+    canvas.text(
+        f"Waiver ID: {waiver.get('id')}    Cart ID: {waiver.get('cart_id')}    Signed at: {waiver.get('signed_at')}",
+        font=canvas.small_font
+    )
+    canvas.rule()
+
+    for heading, body in WAIVER_SECTIONS:
+        if heading:
+            canvas.text(heading, font=canvas.heading_font, after=4)
+        canvas.text(body)
+
+    canvas.rule()
+    canvas.text("Emergency Contact", font=canvas.heading_font, after=4)
+    canvas.text(
+        f"{waiver_data.get('emergency_contact_name', '')} - {waiver_data.get('emergency_contact_phone', '')}"
+        + (f" ({waiver_data['emergency_contact_relationship']})" if waiver_data.get('emergency_contact_relationship') else "")
+    )
+    if waiver_data.get("medical_conditions"):
+        canvas.text(f"Medical conditions: {waiver_data['medical_conditions']}")
+    if waiver_data.get("additional_notes"):
+        canvas.text(f"Additional notes: {waiver_data['additional_notes']}")
+
+    canvas.rule()
+    canvas.text(f"Guests ({waiver.get('total_guests', len(waiver.get('guests') or []))})", font=canvas.heading_font, after=4)
+    for guest in waiver.get("guests") or []:
+        status = "Minor" if guest.get("isMinor") else "Adult"
+        canvas.text(f"Guest {guest.get('id')}: {guest.get('name')} ({status}) - {guest.get('date')}", after=6)
+        canvas.signature("Participant signature", _decode_signature(guest.get("participantSignature")))
+        if guest.get("isMinor"):
+            canvas.text(f"Parent/Guardian: {guest.get('guardianName') or ''}", after=6)
+            canvas.signature("Parent/Guardian signature", _decode_signature(guest.get("guardianSignature")))
+
+    return canvas.to_pdf()
+
+
+class WaiverPdfCache:
+    """Content-addressed on-disk store for rendered waiver PDFs"""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    def path_for(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.pdf"
+
+    def exists(self, digest: str) -> bool:
+        return self.path_for(digest).is_file()
+
+    def write(self, digest: str, pdf_bytes: bytes) -> Path:
+        """Write atomically so a concurrent reader never sees a partial file"""
+        path = self.path_for(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(pdf_bytes)
+        os.replace(tmp_path, path)
+        return path
+
+
+class WaiverPdfPipeline:
+    """Renders waiver PDFs in a process pool and stores them in the content-addressed cache"""
+
+    def __init__(self, cache_dir: Path, max_workers: int = 2):
+        self.cache = WaiverPdfCache(cache_dir)
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn keeps the workers free of the parent's Motor threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def render(self, waiver: Dict[str, Any]) -> str:
+        """Ensure the PDF for this waiver exists in the cache and return its digest"""
+        digest = await asyncio.to_thread(waiver_content_digest, waiver)
+        if await asyncio.to_thread(self.cache.exists, digest):
+            return digest
+
+        # Coalesce concurrent requests for the same document into one render
+        inflight = self._inflight.get(digest)
+        if inflight is not None:
+            try:
+                await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The render we were waiting on was cancelled, not us: start a new one
+                return await self.render(waiver)
+            return digest
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[digest] = future
+        try:
+            pdf_bytes = await loop.run_in_executor(self._get_executor(), render_waiver_pdf, waiver)
+            await asyncio.to_thread(self.cache.write, digest, pdf_bytes)
+            future.set_result(digest)
+            logger.info(f"Rendered waiver PDF {waiver.get('id')} ({len(pdf_bytes)} bytes, digest {digest[:12]})")
+            return digest
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an un-awaited failure doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(digest, None)
+            if not future.done():
+                # Cancelled (e.g. a background job cut off at shutdown); release the followers
+                future.cancel()
+
+    async def shutdown(self):
+        """Stop the worker processes; waiting for a render already running happens off the event loop"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import WEBHOOK_INBOX_EVENTS, WEBHOOK_PROCESSING_LAG
+from tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_INBOX_COLLECTION = "webhook_inbox"
+
+# pending -> processing -> processed, or back to pending with a backoff, or failed
+# once attempts run out; replay puts processed/failed events back to pending
+INBOX_STATUSES = ("pending", "processing", "processed", "failed")
+
+
+async def ensure_inbox_indexes(db):
+    inbox = db[WEBHOOK_INBOX_COLLECTION]
+    await inbox.create_index([("provider", 1), ("event_id", 1)], unique=True)
+    await inbox.create_index([("status", 1), ("next_attempt_at", 1)])
+    await inbox.create_index([("ordering_key", 1), ("received_at", 1)])
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class WebhookInbox:
+    """Durable queue between the webhook endpoints and the code that applies payment events
+
+    The endpoints only verify and store the event, then acknowledge. A pool of
+    workers claims due events and runs the provider's handler. Events with the
+    same ordering key (the payment session, i.e. the booking) always go to the
+    same worker and are processed oldest first; failures are retried with
+    exponential backoff until max_attempts, after which the event is parked as
+    failed for replay.
+    """
+
+    def __init__(self, get_db: Callable, handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]],
+                 workers: int = 4, max_attempts: int = 8, poll_interval: float = 1.0,
+                 lease: timedelta = timedelta(minutes=5), batch_size: int = 100):
+        self.get_db = get_db
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._queued: set = set()
+        self._processing: set = set()
+        self._closing = False
+
+    @property
+    def collection(self):
+        return self.get_db()[WEBHOOK_INBOX_COLLECTION]
+
+    def start(self):
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._dispatch_loop())]
+        self._tasks += [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        return self
+
+    async def record(self, provider: str, event_id: str, event_type: str, ordering_key: Optional[str], payload: Dict[str, Any]) -> bool:
+        """Store a verified event; returns False if the provider already delivered it"""
+        now = _now().isoformat()
+        try:
+            await self.collection.insert_one({
+                "id": str(uuid.uuid4()),
+                "provider": provider,
+                "event_id": event_id,
+                "event_type": event_type,
+                "ordering_key": ordering_key or event_id,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "next_attempt_at": now
+            })
+        except DuplicateKeyError:
+            WEBHOOK_INBOX_EVENTS.labels(provider, "duplicate").inc()
+            return False
+        WEBHOOK_INBOX_EVENTS.labels(provider, "received").inc()
+        self._wake.set()
+        return True
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._dispatch_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook inbox dispatch failed: {str(e)}")
+
+    async def _dispatch_due(self):
+        now = _now()
+        cursor = self.collection.find(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+                # Claimed by a worker that died before finishing
+                {"status": "processing", "claimed_at": {"$lt": (now - self.lease).isoformat()}}
+            ]},
+            {"_id": 0, "id": 1, "ordering_key": 1, "received_at": 1}
+        ).sort("received_at", 1).limit(self.batch_size)
+        async for event in cursor:
+            if event["id"] in self._queued:
+                continue
+            self._queued.add(event["id"])
+            worker = zlib.crc32(event["ordering_key"].encode()) % self.workers
+            self._queues[worker].put_nowait(event)
+
+    async def _claim(self, due: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Another process may hold an older event for the same booking; let it go first.
+        # Checked before claiming, so an event waiting its turn costs a read per poll
+        # but no write, and its attempts and backoff are left alone.
+        earlier = await self.collection.find_one({
+            "id": {"$ne": due["id"]},
+            "ordering_key": due["ordering_key"],
+            "received_at": {"$lt": due["received_at"]},
+            "status": {"$in": ["pending", "processing"]}
+        }, {"_id": 1})
+        if earlier is not None:
+            return None
+
+        now = _now()
+        # Pending events carry no claimed_at; a processing one is only taken over once its lease ran out
+        claim = {"status": "processing", "claimed_at": now.isoformat(), "claimed_by": self.owner}
+        event = await self.collection.find_one_and_update(
+            {
+                "id": due["id"],
+                "status": {"$in": ["pending", "processing"]},
+                "claimed_at": {"$not": {"$gte": (now - self.lease).isoformat()}}
+            },
+            {"$set": claim},
+            projection={"_id": 0}
+        )
+        if event is not None:
+            event.update(claim)
+        return event
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            due = await queue.get()
+            event_id = due["id"]
+            if self._closing:
+                # Still pending in Mongo; whichever worker runs next picks it up
+                self._queued.discard(event_id)
+                continue
+            self._processing.add(event_id)
+            try:
+                event = await self._claim(due)
+                if event is not None:
+                    await self._process(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook inbox worker error on {event_id}: {str(e)}")
+            finally:
+                self._queued.discard(event_id)
+                self._processing.discard(event_id)
+
+    async def _process(self, event: Dict[str, Any]):
+        provider = event["provider"]
+        handler = self.handlers.get(provider)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for provider {provider}")
+            with start_span("webhook.process", provider=provider, event_type=event["event_type"]):
+                await handler(event)
+        except Exception as e:
+            attempts = event.get("attempts", 0) + 1
+            failed = attempts >= self.max_attempts
+            delay = min(2 ** attempts, 300)
+            await self.collection.update_one(
+                {"id": event["id"]},
+                {"$set": {
+                    "status": "failed" if failed else "pending",
+                    "attempts": attempts,
+                    "last_error": f"{type(e).__name__}: {e}",
+                    "next_attempt_at": (_now() + timedelta(seconds=delay)).isoformat()
+                }, "$unset": {"claimed_at": "", "claimed_by": ""}}
+            )
+            WEBHOOK_INBOX_EVENTS.labels(provider, "failed" if failed else "retry").inc()
+            logger.error(f"Webhook {provider} {event['event_id']} attempt {attempts} failed: {str(e)}")
+            return
+
+        processed_at = _now()
+        await self.collection.update_one(
+            {"id": event["id"]},
+            {"$set": {"status": "processed", "processed_at": processed_at.isoformat()}, "$inc": {"attempts": 1}}
+        )
+        WEBHOOK_INBOX_EVENTS.labels(provider, "processed").inc()
+        received_at = datetime.fromisoformat(event["received_at"])
+        WEBHOOK_PROCESSING_LAG.labels(provider).observe((processed_at - received_at).total_seconds())
+
+    async def replay(self, query: Dict[str, Any]) -> int:
+        """Queue matching processed or failed events to run again"""
+        query = {**query, "status": query.get("status", {"$in": ["processed", "failed"]})}
+        result = await self.collection.update_many(
+            query,
+            {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": _now().isoformat()}, "$unset": {"last_error": "", "claimed_at": "", "claimed_by": ""}}
+        )
+        self._wake.set()
+        return result.modified_count
+
+    async def drain(self, timeout: float) -> Dict[str, int]:
+        """Stop claiming events and give the ones being handled until timeout to finish
+
+        Events cut off mid-handler go straight back to pending rather than waiting
+        out the claim lease, so another worker retries them right away.
+        """
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._processing and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        cut_off = len(self._processing)
+        await self.close()
+        if cut_off:
+            await self.collection.update_many(
+                {"status": "processing", "claimed_by": self.owner},
+                {"$set": {"status": "pending", "next_attempt_at": _now().isoformat()}, "$unset": {"claimed_at": "", "claimed_by": ""}}
+            )
+            logger.warning(f"Shutdown deadline reached; returned {cut_off} webhook events to the inbox")
+        return {"cut_off": cut_off}
+
+    async def close(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
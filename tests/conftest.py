@@ -0,0 +1,46 @@
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py reads its configuration at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "egf_tests")
+os.environ.setdefault("CART_TOKEN_SECRET", "test-cart-secret")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("SDK_WARMUP", "false")
+os.environ.setdefault("RECONCILE_ENABLED", "false")
+os.environ.setdefault("BOOKING_ARCHIVE_ENABLED", "false")
+
+
+@pytest.fixture
+def db():
+    """Empty in-memory Mongo database (mongomock) with the Motor API"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["egf_tests"]
+
+
+@pytest.fixture
+def app_client(db, tmp_path, monkeypatch):
+    """Factory for an httpx client on the app, with its services started against `db`"""
+    import httpx
+    import server
+
+    monkeypatch.setattr(server, "WAIVER_PDF_CACHE_DIR", tmp_path / "waiver_pdfs")
+    server.services.register("db", lambda: db)
+
+    @asynccontextmanager
+    async def client():
+        async with server.lifespan(server.app):
+            server.health_checker.draining = False
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                yield http
+
+    return client
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("path", [
+    "/api/admin/bookings/missing/payment",
+    "/api/admin/payments/import?method=venmo",
+    "/api/admin/webhooks/replay",
+    "/api/admin/bookings/archive?dry_run=true",
+    "/api/admin/archive/tier?dry_run=true",
+    "/api/admin/reconcile",
+])
+def test_state_changing_admin_routes_need_the_admin_token(app_client, monkeypatch, path):
+    import server
+
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "s3cret")
+
+    async def scenario():
+        async with app_client() as http:
+            anonymous = await http.post(path, json={})
+            wrong = await http.post(path, json={}, headers={"Authorization": "Bearer nope"})
+            right = await http.post(path, json={}, headers={"Authorization": "Bearer s3cret"})
+            return anonymous.status_code, wrong.status_code, right.status_code
+
+    anonymous, wrong, right = asyncio.run(scenario())
+    assert anonymous == 401 and wrong == 401
+    assert right not in (401, 503)
+
+
+@pytest.mark.parametrize("path", [
+    "/api/admin/reports",
+    "/api/admin/traces",
+    "/api/admin/traces/missing",
+    "/api/admin/startup",
+    "/api/admin/export/bookings",
+    "/api/admin/bookings/archived",
+    "/api/admin/db/routing",
+    "/api/admin/db/pool",
+    "/api/admin/archive/manifest",
+    "/api/admin/history/bookings",
+    "/api/admin/reconcile",
+    "/api/admin/webhooks",
+])
+def test_admin_reads_need_the_admin_token(app_client, monkeypatch, path):
+    import server
+
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "s3cret")
+
+    async def scenario():
+        async with app_client() as http:
+            anonymous = await http.get(path)
+            wrong = await http.get(path, headers={"Authorization": "Bearer nope"})
+            right = await http.get(path, headers={"Authorization": "Bearer s3cret"})
+            return anonymous.status_code, wrong.status_code, right.status_code
+
+    anonymous, wrong, right = asyncio.run(scenario())
+    assert anonymous == 401 and wrong == 401
+    assert right not in (401, 503)
+
+
+def test_admin_routes_are_disabled_without_a_configured_token(app_client, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", None)
+
+    async def scenario():
+        async with app_client() as http:
+            response = await http.post("/api/admin/bookings/missing/payment", json={"payment_status": "completed"},
+                                       headers={"Authorization": "Bearer anything"})
+            return response.status_code
+
+    assert asyncio.run(scenario()) == 503
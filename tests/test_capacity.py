@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from capacity import SlotBusy, booked_quantities, check_capacity, hold_slots, load_capacities
+
+SLOT = ("crystal_kayak", "2030-06-01", "14:00:00")
+
+
+def test_load_capacities_ignores_invalid_config():
+    assert load_capacities('{"crystal_kayak": "4"}') == {"crystal_kayak": 4}
+    assert load_capacities("not json") == {}
+    assert load_capacities(None) == {}
+
+
+def test_check_capacity_counts_confirmed_and_recent_pending(db):
+    async def scenario():
+        await db.bookings.insert_one({
+            "status": "confirmed", "created_at": "2000-01-01T00:00:00+00:00",
+            "items": [{"service_id": SLOT[0], "booking_date": SLOT[1], "booking_time": SLOT[2], "quantity": 1}]
+        })
+        fits = await check_capacity(db, {"crystal_kayak": 2}, {SLOT: 1}, timedelta(hours=1))
+        short = await check_capacity(db, {"crystal_kayak": 2}, {SLOT: 2}, timedelta(hours=1))
+        unlimited = await check_capacity(db, {}, {SLOT: 50}, timedelta(hours=1))
+        return fits, short, unlimited
+
+    fits, short, unlimited = asyncio.run(scenario())
+    assert fits == [] and unlimited == []
+    assert short == [{"service_id": SLOT[0], "booking_date": SLOT[1], "booking_time": SLOT[2], "requested": 2, "available": 1}]
+
+
+def test_hold_slots_is_exclusive_and_released(db):
+    async def scenario():
+        async with hold_slots(db, [SLOT]):
+            with pytest.raises(SlotBusy):
+                async with hold_slots(db, [SLOT], wait=0.1):
+                    pass
+        async with hold_slots(db, [SLOT], wait=0.1):
+            pass
+        return await db.capacity_slot_locks.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_concurrent_checkouts_cannot_overbook_a_slot(app_client, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "SERVICE_CAPACITY", {"crystal_kayak": 2})
+    item = {"service_id": "crystal_kayak", "quantity": 2, "booking_date": SLOT[1], "booking_time": SLOT[2]}
+    checkout = {"customer_info": {"name": "Guest", "email": "guest@example.com"}, "payment_method": "venmo"}
+
+    async def scenario():
+        async with app_client() as http:
+            cart_ids = []
+            for _ in range(3):
+                cart_id = (await http.post("/api/cart/create")).json()["cart_id"]
+                # Every cart fits on its own: nothing is booked yet
+                assert (await http.post(f"/api/cart/{cart_id}/add", json=item)).status_code == 200
+                cart_ids.append(cart_id)
+            responses = await asyncio.gather(*(http.post(f"/api/cart/{cart_id}/checkout", json=checkout) for cart_id in cart_ids))
+            return [response.status_code for response in responses]
+
+    statuses = asyncio.run(scenario())
+    assert sorted(statuses) == [200, 409, 409]
+
+
+def test_unpaid_manual_bookings_hold_their_units_longer(db):
+    three_hours_ago = (datetime.now(timezone.utc) - timedelta(hours=3)).isoformat()
+
+    async def scenario():
+        await db.bookings.insert_many([{
+            "status": "pending", "payment_method": method, "created_at": three_hours_ago,
+            "items": [{"service_id": SLOT[0], "booking_date": SLOT[1], "booking_time": SLOT[2], "quantity": 1}]
+        } for method in ("stripe", "venmo")])
+        return await booked_quantities(db, [SLOT], timedelta(hours=1), {"venmo": timedelta(days=14)})
+
+    # The Stripe checkout was abandoned; the Venmo payment may still arrive
+    assert asyncio.run(scenario()) == {SLOT: 1}
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from cart_store import MongoCartStore, TieredCartStore
+
+
+@pytest.mark.parametrize("mode, workers, known, affinity, expected", [
+    ("auto", 1, False, False, MongoCartStore),
+    ("auto", 1, True, False, TieredCartStore),
+    ("auto", 4, True, False, MongoCartStore),
+    ("auto", 4, True, True, TieredCartStore),
+    ("tiered", 1, False, False, TieredCartStore),
+    ("tiered", 4, True, False, MongoCartStore),
+    ("mongo", 1, True, False, MongoCartStore),
+])
+def test_cart_store_picks_the_in_process_tier_only_when_safe(db, monkeypatch, mode, workers, known, affinity, expected):
+    import server
+
+    monkeypatch.setattr(server, "CART_STORE", mode)
+    monkeypatch.setattr(server, "WEB_CONCURRENCY", workers)
+    monkeypatch.setattr(server, "WEB_CONCURRENCY_KNOWN", known)
+    monkeypatch.setattr(server, "CART_STORE_AFFINITY", affinity)
+    server.services.register("db", lambda: db)
+
+    async def scenario():
+        store = await server.create_cart_store()
+        await store.close()
+        return store
+
+    assert type(asyncio.run(scenario())) is expected
@@ -0,0 +1,95 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cart_tokens import CartTokenSigner, InvalidCartToken
+
+
+def test_issued_id_verifies_with_its_expiry():
+    signer = CartTokenSigner("secret")
+    cart_id, expires_at = signer.issue(timedelta(hours=2))
+    assert signer.verify(cart_id) == expires_at
+    assert expires_at > datetime.now(timezone.utc) + timedelta(minutes=119)
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda parts: [uuid.uuid4().hex, parts[1], parts[2]],
+    lambda parts: [parts[0], str(int(parts[1]) + 86400), parts[2]],
+    lambda parts: [parts[0], parts[1], parts[2][:-1] + ("A" if parts[2][-1] != "A" else "B")],
+])
+def test_tampered_ids_are_rejected(tamper):
+    signer = CartTokenSigner("secret")
+    cart_id, _ = signer.issue(timedelta(hours=2))
+    with pytest.raises(InvalidCartToken):
+        signer.verify(".".join(tamper(cart_id.split("."))))
+
+
+def test_ids_from_another_secret_are_rejected():
+    cart_id, _ = CartTokenSigner("other").issue(timedelta(hours=2))
+    with pytest.raises(InvalidCartToken):
+        CartTokenSigner("secret").verify(cart_id)
+
+
+@pytest.mark.parametrize("cart_id, valid", [
+    (str(uuid.uuid4()), True),
+    (uuid.uuid4().hex, True),
+    ("not-a-cart", False),
+    ("a.b", False),
+])
+def test_legacy_ids_must_be_uuids(cart_id, valid):
+    signer = CartTokenSigner("secret")
+    if valid:
+        assert signer.verify(cart_id) is None
+    else:
+        with pytest.raises(InvalidCartToken):
+            signer.verify(cart_id)
+
+
+def test_cart_saved_under_another_secret_is_still_served(db, app_client):
+    import server
+
+    async def scenario():
+        async with app_client() as http:
+            # Issued and saved by a worker that had a different (or no) secret
+            saved_id, expires_at = CartTokenSigner("previous-secret").issue(timedelta(hours=2))
+            await db.carts.insert_one(server.prepare_for_mongo(server.Cart(id=saved_id, expires_at=expires_at).dict()))
+            unsaved_id, _ = CartTokenSigner("previous-secret").issue(timedelta(hours=2))
+            return (
+                (await http.get(f"/api/cart/{saved_id}")).status_code,
+                (await http.get(f"/api/cart/{unsaved_id}")).status_code,
+            )
+
+    assert asyncio.run(scenario()) == (200, 404)
+
+
+def test_startup_requires_a_cart_secret_unless_single_worker(monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "CART_TOKEN_SECRET", None)
+    for known, workers in [(False, 1), (True, 4)]:
+        monkeypatch.setattr(server, "WEB_CONCURRENCY_KNOWN", known)
+        monkeypatch.setattr(server, "WEB_CONCURRENCY", workers)
+        with pytest.raises(RuntimeError):
+            server.check_required_config()
+    monkeypatch.setattr(server, "WEB_CONCURRENCY_KNOWN", True)
+    monkeypatch.setattr(server, "WEB_CONCURRENCY", 1)
+    server.check_required_config()
+
+
+def test_cart_endpoint_rejects_expired_and_unknown_ids(app_client):
+    import server
+
+    async def scenario():
+        async with app_client() as http:
+            expired_id, _ = server.cart_tokens.issue(timedelta(seconds=-1))
+            fresh_id = (await http.post("/api/cart/create")).json()["cart_id"]
+            return (
+                (await http.get(f"/api/cart/{expired_id}")).status_code,
+                (await http.get(f"/api/cart/{fresh_id}")).status_code,
+                (await http.get(f"/api/cart/{uuid.uuid4()}")).status_code,
+                (await http.get("/api/cart/garbage")).status_code,
+            )
+
+    assert asyncio.run(scenario()) == (410, 200, 404, 404)
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight, coalesce
+
+
+def counting(results):
+    calls = []
+
+    async def compute():
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(0.02)
+        return results[index]
+
+    return calls, compute
+
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls, compute = counting(["a"])
+        values = await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+        return calls, values
+
+    calls, values = asyncio.run(scenario())
+    assert calls == [0]
+    assert values == ["a"] * 5
+
+
+def test_results_are_cached_for_ttl_but_errors_are_not():
+    async def scenario():
+        flight = SingleFlight()
+        calls, compute = counting(["a", "b"])
+        first = await flight.do("k", compute, ttl=60)
+        second = await flight.do("k", compute, ttl=60)
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            await flight.do("e", fail, ttl=60)
+        assert "e" not in flight._results
+        return calls, first, second
+
+    assert asyncio.run(scenario()) == ([0], "a", "a")
+
+
+def test_callers_after_an_invalidate_do_not_get_the_earlier_flight():
+    async def scenario():
+        flight = SingleFlight()
+        calls, compute = counting(["before write", "after write"])
+        early = asyncio.create_task(flight.do("k", compute, ttl=60))
+        await asyncio.sleep(0)
+        # A write lands while the first read is still running
+        flight.invalidate("k")
+        late = await flight.do("k", compute, ttl=60)
+        cached = await flight.do("k", compute, ttl=60)
+        return await early, late, cached, calls
+
+    early, late, cached, calls = asyncio.run(scenario())
+    assert early == "before write"
+    assert late == cached == "after write"
+    assert calls == [0, 1]
+
+
+def test_decorator_keys_on_plain_arguments_only():
+    calls = []
+
+    @coalesce(ttl=60)
+    async def endpoint(cart_id: str, carts=None):
+        calls.append(cart_id)
+        return {"cart_id": cart_id}
+
+    async def scenario():
+        await endpoint("c1", carts=object())
+        await endpoint("c1", carts=object())
+        await endpoint("c2", carts=object())
+        endpoint.invalidate(cart_id="c1")
+        await endpoint("c1", carts=object())
+
+    asyncio.run(scenario())
+    assert calls == ["c1", "c2", "c1"]
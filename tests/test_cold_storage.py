@@ -0,0 +1,83 @@
+import asyncio
+import uuid
+from datetime import date
+
+import pytest
+
+from cold_storage import COLD_MANIFEST_COLLECTION, BloomFilter, ColdStore, load_codec, month_bounds, months_before
+
+
+def test_month_bounds_and_hot_window():
+    assert month_bounds("2025-06") == ("2025-06-01", "2025-07-01")
+    assert month_bounds("2025-12") == ("2025-12-01", "2026-01-01")
+    assert months_before(date(2026, 6, 15), 12) == "2025-07"
+    assert months_before(date(2026, 1, 1), 1) == "2026-01"
+
+
+def test_bloom_filter_holds_every_added_id_with_few_false_positives():
+    ids = [uuid.uuid4().hex for _ in range(2000)]
+    bloom = BloomFilter.for_count(len(ids))
+    for document_id in ids:
+        bloom.add(document_id)
+    assert all(document_id in bloom for document_id in ids)
+    false_positives = sum(uuid.uuid4().hex in bloom for _ in range(2000))
+    assert false_positives < 60
+
+
+@pytest.mark.parametrize("codec_name", ["gzip", "zstd"])
+def test_tiered_months_round_trip_through_the_archive(db, tmp_path, codec_name):
+    if codec_name == "zstd":
+        pytest.importorskip("zstandard")
+    hot_day = date.today().replace(day=1).isoformat()
+    bookings = [
+        {"id": "b-old-1", "created_at": "2020-03-04T10:00:00", "status": "confirmed", "items": [{"quantity": 2}]},
+        {"id": "b-old-2", "created_at": "2020-03-20T10:00:00", "status": "cancelled"},
+        {"id": "b-old-3", "created_at": "2020-05-01T09:00:00", "status": "confirmed"},
+        {"id": "b-hot", "created_at": f"{hot_day}T10:00:00", "status": "confirmed"},
+    ]
+
+    async def scenario():
+        await db.bookings.insert_many([dict(booking) for booking in bookings])
+        store = ColdStore(lambda: db, tmp_path, load_codec(codec_name), hot_months=1)
+        report = await store.tier()
+        hot_ids = [booking["id"] async for booking in db.bookings.find({}, {"_id": 0, "id": 1})]
+        found = await store.get("bookings", "b-old-1")
+        missing = await store.get("bookings", "b-hot")
+        march = [booking["id"] async for booking in store.find("bookings", "2020-03-01", "2020-04-01", match={"status": "confirmed"})]
+        # A second store (another worker) reads the same files through the manifest
+        other = ColdStore(lambda: db, tmp_path, load_codec("gzip"))
+        manifest = await other.manifest("bookings")
+        return report, hot_ids, found, missing, march, manifest, await other.get("bookings", "b-old-3")
+
+    report, hot_ids, found, missing, march, manifest, from_other = asyncio.run(scenario())
+    assert [(entry["month"], entry["count"]) for entry in report["files"]] == [("2020-03", 2), ("2020-05", 1)]
+    assert hot_ids == ["b-hot"]
+    assert found == bookings[0]
+    assert missing is None
+    assert march == ["b-old-1"]
+    assert [entry["status"] for entry in manifest] == ["complete", "complete"]
+    assert all((tmp_path / entry["path"]).is_file() for entry in manifest)
+    assert from_other["id"] == "b-old-3"
+
+
+def test_tier_finishes_a_run_that_stopped_after_writing(db, tmp_path, monkeypatch):
+    async def scenario():
+        await db.bookings.insert_many([{"id": "b1", "created_at": "2020-03-04T10:00:00"}])
+        store = ColdStore(lambda: db, tmp_path, load_codec("gzip"), hot_months=1)
+
+        async def crash(db, entry):
+            raise RuntimeError("process died")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(store, "_delete_archived", crash)
+            with pytest.raises(RuntimeError):
+                await store.tier()
+        stranded = await db.bookings.count_documents({})
+        await store.tier()
+        entries = await db[COLD_MANIFEST_COLLECTION].find({"collection": "bookings"}).to_list(length=None)
+        return stranded, await db.bookings.count_documents({}), entries
+
+    stranded, remaining, entries = asyncio.run(scenario())
+    assert stranded == 1
+    assert remaining == 0
+    assert [(entry["part"], entry["status"]) for entry in entries] == [(0, "complete")]
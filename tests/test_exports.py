@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from exports import resolve_columns, stream_export
+
+
+def test_default_and_selected_columns():
+    assert resolve_columns("contacts", None) == ["id", "created_at", "name", "email", "phone", "message"]
+    assert resolve_columns("bookings", " id, _id ,items,customer_email ") == ["id", "items", "customer_email"]
+
+
+@pytest.mark.parametrize("columns", [
+    "waiver_data,waiver_data.medical_conditions",
+    "waiver_data.medical_conditions,waiver_data",
+    "id,id",
+    "guests.name",
+])
+def test_unexportable_columns_are_rejected(columns):
+    with pytest.raises(ValueError):
+        resolve_columns("waivers", columns)
+
+
+def test_export_streams_rows_sorted_by_date(db):
+    async def scenario():
+        await db.contacts.insert_many([
+            {"id": "c2", "created_at": "2030-06-02T10:00:00", "name": "Bo"},
+            {"id": "c1", "created_at": "2030-06-01T10:00:00", "name": "Al", "phone": None},
+        ])
+        chunks = [chunk async for chunk in stream_export(db, "contacts", "csv", ["id", "name", "phone"], {})]
+        return "".join(chunks)
+
+    assert asyncio.run(scenario()).splitlines() == ["id,name,phone", "c1,Al,", "c2,Bo,"]
+
+
+def test_export_endpoint_rejects_overlapping_columns_before_streaming(app_client, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "s3cret")
+
+    async def scenario():
+        async with app_client() as http:
+            return await http.get("/api/admin/export/bookings", params={"columns": "items,items.name"},
+                                  headers={"Authorization": "Bearer s3cret"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert "items" in response.json()["detail"]
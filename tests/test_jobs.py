@@ -0,0 +1,93 @@
+import asyncio
+
+from fastapi import BackgroundTasks
+
+from jobs import BACKGROUND_JOBS_COLLECTION, BackgroundJobs, ensure_job_indexes
+
+
+def make_jobs(db, calls, delay=0.0):
+    async def deliver(arg):
+        await asyncio.sleep(delay)
+        calls.append(arg)
+
+    jobs = BackgroundJobs(lambda: db, poll_interval=3600)
+    jobs.register(deliver)
+    return jobs, deliver
+
+
+def test_unfinished_jobs_are_requeued_on_shutdown_and_run_elsewhere(db):
+    async def scenario():
+        calls = []
+        slow_jobs, slow = make_jobs(db, calls, delay=10)
+        background_tasks = BackgroundTasks()
+        slow_jobs.add(background_tasks, slow, {"id": "w1"})
+        await background_tasks()
+        drained = await slow_jobs.drain(timeout=0.05)
+        queued = await db[BACKGROUND_JOBS_COLLECTION].find({}, {"_id": 0}).to_list(length=None)
+
+        other_jobs, _ = make_jobs(db, calls)
+        started = await other_jobs.run_queued()
+        await asyncio.gather(*list(other_jobs._running))
+        left = await db[BACKGROUND_JOBS_COLLECTION].count_documents({})
+        return drained, queued, started, calls, left
+
+    drained, queued, started, calls, left = asyncio.run(scenario())
+    assert drained == {"finished": 0, "requeued": 1}
+    assert [(job["name"], job["argument"], job["status"]) for job in queued] == [("deliver", {"id": "w1"}, "pending")]
+    assert started == 1
+    assert calls == [{"id": "w1"}]
+    assert left == 0
+
+
+def test_enqueue_runs_each_key_once(db):
+    async def scenario():
+        await ensure_job_indexes(db)
+        calls = []
+        jobs, deliver = make_jobs(db, calls)
+        first = await jobs.enqueue(deliver, "b1", key="b1")
+        await asyncio.gather(*list(jobs._running))
+        # A replayed caller enqueues the same key again after the job has run
+        again = await jobs.enqueue(deliver, "b1", key="b1")
+        await asyncio.gather(*list(jobs._running))
+        stored = await db[BACKGROUND_JOBS_COLLECTION].find_one({"id": "deliver:b1"})
+        return first, again, calls, stored
+
+    first, again, calls, stored = asyncio.run(scenario())
+    assert (first, again) == (True, False)
+    assert calls == ["b1"]
+    assert stored["status"] == "done"
+
+
+def test_enqueue_while_draining_leaves_the_job_for_another_worker(db):
+    async def scenario():
+        calls = []
+        draining, deliver = make_jobs(db, calls)
+        await draining.drain(timeout=0)
+        await draining.enqueue(deliver, "b1", key="b1")
+        pending = await db[BACKGROUND_JOBS_COLLECTION].count_documents({"status": "pending"})
+
+        other_jobs, _ = make_jobs(db, calls)
+        await other_jobs.run_queued()
+        await asyncio.gather(*list(other_jobs._running))
+        return pending, calls
+
+    assert asyncio.run(scenario()) == (1, ["b1"])
+
+
+def test_replayed_payment_event_queues_the_lost_notification(db, app_client):
+    import server
+
+    async def scenario():
+        async with app_client():
+            # The transition committed, then the worker died before queueing the follow-up
+            await db.bookings.insert_one({
+                "id": "b1", "payment_status": "completed", "status": "confirmed",
+                "payment_history": [{"to": "completed", "reference": "evt-1"}]
+            })
+            replay = await server.apply_payment_status(db, {"id": "b1"}, "completed", "stripe", reference="evt-1")
+            duplicate = await server.apply_payment_status(db, {"id": "b1"}, "completed", "stripe", reference="evt-2")
+            return replay, duplicate, await db[BACKGROUND_JOBS_COLLECTION].find({}, {"_id": 0, "id": 1}).to_list(length=None)
+
+    replay, duplicate, queued = asyncio.run(scenario())
+    assert replay is None and duplicate is None
+    assert queued == [{"id": "notify_booking_paid:b1"}]
@@ -0,0 +1,132 @@
+import asyncio
+from datetime import timedelta
+
+import lifecycle
+from lifecycle import BOOKINGS_ARCHIVE, TRANSACTIONS_ARCHIVE, BookingArchiver, PendingBookingPolicy
+
+OLD = "2020-01-01T10:00:00+00:00"
+
+
+def booking(booking_id, payment_method="stripe", created_at=OLD, **fields):
+    return {
+        "id": booking_id, "cart_id": f"cart-{booking_id}", "customer_name": "Guest", "customer_email": "guest@example.com",
+        "booking_reference": f"EGF-{booking_id}", "status": "pending", "payment_status": "pending",
+        "payment_session_id": f"s-{booking_id}", "payment_method": payment_method, "total_amount": 100.0,
+        "created_at": created_at, "items": [], **fields
+    }
+
+
+def transaction(booking_id, payment_status="pending"):
+    return {
+        "id": f"t-{booking_id}", "booking_id": booking_id, "session_id": f"s-{booking_id}",
+        "payment_provider": "stripe", "payment_status": payment_status
+    }
+
+
+def archiver(db):
+    policy = PendingBookingPolicy(pending_for=timedelta(hours=48), pending_for_method={"venmo": timedelta(days=14)})
+    return BookingArchiver(lambda: db, policy)
+
+
+async def ids(collection):
+    return sorted([document["id"] async for document in collection.find({}, {"_id": 0, "id": 1})])
+
+
+def test_archive_moves_abandoned_bookings_with_their_transactions(db):
+    async def scenario():
+        await db.bookings.insert_many([
+            booking("b-old"),
+            booking("b-paid", payment_status="completed"),
+            booking("b-recent", created_at="2999-01-01T10:00:00+00:00"),
+        ])
+        await db.payment_transactions.insert_many([transaction("b-old"), transaction("b-paid", "completed")])
+        report = await archiver(db).archive()
+        archived = await db[BOOKINGS_ARCHIVE].find_one({"id": "b-old"}, {"_id": 0})
+        return report, await ids(db.bookings), archived, await ids(db[TRANSACTIONS_ARCHIVE])
+
+    report, hot, archived, archived_transactions = asyncio.run(scenario())
+    assert report == {"dry_run": False, "bookings": 1, "payment_transactions": 1}
+    assert hot == ["b-paid", "b-recent"]
+    assert archived["archive_reason"] == "pending_expired"
+    assert archived_transactions == ["t-b-old"]
+
+
+def test_booking_paid_mid_sweep_stays_in_bookings(db, monkeypatch):
+    move = lifecycle._move
+
+    async def paid_during_move(db, source, target, documents, guard, extra):
+        if source == "bookings":
+            # The webhook lands after the sweep read the batch but before it deletes it
+            await db.bookings.update_one({"id": "b-late"}, {"$set": {"payment_status": "completed"}})
+        return await move(db, source, target, documents, guard, extra)
+
+    monkeypatch.setattr(lifecycle, "_move", paid_during_move)
+
+    async def scenario():
+        await db.bookings.insert_many([booking("b-abandoned"), booking("b-late")])
+        await db.payment_transactions.insert_many([transaction("b-abandoned"), transaction("b-late")])
+        report = await archiver(db).archive()
+        return report, await ids(db.bookings), await ids(db[BOOKINGS_ARCHIVE]), await ids(db[TRANSACTIONS_ARCHIVE])
+
+    report, hot, archived, archived_transactions = asyncio.run(scenario())
+    assert report["bookings"] == 1
+    assert hot == ["b-late"]
+    assert archived == ["b-abandoned"]
+    assert archived_transactions == ["t-b-abandoned"]
+
+
+def test_manual_payments_get_their_own_age(db):
+    async def scenario():
+        await db.bookings.insert_many([
+            booking("b-venmo", payment_method="venmo", created_at="2999-01-01T10:00:00+00:00"),
+            booking("b-venmo-old", payment_method="venmo"),
+        ])
+        await archiver(db).archive()
+        return await ids(db.bookings)
+
+    assert asyncio.run(scenario()) == ["b-venmo"]
+
+
+def test_restore_strips_archive_fields_and_brings_transactions_back(db):
+    async def scenario():
+        await db.bookings.insert_one(booking("b1"))
+        await db.payment_transactions.insert_one(transaction("b1"))
+        store = archiver(db)
+        await store.archive()
+        restored = await store.restore({"payment_session_id": "s-b1"})
+        stored = await db.bookings.find_one({"id": "b1"}, {"_id": 0})
+        stored_transaction = await db.payment_transactions.find_one({"id": "t-b1"}, {"_id": 0})
+        left = (await ids(db[BOOKINGS_ARCHIVE]), await ids(db[TRANSACTIONS_ARCHIVE]))
+        # A restored booking isn't swept again straight away
+        again = await store.archive()
+        return restored, stored, stored_transaction, left, again
+
+    restored, stored, stored_transaction, left, again = asyncio.run(scenario())
+    assert restored == ["b1"]
+    assert "archived_at" not in stored and "archive_reason" not in stored
+    assert "restored_at" in stored
+    assert stored_transaction == transaction("b1")
+    assert left == ([], [])
+    assert again["bookings"] == 0
+
+
+def test_late_webhook_for_an_archived_booking_restores_and_completes_it(db, app_client):
+    import server
+
+    async def scenario():
+        async with app_client() as http:
+            await db.bookings.insert_one(booking("b1"))
+            await db.payment_transactions.insert_one(transaction("b1"))
+            await server.services["booking_archiver"].archive()
+            archived = await ids(db[BOOKINGS_ARCHIVE])
+            paid = await server.apply_payment_status(db, {"payment_session_id": "s-b1"}, "completed", "stripe", reference="evt-1")
+            stored = await db.bookings.find_one({"id": "b1"}, {"_id": 0})
+            stored_transaction = await db.payment_transactions.find_one({"id": "t-b1"}, {"_id": 0})
+            return archived, paid, stored, stored_transaction, await ids(db[BOOKINGS_ARCHIVE])
+
+    archived, paid, stored, stored_transaction, left = asyncio.run(scenario())
+    assert archived == ["b1"]
+    assert paid.id == "b1" and paid.payment_status == "completed"
+    assert stored["payment_status"] == stored_transaction["payment_status"] == "completed"
+    assert [entry["reference"] for entry in stored["payment_history"]] == ["evt-1"]
+    assert left == []
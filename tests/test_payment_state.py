@@ -0,0 +1,108 @@
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+import pytest
+
+from payment_state import sync_transaction_status, transition_payment, transition_payments_bulk
+from reconcile import PaymentReconciler
+from reporting import apply_booking_rollups, read_reports, reverse_booking_rollups
+
+
+def booking(booking_id, payment_status="pending", session_id=None):
+    return {
+        "id": booking_id, "status": "pending", "payment_status": payment_status, "payment_session_id": session_id,
+        "payment_method": "stripe", "total_amount": 100.0,
+        "items": [{"service_id": "crystal_kayak", "booking_date": "2030-06-02", "quantity": 2, "subtotal": 100.0}]
+    }
+
+
+def transaction(session_id, payment_status="pending"):
+    return {"id": f"t-{session_id}", "session_id": session_id, "payment_provider": "stripe", "payment_status": payment_status}
+
+
+@pytest.mark.parametrize("start, to_status, moves", [
+    ("pending", "completed", True),
+    ("failed", "completed", True),
+    ("pending", "failed", True),
+    ("completed", "refunded", True),
+    ("completed", "completed", False),
+    ("completed", "failed", False),
+    ("pending", "refunded", False),
+    ("refunded", "completed", False),
+])
+def test_transition_guard(db, start, to_status, moves):
+    async def scenario():
+        await db.bookings.insert_one(booking("b1", start, "s1"))
+        await db.payment_transactions.insert_one(transaction("s1", start))
+        moved = await transition_payment(db, {"id": "b1"}, to_status, "test", reference="r1")
+        stored = await db.bookings.find_one({"id": "b1"})
+        return moved, stored, await db.payment_transactions.find_one({"session_id": "s1"})
+
+    moved, stored, tx = asyncio.run(scenario())
+    if moves:
+        assert moved["payment_status"] == stored["payment_status"] == tx["payment_status"] == to_status
+        assert [entry["to"] for entry in stored["payment_history"]] == [to_status]
+    else:
+        assert moved is None
+        assert stored["payment_status"] == tx["payment_status"] == start
+        assert "payment_history" not in stored
+
+
+def test_unknown_status_is_rejected(db):
+    with pytest.raises(ValueError):
+        asyncio.run(transition_payment(db, {"id": "b1"}, "paid", "test"))
+
+
+def test_bulk_transition_moves_only_allowed_bookings(db):
+    async def scenario():
+        await db.bookings.insert_many([booking("b1", "pending", "s1"), booking("b2", "completed", "s2")])
+        await db.payment_transactions.insert_many([transaction("s1"), transaction("s2", "completed")])
+        moved = await transition_payments_bulk(db, [("b1", "r1"), ("b2", "r2"), ("missing", "r3")], "completed", "statement")
+        return moved, await db.bookings.find_one({"id": "b2"}), await db.payment_transactions.find_one({"session_id": "s1"})
+
+    moved, untouched, tx = asyncio.run(scenario())
+    assert moved == ["b1"]
+    assert "payment_history" not in untouched
+    assert tx["payment_status"] == "completed"
+
+
+def test_reconciler_repairs_a_transaction_left_behind(db):
+    async def lookup(session_id):
+        raise AssertionError("the provider shouldn't be asked about a booking that already moved")
+
+    async def scenario():
+        # The booking moved but the process stopped before the transaction's mirror write
+        await db.bookings.insert_one(booking("b1", "completed", "s1"))
+        await db.payment_transactions.insert_one(transaction("s1"))
+        reconciler = PaymentReconciler(lambda: db, {"stripe": lookup}, apply=None, bucket_store=None)
+        counts = defaultdict(lambda: defaultdict(int))
+        await reconciler._check(db, await db.payment_transactions.find_one({"session_id": "s1"}), counts)
+        again = await sync_transaction_status(db, "s1")
+        return counts, again, await db.payment_transactions.find_one({"session_id": "s1"})
+
+    counts, again, tx = asyncio.run(scenario())
+    assert counts["stripe"]["repaired"] == 1
+    assert again is None
+    assert tx["payment_status"] == "completed"
+    assert tx["reconcile_checks"] == 1
+
+
+def test_refund_takes_the_booking_out_of_the_rollups_once(db):
+    confirmed_at = datetime(2030, 6, 1, 15, tzinfo=timezone.utc)
+
+    async def scenario():
+        await db.bookings.insert_many([booking("b1", "completed"), booking("b2", "completed")])
+        for booking_id in ("b1", "b2"):
+            await apply_booking_rollups(db, booking_id, confirmed_at)
+        await transition_payment(db, {"id": "b1"}, "refunded", "paypal_webhook")
+        first = await reverse_booking_rollups(db, "b1")
+        second = await reverse_booking_rollups(db, "b1")
+        # A late confirmation side effect doesn't add the refunded booking back
+        late = await apply_booking_rollups(db, "b1", confirmed_at)
+        return first, second, late, await read_reports(db, date(2030, 6, 1), date(2030, 6, 2))
+
+    first, second, late, report = asyncio.run(scenario())
+    assert (first, second, late) == (True, False, False)
+    assert report["totals"] == {"revenue": 100.0, "bookings": 1, "guests": 2}
+    assert report["by_service"][0]["units"] == 1
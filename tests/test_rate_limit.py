@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from rate_limit import DEFAULT_POLICIES, MemoryBucketStore, RateLimiter, RateLimitPolicy
+
+
+def make_request(method="POST", path="/api/cart/c1/checkout", forwarded=None, peer="10.0.0.9"):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "method": method, "path": path, "headers": headers, "client": (peer, 1234)})
+
+
+def test_bucket_refills_and_rejects_without_going_negative():
+    async def scenario():
+        store = MemoryBucketStore()
+        takes = [await store.take("k", 2, 1.0, now=100.0) for _ in range(3)]
+        later = await store.take("k", 2, 1.0, now=101.0)
+        return takes, later
+
+    takes, later = asyncio.run(scenario())
+    assert [allowed for allowed, _ in takes] == [True, True, False]
+    assert takes[-1][1] == 0
+    assert later == (True, 0)
+
+
+@pytest.mark.parametrize("trusted_proxies, forwarded, expected", [
+    (0, "1.1.1.1", "10.0.0.9"),
+    (1, "6.6.6.6, 2.2.2.2", "2.2.2.2"),
+    (2, "6.6.6.6, 2.2.2.2, 172.16.0.1", "2.2.2.2"),
+    (2, "2.2.2.2", "2.2.2.2"),
+    (1, None, "10.0.0.9"),
+])
+def test_client_ip_takes_the_entry_added_by_the_outermost_trusted_proxy(trusted_proxies, forwarded, expected):
+    limiter = RateLimiter([], MemoryBucketStore(), trusted_proxies=trusted_proxies)
+    assert limiter.client_ip(make_request(forwarded=forwarded)) == expected
+
+
+def test_rejected_request_gives_back_tokens_taken_from_other_buckets():
+    policies = [
+        RateLimitPolicy("per_ip", "POST", "/api/cart/{cart_id}/checkout", capacity=5, refill_per_second=0.001),
+        RateLimitPolicy("per_cart", "POST", "/api/cart/{cart_id}/checkout", capacity=1, refill_per_second=0.001, key_by="cart_id"),
+    ]
+
+    async def scenario():
+        store = MemoryBucketStore()
+        limiter = RateLimiter(policies, store)
+        results = [await limiter.check(make_request()) for _ in range(3)]
+        return results, store._buckets["per_ip:10.0.0.9"][0]
+
+    results, ip_tokens = asyncio.run(scenario())
+    assert results[0] is None
+    assert results[1] is not None and results[2] is not None
+    # Only the one admitted request counts against the client's address
+    assert ip_tokens == pytest.approx(4, abs=0.01)
+
+
+def test_batch_cart_endpoint_is_limited():
+    matching = [policy.name for policy in DEFAULT_POLICIES if policy.match("POST", "/api/cart/c1/items:batch") is not None]
+    assert matching == ["cart_batch_ip"]
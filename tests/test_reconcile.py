@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from payment_state import transition_payment
+from rate_limit import MemoryBucketStore
+from reconcile import RECONCILE_RUNS_COLLECTION, PaymentReconciler
+
+
+def an_hour_ago(seconds=0):
+    return (datetime.now(timezone.utc) - timedelta(hours=1) + timedelta(seconds=seconds)).isoformat()
+
+
+def booking(session_id):
+    return {
+        "id": f"b-{session_id}", "status": "pending", "payment_status": "pending", "payment_session_id": session_id,
+        "payment_method": "stripe", "total_amount": 100.0, "items": []
+    }
+
+
+def transaction(session_id, created_at):
+    return {
+        "id": f"t-{session_id}", "booking_id": f"b-{session_id}", "session_id": session_id,
+        "payment_provider": "stripe", "payment_status": "pending", "created_at": created_at
+    }
+
+
+async def insert_pending(db, created_at_by_session):
+    await db.bookings.insert_many([booking(session_id) for session_id in created_at_by_session])
+    await db.payment_transactions.insert_many([
+        transaction(session_id, created_at) for session_id, created_at in created_at_by_session.items()
+    ])
+
+
+def reconciler(db, lookup, **options):
+    async def apply(session_id, to_status, source):
+        return await transition_payment(db, {"payment_session_id": session_id}, to_status, source, reference="reconcile")
+
+    return PaymentReconciler(lambda: db, {"stripe": lookup}, apply, MemoryBucketStore(), rate_per_second=1000, **options)
+
+
+def test_only_one_worker_sweeps_at_a_time(db):
+    async def scenario():
+        await insert_pending(db, {"s1": an_hour_ago()})
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_lookup(session_id):
+            started.set()
+            await release.wait()
+            return None
+
+        first_worker = reconciler(db, slow_lookup)
+        second_worker = reconciler(db, slow_lookup)
+        first = asyncio.create_task(first_worker.run())
+        await started.wait()
+        blocked = await second_worker.run()
+        release.set()
+        # The lease is released when the sweep ends
+        return blocked, await first, await second_worker.run()
+
+    blocked, first, after = asyncio.run(scenario())
+    assert blocked is None
+    assert first["checked"] == 1
+    assert after is not None
+
+
+def test_pages_on_created_at_then_id_while_rows_change(db):
+    same_time = an_hour_ago(-60)
+    created_at = {"s4": an_hour_ago(), "s2": same_time, "s1": same_time, "s3": same_time, "s5": an_hour_ago(-120)}
+    looked_up = []
+
+    async def lookup(session_id):
+        looked_up.append(session_id)
+        # Completed rows drop out of the pending query while later pages are read
+        return "completed"
+
+    async def scenario():
+        await insert_pending(db, created_at)
+        return await reconciler(db, lookup, batch_size=2).run()
+
+    report = asyncio.run(scenario())
+    assert looked_up == ["s5", "s1", "s2", "s3", "s4"]
+    assert report["checked"] == 5
+    assert report["providers"] == {"stripe": {"completed": 5}}
+
+
+def test_max_checks_caps_a_run_and_the_next_run_continues(db):
+    looked_up = []
+
+    async def lookup(session_id):
+        looked_up.append(session_id)
+        return None
+
+    async def scenario():
+        await insert_pending(db, {f"s{index}": an_hour_ago(index) for index in range(5)})
+        worker = reconciler(db, lookup, batch_size=2, max_checks=3)
+        first = await worker.run()
+        second = await worker.run()
+        runs = await db[RECONCILE_RUNS_COLLECTION].count_documents({"started_at": {"$exists": True}})
+        return first, second, runs
+
+    first, second, runs = asyncio.run(scenario())
+    assert (first["checked"], first["max_checks_reached"]) == (3, True)
+    assert (second["checked"], second["max_checks_reached"]) == (2, False)
+    assert looked_up == ["s0", "s1", "s2", "s3", "s4"]
+    assert runs == 2
+
+
+def test_webhook_that_lands_during_the_lookup_wins(db):
+    async def lookup(session_id):
+        # The webhook is applied while the provider call is in flight
+        await transition_payment(db, {"payment_session_id": session_id}, "completed", "stripe_webhook", reference="evt-1")
+        return "completed"
+
+    async def scenario():
+        await insert_pending(db, {"s1": an_hour_ago()})
+        report = await reconciler(db, lookup).run()
+        return report, await db.bookings.find_one({"id": "b-s1"}, {"_id": 0})
+
+    report, stored = asyncio.run(scenario())
+    assert report["providers"] == {"stripe": {"already_applied": 1}}
+    assert [entry["source"] for entry in stored["payment_history"]] == ["stripe_webhook"]
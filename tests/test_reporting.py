@@ -0,0 +1,56 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+from reporting import HOURLY, apply_booking_rollups, read_reports
+
+CONFIRMED_AT = datetime(2030, 6, 1, 15, 30, tzinfo=timezone.utc)
+BOOKING = {
+    "id": "b1", "status": "confirmed", "payment_method": "stripe", "total_amount": 300.0,
+    "items": [
+        {"service_id": "crystal_kayak", "name": "Crystal Kayak", "booking_date": "2030-06-02", "quantity": 2, "subtotal": 200.0},
+        {"service_id": "crystal_kayak", "name": "Crystal Kayak", "booking_date": "2030-06-02", "quantity": 1, "subtotal": 100.0},
+    ]
+}
+
+
+def test_rollups_count_a_booking_once_across_retries(db):
+    async def scenario():
+        await db.bookings.insert_one(dict(BOOKING))
+        first = await apply_booking_rollups(db, "b1", CONFIRMED_AT)
+        # A retry with a later clock still lands in the stored day/hour buckets
+        second = await apply_booking_rollups(db, "b1", datetime(2030, 6, 3, tzinfo=timezone.utc))
+        return first, second, await read_reports(db, date(2030, 6, 1), date(2030, 6, 3))
+
+    first, second, report = asyncio.run(scenario())
+    assert (first, second) == (True, False)
+    assert report["totals"] == {"revenue": 300.0, "bookings": 1, "guests": 3}
+    assert report["by_service"] == [{"day": "2030-06-02", "service_id": "crystal_kayak", "name": "Crystal Kayak",
+                                     "revenue": 300.0, "units": 2, "guests": 3}]
+
+
+def test_rollups_recover_after_a_crash_between_inc_and_mark(db, monkeypatch):
+    import reporting
+
+    write = reporting._bulk_write_counted_once
+
+    async def crash_on_hourly(db, collection, operations):
+        if collection == HOURLY:
+            raise RuntimeError("process died")
+        await write(db, collection, operations)
+
+    async def scenario():
+        await db.bookings.insert_one(dict(BOOKING))
+        monkeypatch.setattr(reporting, "_bulk_write_counted_once", crash_on_hourly)
+        try:
+            await apply_booking_rollups(db, "b1", CONFIRMED_AT)
+        except RuntimeError:
+            pass
+        monkeypatch.setattr(reporting, "_bulk_write_counted_once", write)
+        marked = (await db.bookings.find_one({"id": "b1"})).get("rollup_applied", False)
+        retried = await apply_booking_rollups(db, "b1")
+        return marked, retried, await read_reports(db, date(2030, 6, 1), date(2030, 6, 3))
+
+    marked, retried, report = asyncio.run(scenario())
+    assert marked is False and retried is True
+    assert report["totals"] == {"revenue": 300.0, "bookings": 1, "guests": 3}
+    assert [row["hour"] for row in report["by_hour"]] == [15]
@@ -0,0 +1,87 @@
+import asyncio
+
+from statements import extract_booking_reference, import_statement, parse_amount
+
+VENMO_EXPORT = (
+    "Account Statement - (@egf)\n"
+    "ID,Datetime,Type,Status,Note,From,To,Amount (total)\n"
+    '1001,2030-06-01T10:00:00,Payment,Complete,"Float egf-20300601-a1b2c3",Ann,EGF,"+ $150.00"\n'
+    '1002,2030-06-01T11:00:00,Payment,Complete,"EGF20300601D4E5F6",Bob,EGF,"+ $150.00"\n'
+    '1003,2030-06-01T12:00:00,Payment,Complete,"EGF20300601AAAAAA",Cy,EGF,"+ $99.00"\n'
+    '1004,2030-06-01T13:00:00,Payment,Complete,"thanks!",Di,EGF,"+ $20.00"\n'
+    '1005,2030-06-01T14:00:00,Payment,Complete,"refund",EGF,Ed,"- $20.00"\n'
+)
+
+
+def booking(reference, payment_method, total=150.0, payment_status="pending"):
+    return {
+        "id": f"id-{reference}", "booking_reference": reference, "payment_method": payment_method,
+        "total_amount": total, "status": "pending", "payment_status": payment_status
+    }
+
+
+async def chunks(text, size=17):
+    data = text.encode()
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_reference_and_amount_parsing():
+    assert extract_booking_reference("paid egf 20300601-a1b2c3 thx") == "EGF20300601A1B2C3"
+    assert extract_booking_reference("no reference") is None
+    assert parse_amount("+ $1,250.00") == 1250.0
+    assert parse_amount("(20.00)") == -20.0
+    assert parse_amount("") is None
+
+
+def test_import_matches_on_reference_and_payment_method(db):
+    async def scenario():
+        await db.bookings.insert_many([
+            booking("EGF20300601A1B2C3", "venmo"),
+            # Right reference and amount, but checked out with Stripe
+            booking("EGF20300601D4E5F6", "stripe"),
+            booking("EGF20300601AAAAAA", "venmo"),
+        ])
+        report = await import_statement(db, chunks(VENMO_EXPORT), "venmo")
+        statuses = {doc["id"]: doc["payment_status"] async for doc in db.bookings.find({}, {"_id": 0})}
+        return report, statuses
+
+    report, statuses = asyncio.run(scenario())
+    assert report["rows"] == 4
+    assert report["confirmed_booking_ids"] == ["id-EGF20300601A1B2C3"]
+    assert report["outcomes"] == {"matched": 1, "unmatched": 1, "amount_mismatch": 1, "no_reference": 1, "changed_during_import": 0}
+    assert statuses == {
+        "id-EGF20300601A1B2C3": "completed",
+        "id-EGF20300601D4E5F6": "pending",
+        "id-EGF20300601AAAAAA": "pending",
+    }
+    assert {row["outcome"] for row in report["exceptions"]} == {"unmatched", "amount_mismatch", "no_reference"}
+
+
+def test_dry_run_changes_nothing(db):
+    async def scenario():
+        await db.bookings.insert_one(booking("EGF20300601A1B2C3", "venmo"))
+        report = await import_statement(db, chunks(VENMO_EXPORT), "venmo", dry_run=True)
+        return report, await db.bookings.find_one({}, {"_id": 0})
+
+    report, stored = asyncio.run(scenario())
+    assert report["confirmed"] == 0 and report["outcomes"]["matched"] == 1
+    assert stored["payment_status"] == "pending"
+
+
+def test_import_endpoint_queues_one_payment_follow_up_per_booking(db, app_client, monkeypatch):
+    import server
+    from jobs import BACKGROUND_JOBS_COLLECTION
+
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "s3cret")
+
+    async def scenario():
+        async with app_client() as http:
+            await db.bookings.insert_one(booking("EGF20300601A1B2C3", "venmo"))
+            for _ in range(2):
+                response = await http.post("/api/admin/payments/import?method=venmo", content=VENMO_EXPORT.encode(),
+                                           headers={"Authorization": "Bearer s3cret"})
+                assert response.status_code == 200
+            return [job["id"] async for job in db[BACKGROUND_JOBS_COLLECTION].find({}, {"_id": 0, "id": 1})]
+
+    assert asyncio.run(scenario()) == ["notify_booking_paid:id-EGF20300601A1B2C3"]
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import waiver_pdf
+from waiver_pdf import WaiverPdfPipeline, waiver_content_digest
+
+WAIVER = {"id": "w1", "cart_id": "c1", "waiver_data": {}, "guests": [], "signed_at": "2030-06-01T10:00:00", "total_guests": 0}
+
+
+def make_pipeline(tmp_path, monkeypatch, delay):
+    renders = []
+
+    def fake_render(waiver):
+        renders.append(waiver["id"])
+        time.sleep(delay)
+        return b"%PDF-fake"
+
+    monkeypatch.setattr(waiver_pdf, "render_waiver_pdf", fake_render)
+    pipeline = WaiverPdfPipeline(tmp_path)
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(pipeline, "_get_executor", lambda: executor)
+    return pipeline, renders
+
+
+def test_concurrent_renders_of_one_waiver_share_a_render(tmp_path, monkeypatch):
+    pipeline, renders = make_pipeline(tmp_path, monkeypatch, delay=0.1)
+
+    async def scenario():
+        return await asyncio.gather(*(pipeline.render(dict(WAIVER)) for _ in range(3)))
+
+    digests = asyncio.run(scenario())
+    assert digests == [waiver_content_digest(WAIVER)] * 3
+    assert renders == ["w1"]
+    assert pipeline.cache.exists(digests[0])
+
+
+def test_follower_takes_over_when_the_leader_is_cancelled(tmp_path, monkeypatch):
+    pipeline, renders = make_pipeline(tmp_path, monkeypatch, delay=0.2)
+
+    async def scenario():
+        leader = asyncio.create_task(pipeline.render(dict(WAIVER)))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(pipeline.render(dict(WAIVER)))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        digest = await asyncio.wait_for(follower, timeout=5)
+        await pipeline.shutdown()
+        return digest, leader.cancelled()
+
+    digest, leader_cancelled = asyncio.run(scenario())
+    assert leader_cancelled
+    assert digest == waiver_content_digest(WAIVER)
+    assert len(renders) == 2
+    assert pipeline._inflight == {}
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from webhook_inbox import WEBHOOK_INBOX_COLLECTION, WebhookInbox, ensure_inbox_indexes
+
+
+def iso(delta_seconds=0.0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=delta_seconds)).isoformat()
+
+
+def stored_event(event_id, ordering_key="s1", received_at=None, **fields):
+    return {
+        "id": event_id, "provider": "stripe", "event_id": event_id, "event_type": "checkout.session.completed",
+        "ordering_key": ordering_key, "payload": {}, "status": "pending", "attempts": 0,
+        "received_at": received_at or iso(), "next_attempt_at": iso(-1), **fields
+    }
+
+
+async def wait_for_status(db, status, count, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if await db[WEBHOOK_INBOX_COLLECTION].count_documents({"status": status}) >= count:
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"events did not reach {status}")
+
+
+def test_events_for_one_booking_are_processed_in_order(db):
+    handled = []
+
+    async def handler(event):
+        await asyncio.sleep(0.01)
+        handled.append(event["event_id"])
+
+    async def scenario():
+        await ensure_inbox_indexes(db)
+        inbox = WebhookInbox(lambda: db, {"stripe": handler}, workers=3, poll_interval=0.05).start()
+        for index in range(4):
+            assert await inbox.record("stripe", f"evt-{index}", "checkout.session.completed", "s1", {})
+        assert not await inbox.record("stripe", "evt-0", "checkout.session.completed", "s1", {})
+        await wait_for_status(db, "processed", 4)
+        await inbox.close()
+
+    asyncio.run(scenario())
+    assert handled == ["evt-0", "evt-1", "evt-2", "evt-3"]
+
+
+def test_event_behind_an_open_earlier_one_waits_without_writes(db):
+    async def scenario():
+        inbox = WebhookInbox(lambda: db, {})
+        # The earlier event is being handled by another process
+        await db[WEBHOOK_INBOX_COLLECTION].insert_many([
+            stored_event("evt-1", received_at=iso(-2), status="processing", claimed_at=iso(), claimed_by="other"),
+            stored_event("evt-2", received_at=iso(-1)),
+        ])
+        before = await db[WEBHOOK_INBOX_COLLECTION].find_one({"id": "evt-2"}, {"_id": 0})
+        claimed = await inbox._claim({"id": "evt-2", "ordering_key": "s1", "received_at": before["received_at"]})
+        after = await db[WEBHOOK_INBOX_COLLECTION].find_one({"id": "evt-2"}, {"_id": 0})
+        return claimed, before, after
+
+    claimed, before, after = asyncio.run(scenario())
+    assert claimed is None
+    assert after == before
+
+
+def test_processing_event_is_taken_over_only_after_its_lease(db):
+    async def scenario():
+        inbox = WebhookInbox(lambda: db, {}, lease=timedelta(minutes=5))
+        await db[WEBHOOK_INBOX_COLLECTION].insert_many([
+            stored_event("fresh", ordering_key="a", status="processing", claimed_at=iso(), claimed_by="other"),
+            stored_event("stale", ordering_key="b", status="processing", claimed_at=iso(-600), claimed_by="dead"),
+        ])
+        fresh = await inbox._claim({"id": "fresh", "ordering_key": "a", "received_at": iso()})
+        stale = await inbox._claim({"id": "stale", "ordering_key": "b", "received_at": iso()})
+        return fresh, stale, inbox.owner
+
+    fresh, stale, owner = asyncio.run(scenario())
+    assert fresh is None
+    assert stale["claimed_by"] == owner
+
+
+def test_failed_handler_backs_off_and_parks_after_max_attempts(db):
+    async def handler(event):
+        raise RuntimeError("provider down")
+
+    async def scenario():
+        inbox = WebhookInbox(lambda: db, {"stripe": handler}, max_attempts=2)
+        await db[WEBHOOK_INBOX_COLLECTION].insert_one(stored_event("evt-1"))
+        states = []
+        for _ in range(2):
+            event = await inbox._claim({"id": "evt-1", "ordering_key": "s1", "received_at": iso()})
+            await inbox._process(event)
+            await db[WEBHOOK_INBOX_COLLECTION].update_one({"id": "evt-1"}, {"$set": {"next_attempt_at": iso(-1)}})
+            stored = await db[WEBHOOK_INBOX_COLLECTION].find_one({"id": "evt-1"})
+            states.append((stored["status"], stored["attempts"]))
+        return states
+
+    assert asyncio.run(scenario()) == [("pending", 1), ("failed", 2)]
+
+
+def test_drain_returns_cut_off_events_to_pending(db):
+    async def scenario():
+        running = asyncio.Event()
+
+        async def handler(event):
+            running.set()
+            await asyncio.sleep(10)
+
+        inbox = WebhookInbox(lambda: db, {"stripe": handler}, workers=1, poll_interval=0.05).start()
+        await inbox.record("stripe", "evt-1", "checkout.session.completed", "s1", {})
+        await asyncio.wait_for(running.wait(), timeout=5)
+        report = await inbox.drain(timeout=0.05)
+        return report, await db[WEBHOOK_INBOX_COLLECTION].find_one({"event_id": "evt-1"})
+
+    report, stored = asyncio.run(scenario())
+    assert report == {"cut_off": 1}
+    assert stored["status"] == "pending"
+    assert "claimed_by" not in stored
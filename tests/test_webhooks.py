@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from webhook_inbox import WEBHOOK_INBOX_COLLECTION
+
+WEBHOOK_ID = "WH-TEST"
+SIGNATURE_HEADERS = {
+    "PAYPAL-AUTH-ALGO": "SHA256withRSA",
+    "PAYPAL-CERT-URL": "https://api.paypal.com/v1/notifications/certs/CERT-1",
+    "PAYPAL-TRANSMISSION-ID": "tx-1",
+    "PAYPAL-TRANSMISSION-SIG": "sig",
+    "PAYPAL-TRANSMISSION-TIME": "2030-06-01T10:00:00Z",
+}
+EVENT = {"id": "WH-EVT-1", "event_type": "PAYMENT.SALE.COMPLETED", "resource": {"parent_payment": "PAY-1"}}
+
+
+class FakePayPalApi:
+    def __init__(self, status="SUCCESS"):
+        self.status = status
+        self.requests = []
+
+    def post(self, path, body):
+        self.requests.append((path, body))
+        if isinstance(self.status, Exception):
+            raise self.status
+        return {"verification_status": self.status}
+
+
+@pytest.fixture
+def paypal_api(monkeypatch):
+    import server
+
+    api = FakePayPalApi()
+    monkeypatch.setattr(server, "PAYPAL_WEBHOOK_ID", WEBHOOK_ID)
+    server.services.register("paypal", lambda: api, lazy=True)
+    yield api
+    server.services.register("paypal", server.configure_paypal, lazy=True)
+
+
+def deliver(db, app_client, event, headers):
+    async def scenario():
+        async with app_client() as http:
+            response = await http.post("/api/webhook/paypal", json=event, headers=headers)
+            stored = await db[WEBHOOK_INBOX_COLLECTION].find({}, {"_id": 0}).to_list(length=None)
+        return response.status_code, stored
+
+    return asyncio.run(scenario())
+
+
+def test_verified_paypal_event_is_stored_as_received(db, app_client, paypal_api):
+    status, stored = deliver(db, app_client, EVENT, SIGNATURE_HEADERS)
+    assert status == 200
+    assert [(event["event_id"], event["ordering_key"], event["payload"]) for event in stored] == [("WH-EVT-1", "PAY-1", EVENT)]
+    [(path, body)] = paypal_api.requests
+    assert path == "v1/notifications/verify-webhook-signature"
+    assert body["webhook_id"] == WEBHOOK_ID
+    assert body["webhook_event"] == EVENT
+    assert body["transmission_id"] == "tx-1"
+
+
+@pytest.mark.parametrize("event, headers, verification", [
+    ({key: value for key, value in EVENT.items() if key != "id"}, SIGNATURE_HEADERS, "SUCCESS"),
+    (EVENT, {key: value for key, value in SIGNATURE_HEADERS.items() if key != "PAYPAL-TRANSMISSION-SIG"}, "SUCCESS"),
+    (EVENT, SIGNATURE_HEADERS, "FAILURE"),
+])
+def test_unidentified_or_unverified_paypal_event_is_rejected(db, app_client, paypal_api, event, headers, verification):
+    paypal_api.status = verification
+    status, stored = deliver(db, app_client, event, headers)
+    assert status == 400
+    assert stored == []
+
+
+def test_paypal_event_is_retried_when_verification_is_unavailable(db, app_client, paypal_api):
+    paypal_api.status = RuntimeError("PayPal unreachable")
+    status, stored = deliver(db, app_client, EVENT, SIGNATURE_HEADERS)
+    assert status == 503
+    assert stored == []
+
+
+def test_paypal_event_is_rejected_without_a_webhook_id(db, app_client, paypal_api, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "PAYPAL_WEBHOOK_ID", None)
+    status, stored = deliver(db, app_client, EVENT, SIGNATURE_HEADERS)
+    assert status == 400
+    assert paypal_api.requests == []
+
+
+@pytest.mark.parametrize("payload, expected", [
+    ({"id": "evt_1", "type": "checkout.session.completed",
+      "data": {"object": {"object": "checkout.session", "id": "cs_1", "payment_status": "paid"}}}, ("cs_1", "paid")),
+    ({"id": "evt_2", "type": "charge.refunded", "data": {"object": {"object": "charge", "id": "ch_1"}}}, (None, None)),
+    ({"session_id": "cs_2", "payment_status": "unpaid"}, ("cs_2", "unpaid")),
+])
+def test_stripe_event_session_reads_raw_and_legacy_payloads(payload, expected):
+    import server
+
+    assert server.stripe_event_session(payload) == expected